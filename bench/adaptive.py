@@ -0,0 +1,53 @@
+# adaptive.py
+# Measures adaptive quickening on code whose operand types can't be inferred statically.
+from bench.common import *
+
+POLYMORPHIC = '''
+combine { +; }
+smaller { <; }
+
+main {
+    8000 .n;
+    n 0 >;
+    loop {
+        .@;
+        n n combine .@;
+        "a" "b" combine .@;
+        n 1 smaller .@;
+        'a 'b smaller .@;
+        n 1 - .n;
+        n 0 >;
+    }
+    .@;
+}
+'''
+
+MONOMORPHIC = '''
+step { .x x x * x 1 + -; }
+
+main {
+    8000 .n;
+    n 0 >;
+    loop {
+        .@;
+        n step step .@;
+        n 1 - .n;
+        n 0 >;
+    }
+    .@;
+}
+'''
+
+
+def main():
+    header('interpreter', 'adaptive')
+    for name, source in [('polymorphic call sites', POLYMORPHIC), ('monomorphic call sites', MONOMORPHIC)]:
+        # keep the helpers out of line so their operand types stay unknown to the compiler
+        fun_table = compile_source(source, inline_threshold=0)
+        baseline = time_run(fun_table)
+        adaptive = time_run(fun_table, adaptive=True)
+        report(name, baseline, adaptive)
+
+
+if __name__ == '__main__':
+    main()
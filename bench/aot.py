@@ -0,0 +1,70 @@
+# aot.py
+# Compares running a program with `sbl` against running the module `sbl compile` makes of it, both from a fresh process
+# (startup included) and in-process (steady state).
+import os
+import subprocess
+import sys
+import tempfile
+
+from bench.common import *
+from sbl.vm.aot import ModuleWriter
+
+SOURCE = '''
+fib { ^ 2 <; br { .@; } el { .@ .n n 1 - fib n 2 - fib +; } }
+main { 15 fib println; }
+'''
+
+RUN_SBL = "import sys; sys.argv = ['sbl'] + sys.argv[1:]; from sbl.sbl import main; main()"
+
+
+def time_process(args: List[str], repeat: int=5) -> float:
+    """
+    Runs a command several times, discarding its output.
+    :return: the fastest wall time, in seconds.
+    """
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(args, env=env, stdout=subprocess.DEVNULL, check=True)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def time_module(module: dict, repeat: int=5) -> float:
+    best = None
+    for _ in range(repeat):
+        runtime = module['Runtime'](module['FUNS'])
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            module['run'](runtime)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    header('sbl', 'compiled')
+    fun_table = compile_source(SOURCE)
+    module_source = ModuleWriter(fun_table, 'bench').write()
+    with tempfile.TemporaryDirectory() as tmp:
+        sbl_path = os.path.join(tmp, 'fib.sbl')
+        module_path = os.path.join(tmp, 'fib.py')
+        with open(sbl_path, 'w') as fp:
+            fp.write(SOURCE)
+        with open(module_path, 'w') as fp:
+            fp.write(module_source)
+        # run once so both start from warm bytecode caches
+        time_process([sys.executable, module_path], repeat=1)
+        report('fib 15, startup included', time_process([sys.executable, '-c', RUN_SBL, sbl_path]),
+               time_process([sys.executable, module_path]))
+    module = {'__name__': 'fib'}
+    exec(compile(module_source, 'fib.py', 'exec'), module)
+    report('fib 15, steady state', time_run(fun_table), time_module(module))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+# arrays.py
+# Compares summing and scaling a local stack one item at a time against doing the same with array builtins.
+from bench.common import *
+from sbl.vm import arrays
+
+N = 20000
+
+# builds the stack with a loop, then scales every item by 3 into a new stack and sums that
+STACK = f'''
+main {{
+    [] .s 0 .i; i {N} <; loop {{ .@ s i push .s i 1 + .i; i {N} <; }} .@
+    [] .t; s len .n .@; n 0 >; loop {{ .@ s pop 3 * .x .s t x push .t n 1 - .n; n 0 >; }} .@
+    0 .total; t len .n .@; n 0 >; loop {{ .@ t pop total + .total .t n 1 - .n; n 0 >; }} .@;
+}}
+'''
+
+ARRAY = f'''
+main {{ 0 {N} range 3 * sum .@; }}
+'''
+
+
+def main():
+    header('stack', 'array')
+    baseline = time_run(compile_source(STACK), repeat=3)
+    backends = [False, True] if arrays.numpy is not None else [False]
+    for use_numpy in backends:
+        arrays.USE_NUMPY = use_numpy
+        vectorized = time_run(compile_source(ARRAY), repeat=3)
+        report(f"sum of {N} scaled items ({'numpy' if use_numpy else 'array'})", baseline, vectorized)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+# batch.py
+# Compares starting `sbl` once per program against running the same programs with `sbl batch`, which starts its
+# workers once and parses shared imports once per worker.
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.common import *
+
+PROGRAMS = 24
+
+# identifiers can't have digits in them
+NAMES = [f"helper{a}{b}" for a in 'abcdefghij' for b in 'abcdefghijklmnopqrst']
+LIB = 'square { ^ *; }\n' + ''.join(f"{name} {{ {i} +; }}\n" for i, name in enumerate(NAMES))
+PROGRAM = 'import "lib.sbl"; main { 0 .i; i 100 <; loop { .@ i square helperah .@ i 1 + .i; i 100 <; } .@; }'
+
+
+def run(argv: List[str], env: dict) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', "import sys; from sbl.sbl import main; sys.argv[0] = 'sbl'; main()"] + argv,
+                   env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'lib.sbl'), 'w') as fp:
+            fp.write(LIB)
+        paths = []
+        for i in range(PROGRAMS):
+            paths += [os.path.join(tmp, f"p{i}.sbl")]
+            with open(paths[-1], 'w') as fp:
+                fp.write(PROGRAM)
+        env = dict(os.environ, SBL_PATH=tmp, PYTHONPATH=os.getcwd())
+        each = sum(run([path], env) for path in paths)
+        batch = run(['batch', '-j', str(os.cpu_count() or 1)] + paths, env)
+    header('sbl each', 'sbl batch')
+    report(f"{PROGRAMS} programs", each, batch)
+
+
+if __name__ == '__main__':
+    main()
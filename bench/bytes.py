@@ -0,0 +1,33 @@
+# bytes.py
+# Compares taking windows of a payload as slices of a character stack against slices of bytes, which share the
+# payload's memory instead of copying it.
+from bench.common import *
+
+SIZE = 64 * 1024
+WINDOW = 16 * 1024
+STEP = 256
+PAYLOAD = 'x' * SIZE
+
+STACK = f'''
+main {{
+    "{PAYLOAD}" chars .s 0 .i; i {SIZE - WINDOW} <;
+    loop {{ .@ s i i {WINDOW} + slice len .n .@ .@ i {STEP} + .i; i {SIZE - WINDOW} <; }} .@;
+}}
+'''
+
+BYTES = f'''
+main {{
+    "{PAYLOAD}" bytes .s 0 .i; i {SIZE - WINDOW} <;
+    loop {{ .@ s i i {WINDOW} + slice len .n .@ .@ i {STEP} + .i; i {SIZE - WINDOW} <; }} .@;
+}}
+'''
+
+
+def main():
+    header('stack', 'bytes')
+    report(f"{(SIZE - WINDOW) // STEP} windows of {WINDOW // 1024} KB", time_run(compile_source(STACK), repeat=3),
+           time_run(compile_source(BYTES), repeat=3))
+
+
+if __name__ == '__main__':
+    main()
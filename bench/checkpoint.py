@@ -0,0 +1,58 @@
+# checkpoint.py
+# Measures saving and loading a checkpoint of a program with a million items on its global stack, against pickling the
+# same values, and what running with a checkpoint file (but never saving to it) costs a loop with calls.
+import os
+import pickle
+import tempfile
+import time
+
+from bench.common import *
+from sbl.vm.checkpoint import Checkpoint
+
+N = 10 ** 6
+
+LOOP = '''
+step { 1 +; }
+main { 0 .i 0 .total; i 20000 <; loop { .@ total i step + .total i 1 + .i; i 20000 <; } .@ total println; }
+'''
+
+
+def best_of(fn: Callable[[], Any], repeat: int=2) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    fun_table = compile_source(LOOP, inline_threshold=0)
+    stack = [Val(i, ValType.INT) for i in range(N)]
+    stack += [Val([Val('x', ValType.STRING)] * 10, ValType.STACK) for _ in range(1000)]
+    frames = [('main', '<init>', 0, {'total': Val(0, ValType.INT)})]
+    checkpoint = Checkpoint(stack, frames)
+    with tempfile.TemporaryDirectory() as tmp:
+        pickled = os.path.join(tmp, 'pickled')
+        path = os.path.join(tmp, 'checkpoint')
+
+        def dump():
+            with open(pickled, 'wb') as fp:
+                pickle.dump((stack, frames), fp, protocol=pickle.HIGHEST_PROTOCOL)
+
+        def load():
+            with open(pickled, 'rb') as fp:
+                pickle.load(fp)
+
+        header('pickle', 'checkpoint')
+        report(f"save {N} items", best_of(dump), best_of(lambda: checkpoint.write(path, fun_table)))
+        report(f"load {N} items", best_of(load), best_of(lambda: Checkpoint.read(path, fun_table)))
+        print(f"{'file size'.ljust(40)} {os.path.getsize(pickled) // 1024:10}KB {os.path.getsize(path) // 1024:10}KB")
+        header('plain', 'checkpointed')
+        report('loop with calls', time_run(fun_table, 3), time_run(fun_table, 3, checkpoint=path))
+
+
+if __name__ == '__main__':
+    main()
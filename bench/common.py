@@ -0,0 +1,43 @@
+# common.py
+# Helpers shared by the benchmarks. Run a benchmark from the repository root, e.g. `python -m bench.inline`.
+import io
+import time
+from contextlib import redirect_stdout
+
+from sbl.syntax.prepro import *
+from sbl.vm.vm import *
+
+
+def compile_source(source: str, path: str='bench', **options) -> FunTable:
+    """
+    Compiles SBL source text into a function table.
+    :param options: extra keyword arguments passed to the compiler.
+    """
+    ast = Parser(source, path).parse()
+    ast += Preprocess(path, [], ast).preprocess()
+    return Compiler(ast, {'file': path}, **options).compile()
+
+
+def time_run(fun_table: FunTable, repeat: int=5, vm_class=VM, **options) -> float:
+    """
+    Runs a compiled program several times, discarding its output.
+    :return: the fastest wall time, in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        vm = vm_class(fun_table, **options)
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            vm.run()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def report(name: str, baseline: float, candidate: float):
+    print(f"{name.ljust(40)} {baseline * 1000:10.2f}ms {candidate * 1000:10.2f}ms {baseline / candidate:6.2f}x")
+
+
+def header(baseline: str, candidate: str):
+    print(f"{'benchmark'.ljust(40)} {baseline.rjust(12)} {candidate.rjust(12)} speedup")
@@ -0,0 +1,40 @@
+# files.py
+# Compares reading a big binary file by copying it into memory, either in chunks or all at once, against memory-mapping
+# it with `readall`.
+import os
+import tempfile
+
+from bench.common import *
+from sbl.vm import files
+
+SIZE = 32 * 1024 * 1024
+CHUNK = 64 * 1024
+
+CHUNKS = '''
+main { "PATH" "rb" open CHUNK read; loop { .@ CHUNK read; } .2; }
+'''.replace('CHUNK', str(CHUNK))
+
+READALL = '''
+main { "PATH" "rb" open readall len .2 .@; }
+'''
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'data.bin')
+        with open(path, 'wb') as fp:
+            fp.write(os.urandom(SIZE))
+        threshold = files.MMAP_THRESHOLD
+        header('copied', 'mapped')
+        readall = compile_source(READALL.replace('PATH', path))
+        files.MMAP_THRESHOLD = SIZE + 1
+        chunks = time_run(compile_source(CHUNKS.replace('PATH', path)), repeat=3)
+        copied = time_run(readall, repeat=3)
+        files.MMAP_THRESHOLD = threshold
+        mapped = time_run(readall, repeat=3)
+        report(f"{SIZE // CHUNK} reads of {CHUNK // 1024} KB", chunks, mapped)
+        report(f"readall of {SIZE // (1024 * 1024)} MB", copied, mapped)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+# inline.py
+# Measures the call overhead saved by inlining small functions.
+from bench.common import *
+
+SOURCE = '''
+square { ^ *; }
+inc { 1 +; }
+swap { .a .b a b; }
+
+main {
+    20000 .n;
+    n 0 >;
+    loop {
+        .@;
+        n square inc .@;
+        n 1 swap .@ .@;
+        n 1 - .n;
+        n 0 >;
+    }
+    .@;
+}
+'''
+
+
+def main():
+    header('no inlining', 'inlining')
+    baseline = time_run(compile_source(SOURCE, inline_threshold=0))
+    inlined = time_run(compile_source(SOURCE))
+    report('small helpers in a loop', baseline, inlined)
+
+
+if __name__ == '__main__':
+    main()
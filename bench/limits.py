@@ -0,0 +1,27 @@
+# limits.py
+# Compares running without limits against running with limits set (but never reached), to show what checking them on
+# calls and loops costs. Setting every limit is the worst case; an instruction limit alone is the common one.
+from bench.common import *
+from sbl.vm.pyjit import JitVM
+from sbl.vm.regvm import RegVM
+
+LOOP = '''
+step { 1 +; }
+main { 0 .i 0 .total; i 20000 <; loop { .@ total i step + .total i 1 + .i; i 20000 <; } .@ total println; }
+'''
+
+LIMITS = Limits(instructions=10 ** 12, stack=10 ** 6, depth=10 ** 4, time=3600)
+INSTRUCTIONS = Limits(instructions=10 ** 12)
+
+
+def main():
+    fun_table = compile_source(LOOP, inline_threshold=0)
+    header('no limits', 'limits')
+    for vm_class in [VM, JitVM, RegVM]:
+        plain = time_run(fun_table, vm_class=vm_class)
+        report(f"loop with calls ({vm_class.__name__})", plain, time_run(fun_table, vm_class=vm_class, limits=LIMITS))
+        report("  instructions only", plain, time_run(fun_table, vm_class=vm_class, limits=INSTRUCTIONS))
+
+
+if __name__ == '__main__':
+    main()
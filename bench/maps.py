@@ -0,0 +1,33 @@
+# maps.py
+# Compares keyed lookups through a linear scan over a local stack of pairs against lookups in a map.
+from bench.common import *
+
+# `ks` and `vs` are parallel stacks, so a lookup scans `ks` for the index of the key
+SCAN = '''
+find { .k .ks 0 .i; ks i get k !=; loop { .@ .@ i 1 + .i; ks i get k !=; } .@ .@ i; }
+lookup { .k .vs .ks ks k find .i vs i get .v .@ v; }
+main {
+    [] .ks [] .vs 0 .i; i {n} <; loop { .@ ks i push .ks vs i i * push .vs i 1 + .i; i {n} <; } .@
+    0 .total 0 .i; i {n} <; loop { .@ ks vs i lookup total + .total i 1 + .i; i {n} <; } .@;
+}
+'''
+
+MAP = '''
+main {
+    () .m 0 .i; i {n} <; loop { .@ m i i i * put .m i 1 + .i; i {n} <; } .@
+    0 .total 0 .i; i {n} <; loop { .@ m i get .v .@ v total + .total i 1 + .i; i {n} <; } .@;
+}
+'''
+
+
+def main():
+    header('scan', 'map')
+    for n in [10, 100, 400]:
+        # keyed lookups are O(n) for the scan, and O(1) for the map
+        scan = time_run(compile_source(SCAN.replace('{n}', str(n))), repeat=3)
+        table = time_run(compile_source(MAP.replace('{n}', str(n))), repeat=3)
+        report(f"{n} keys, {n} lookups", scan, table)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,20 @@
+# memo.py
+# Measures memoization of pure recursive functions.
+from bench.common import *
+
+SOURCE = '''
+fib { ^ 2 <; br { .@; } el { .@ .n n 1 - fib n 2 - fib +; } }
+main { 18 fib .@; }
+'''
+
+
+def main():
+    header('no memo', 'memo')
+    fun_table = compile_source(SOURCE)
+    baseline = time_run(fun_table, repeat=3)
+    memoized = time_run(fun_table, repeat=3, memo_size=1024)
+    report('fib 18', baseline, memoized)
+
+
+if __name__ == '__main__':
+    main()
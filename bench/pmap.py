@@ -0,0 +1,26 @@
+# pmap.py
+# Compares mapping a CPU-bound function over a stack in this process against spreading it across worker processes.
+# The speedup depends on how many CPUs there are.
+import os
+
+from bench.common import *
+
+ITEMS = 64
+WORK = 500
+
+SCORE = '''
+score { .n 0 .total 0 .i; i WORK <; loop { .@ total i n * + .total i 1 + .i; i WORK <; } .@ total; }
+main { [] .items 0 .i; i ITEMS <; loop { .@ items i push .items i 1 + .i; i ITEMS <; } .@ items "score" pmap .@; }
+'''.replace('WORK', str(WORK)).replace('ITEMS', str(ITEMS))
+
+
+def main():
+    workers = os.cpu_count() or 1
+    fun_table = compile_source(SCORE)
+    header('1 process', f"{workers} workers")
+    report(f"score {ITEMS} items", time_run(fun_table, repeat=3, workers=1),
+           time_run(fun_table, repeat=3, workers=workers))
+
+
+if __name__ == '__main__':
+    main()
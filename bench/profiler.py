@@ -0,0 +1,35 @@
+# profiler.py
+# Measures what profiling costs a program that makes a lot of calls. The plain VM has no profiling code in it at all;
+# sampling runs it as it is, and timing every call goes through ProfilingVM.
+from bench.common import *
+from sbl.vm.profiler import ProfilingVM, Sampler
+
+FIB = '''
+fib { ^ 2 <; br { .@; } el { .@ ^ 1 - fib .a 2 - fib a +; } }
+main { 18 fib println; }
+'''
+
+
+def time_sampled(fun_table: FunTable, repeat: int=3) -> float:
+    best = None
+    for _ in range(repeat):
+        vm = VM(fun_table)
+        start = time.perf_counter()
+        with Sampler(vm), redirect_stdout(io.StringIO()):
+            vm.run()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    fun_table = compile_source(FIB)
+    plain = time_run(fun_table, 3)
+    header('plain', 'profiled')
+    report('recursive calls (sample)', plain, time_sampled(fun_table))
+    report('recursive calls (calls)', plain, time_run(fun_table, 3, vm_class=ProfilingVM))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+# program.py
+# Compares compiling a program and making a VM for every request against compiling it once into a Program and making
+# cheap VMs from that, the way code embedding SBL would serve requests.
+import time
+
+from bench.common import *
+from sbl.program import Program, ENGINES
+
+REQUESTS = 40
+
+SOURCE = '''
+score { .n 0 .total 0 .i; i 20 <; loop { .@ total i n * + .total i 1 + .i; i 20 <; } .@ total; }
+''' + ''.join(f"helper{a}{b} {{ .x x {ord(a)} + x {ord(b)} * -; }}\n"
+              for a in 'abcdefgh' for b in 'abcdefgh')
+
+
+def per_request(engine: str) -> float:
+    start = time.perf_counter()
+    for n in range(REQUESTS):
+        Program.compile(SOURCE).run(n, fname='score', engine=engine)
+    return time.perf_counter() - start
+
+
+def shared(engine: str) -> float:
+    start = time.perf_counter()
+    program = Program.compile(SOURCE)
+    for n in range(REQUESTS):
+        program.run(n, fname='score', engine=engine)
+    return time.perf_counter() - start
+
+
+def main():
+    header('compile each', 'shared')
+    for engine in ENGINES:
+        report(f"{REQUESTS} requests ({engine})", per_request(engine), shared(engine))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+# pvec.py
+# Measures functional-style code that keeps every version of a stack it derives. With list-backed stacks, each version
+# has to be copied item by item before it is changed; with persistent stacks, deriving a version is a single `push`.
+from bench.common import *
+
+N = 300
+
+# each step derives a new version from the last one, and keeps both
+COPYING = f'''
+copy {{ .s [] .t 0 .i; s len .n .@; i n <; loop {{ .@ t s i get .x .@ x push .t i 1 + .i; i n <; }} .@ t; }}
+main {{
+    [] .versions [] .v 0 .i; i {N} <;
+    loop {{ .@ v copy i push .v versions v push .versions i 1 + .i; i {N} <; }} .@;
+}}
+'''
+
+PERSISTENT = f'''
+main {{
+    [] .versions [] .v 0 .i; i {N} <;
+    loop {{ .@ v i push .v versions v push .versions i 1 + .i; i {N} <; }} .@;
+}}
+'''
+
+
+def main():
+    header('copying', 'persistent')
+    copying = time_run(compile_source(COPYING), repeat=3)
+    persistent = time_run(compile_source(PERSISTENT, persistent_stacks=True), repeat=3)
+    report(f"{N} versions of a growing stack", copying, persistent)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+# pyjit.py
+# Compares the interpreter against functions translated to Python. Translation happens when the VM is built, so it isn't
+# part of the measured time.
+from bench.common import *
+from sbl.vm.pyjit import JitVM
+
+PROGRAMS = {
+    'fib 18': '''
+        fib { ^ 2 <; br { .@; } el { .@ .n n 1 - fib n 2 - fib +; } }
+        main { 18 fib .@; }
+    ''',
+    'counting loop 20000': '''
+        main {
+            0 .i 0 .total;
+            i 20000 <;
+            loop { .@; total i + .total; i 1 + .i; i 20000 <; }
+            .@;
+        }
+    ''',
+    'stack juggling 5000': '''
+        step { ^ 2 * + ^ 3 - .@ .@; }
+        main { 5000 .n; n 0 >; loop { .@; n step n 1 - .n; n 0 >; } .@; }
+    ''',
+}
+
+
+def main():
+    header('interp', 'pyjit')
+    for name, source in PROGRAMS.items():
+        fun_table = compile_source(source)
+        baseline = time_run(fun_table, repeat=3)
+        jitted = time_run(fun_table, repeat=3, vm_class=JitVM)
+        report(name, baseline, jitted)
+
+
+if __name__ == '__main__':
+    main()
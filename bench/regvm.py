@@ -0,0 +1,73 @@
+# regvm.py
+# Compares the interpreter against the register VM tier, by time and by how many items move on or off the global stack.
+from bench.common import *
+from sbl.vm.regvm import RegVM
+
+PROGRAMS = {
+    'fact 12, 200 times': '''
+        fact { ^ 1 >; br { .@ ^ 1 - fact *; } el { .@; } }
+        main { 200 .n; n 0 >; loop { .@ 12 fact .@ n 1 - .n; n 0 >; } .@; }
+    ''',
+    'fib 16': '''
+        fib { ^ 2 <; br { .@; } el { .@ .n n 1 - fib n 2 - fib +; } }
+        main { 16 fib .@; }
+    ''',
+    # only `square` gets hot; the loop runs in a function that is called once
+    'sum of squares 3000': '''
+        square { .x x x *; }
+        sum-squares { .n 0 .total; n 0 >; loop { .@ total n square + .total n 1 - .n; n 0 >; } .@ total; }
+        main { 3000 sum-squares .@; }
+    ''',
+}
+
+
+class CountingStack(list):
+    """
+    A global stack that counts every item pushed onto it or popped off of it.
+    """
+    def __init__(self):
+        super().__init__()
+        self.traffic = 0
+
+    def append(self, item):
+        self.traffic += 1
+        super().append(item)
+
+    def extend(self, items):
+        items = list(items)
+        self.traffic += len(items)
+        super().extend(items)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def pop(self, *args):
+        self.traffic += 1
+        return super().pop(*args)
+
+    def __delitem__(self, key):
+        self.traffic += len(self[key]) if isinstance(key, slice) else 1
+        super().__delitem__(key)
+
+
+def count_traffic(fun_table: FunTable, vm_class) -> int:
+    vm = vm_class(fun_table)
+    vm.state.stack = CountingStack()
+    with redirect_stdout(io.StringIO()):
+        vm.run()
+    return vm.state.stack.traffic
+
+
+def main():
+    header('interp', 'regvm')
+    for name, source in PROGRAMS.items():
+        fun_table = compile_source(source, inline_threshold=0)
+        report(name, time_run(fun_table, repeat=3), time_run(fun_table, repeat=3, vm_class=RegVM))
+        baseline = count_traffic(fun_table, VM)
+        registers = count_traffic(fun_table, RegVM)
+        print(f"{'    stack traffic'.ljust(40)} {baseline:12} {registers:12} {baseline / registers:6.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# serve.py
+# Compares running a short program with a fresh `sbl` process each time against sending it to `sbl serve` with the
+# thin client, which skips importing SBL and compiling the program again.
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.common import *
+
+RUNS = 20
+
+PROGRAM = 'main { 0 .i; i 100 <; loop { .@ i ^ * .@ i 1 + .i; i 100 <; } .@; "done" println; }'
+
+
+def run(argv: List[str], env: dict) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + argv, env=env, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'short.sbl')
+        socket_path = os.path.join(tmp, 'sbl.sock')
+        with open(path, 'w') as fp:
+            fp.write(PROGRAM)
+        env = dict(os.environ, PYTHONPATH=os.getcwd())
+        launcher = "import sys; from sbl.sbl import main; sys.argv[0] = 'sbl'; main()"
+        server = subprocess.Popen([sys.executable, '-c', launcher, 'serve', '--socket', socket_path], env=env,
+                                  stderr=subprocess.PIPE)
+        try:
+            server.stderr.readline()
+            cold = sum(run(['-c', launcher, path], env) for _ in range(RUNS))
+            warm = sum(run(['-m', 'sbl.client', '--socket', socket_path, path], env) for _ in range(RUNS))
+        finally:
+            server.terminate()
+            server.wait()
+            server.stderr.close()
+    header('sbl', 'sbl.client')
+    report(f"{RUNS} runs of a short program", cold, warm)
+
+
+if __name__ == '__main__':
+    main()
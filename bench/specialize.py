@@ -0,0 +1,29 @@
+# specialize.py
+# Measures specialized integer instructions against generic builtin calls.
+from bench.common import *
+
+SOURCE = '''
+main {
+    0 .total;
+    30000 .n;
+    n 0 >;
+    loop {
+        .@;
+        total n n * + .total;
+        n 1 - .n;
+        n 0 >;
+    }
+    .@;
+}
+'''
+
+
+def main():
+    header('generic', 'specialized')
+    baseline = time_run(compile_source(SOURCE, specialize=False))
+    specialized = time_run(compile_source(SOURCE))
+    report('integer arithmetic loop', baseline, specialized)
+
+
+if __name__ == '__main__':
+    main()
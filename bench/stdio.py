@@ -0,0 +1,45 @@
+# stdio.py
+# Compares a filter that reads lines from stdin, changes them, and prints them, with print calling Python's `print` for
+# every value (as it used to) against buffered output.
+from unittest.mock import patch
+
+from bench.common import *
+from sbl.vm.funs import BUILTINS, _text
+
+LINES = 20000
+INPUT = ''.join(f"line {i}\n" for i in range(LINES))
+
+FILTER = '''
+main { stdin readline; loop { .line "> " print line print "ok" println readline; } .2; }
+'''
+
+
+def print_fn(vm_state):
+    print(_text(vm_state.pop()), end='')
+
+
+def println_fn(vm_state):
+    print_fn(vm_state)
+    print()
+
+
+UNBUFFERED = dict(BUILTINS, print=print_fn, println=println_fn)
+
+
+def time_filter(fun_table: FunTable, repeat: int, **options) -> float:
+    best = None
+    for _ in range(repeat):
+        with patch('sys.stdin', io.StringIO(INPUT)):
+            elapsed = time_run(fun_table, repeat=1, **options)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    fun_table = compile_source(FILTER)
+    header('print', 'buffered')
+    report(f"filter {LINES} lines", time_filter(fun_table, 3, builtins=UNBUFFERED), time_filter(fun_table, 3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+# strings.py
+# Compares building a long string by repeated `+` against appending to a string builder, and turning a string into a
+# stack of characters (and back) one character at a time against `chars` and `unchars`.
+from bench.common import *
+
+N = 5000
+PIECE = 'x' * 200
+
+CONCAT = f'''
+main {{ "" .out 0 .i; i {N} <; loop {{ .@ out "{PIECE}" + .out i 1 + .i; i {N} <; }} .@; }}
+'''
+
+BUILDER = f'''
+main {{ builder .out 0 .i; i {N} <; loop {{ .@ out "{PIECE}" append .out i 1 + .i; i {N} <; }} .@ out finish .@; }}
+'''
+
+TEXT = 'x' * N
+
+LOOP = f'''
+main {{
+    "{TEXT}" .s [] .cs 0 .i; s len .size .@; i size <;
+    loop {{ .@ cs s i get .c .@ c push .cs i 1 + .i; i size <; }} .@
+    "" .out 0 .i; i size <; loop {{ .@ out cs i get .c .@ c + .out i 1 + .i; i size <; }} .@;
+}}
+'''
+
+CHARS = f'''
+main {{ "{TEXT}" chars unchars .@; }}
+'''
+
+
+def main():
+    header('naive', 'builtins')
+    report(f"{N} appends of {len(PIECE)} characters", time_run(compile_source(CONCAT), repeat=3),
+           time_run(compile_source(BUILDER), repeat=3))
+    report(f"{N} characters to a stack and back", time_run(compile_source(LOOP), repeat=3),
+           time_run(compile_source(CHARS), repeat=3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# tasks.py
+# Compares reading a line from each of several slow pipes one after another against reading each pipe in its own
+# task, so that the waits overlap.
+import os
+import tempfile
+import threading
+import time
+
+from bench.common import *
+
+PIPES = 8
+DELAY = 0.05
+
+SEQUENTIAL = '''
+main {
+    PATHS .paths paths len .n .@ 0 .i; i n <;
+    loop { .@ paths i get .path .@ path "r" open readline .@ close i 1 + .i; i n <; } .@;
+}
+'''
+
+TASKS = '''
+reader { .path path "r" open readline .@ close; }
+main {
+    PATHS .paths paths len .n .@ [] .tasks 0 .i; i n <;
+    loop { .@ tasks paths i get .path .@ path "reader" spawn push .tasks i 1 + .i; i n <; } .@
+    0 .i; i n <; loop { .@ tasks i get .t .@ t wait .@ i 1 + .i; i n <; } .@;
+}
+'''
+
+
+def write_slowly(path: str):
+    with open(path, 'w') as fp:
+        time.sleep(DELAY)
+        fp.write('line\n')
+
+
+def time_pipes(fun_table: FunTable, paths: List[str], repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        writers = [threading.Thread(target=write_slowly, args=(path,)) for path in paths]
+        for writer in writers:
+            writer.start()
+        elapsed = time_run(fun_table, repeat=1)
+        for writer in writers:
+            writer.join()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, f"pipe{i}") for i in range(PIPES)]
+        for path in paths:
+            os.mkfifo(path)
+        listed = '[' + ' '.join(f'"{path}"' for path in paths) + ']'
+        header('sequential', 'tasks')
+        sequential = compile_source(SEQUENTIAL.replace('PATHS', listed))
+        tasks = compile_source(TASKS.replace('PATHS', listed))
+        report(f"{PIPES} pipes, {int(DELAY * 1000)}ms each", time_pipes(sequential, paths, 3),
+               time_pipes(tasks, paths, 3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+# batch.py
+# `sbl batch`: runs many programs in a pool of worker processes, and sums up how they went.
+import io
+import os
+import signal
+import time
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stdout, redirect_stderr
+from copy import copy
+
+from sbl.common import *
+from sbl.sbl import add_run_args, check_run_args, import_dirs, run_file
+
+
+class JobTimeout(BaseException):
+    """
+    Raised in a worker when a program runs for longer than it is allowed to.
+    """
+
+
+# The status of a program whose worker process died before it finished.
+WORKER_DIED = -1
+
+
+class JobResult:
+    """
+    How a program in a batch went.
+    """
+    def __init__(self, path: str, status: Optional[int], stdout: str, stderr: str, elapsed: float):
+        """
+        :param status: the exit status, None if the program timed out, or WORKER_DIED.
+        :param elapsed: the wall time of the job, in seconds.
+        """
+        self.path = path
+        self.status = status
+        self.stdout = stdout
+        self.stderr = stderr
+        self.elapsed = elapsed
+
+    @property
+    def timed_out(self) -> bool:
+        return self.status is None
+
+    def describe(self) -> str:
+        if self.timed_out:
+            return 'timeout'
+        elif self.status == WORKER_DIED:
+            return 'crashed'
+        return 'ok' if self.status == 0 else f"exit {self.status}"
+
+
+def parse_batch_args(argv: List[str]) -> Namespace:
+    parser = ArgumentParser(prog='sbl batch', description="Runs many SBL programs in a pool of worker processes.")
+    add_run_args(parser)
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=0,
+                        help='Number of worker processes; 0 uses one per CPU')
+    parser.add_argument('--timeout', metavar='SECONDS', type=float, default=0,
+                        help='Stop any program that runs for longer than this; 0 never stops them')
+    parser.add_argument('-m', '--manifest', metavar='MANIFEST', type=str,
+                        help='File listing programs to run, one per line, relative to the manifest')
+    parser.add_argument('--output-dir', metavar='DIR', type=str,
+                        help='Write the output of each program to DIR instead of showing it')
+    parser.add_argument('files', metavar='FILE', type=str, nargs='*', help='Programs to run')
+    # programs run in a batch aren't checkpointed or profiled
+    parser.set_defaults(checkpoint=None, checkpoint_every=0, resume=None, profile=None, profile_output=None)
+    args = parser.parse_args(argv)
+    check_run_args(parser, args)
+    if args.manifest is not None:
+        args.files += read_manifest(args.manifest)
+    if not args.files:
+        parser.error('no programs to run')
+    # the programs already run in parallel
+    if args.workers == 0:
+        args.workers = 1
+    return args
+
+
+def read_manifest(manifest: str) -> List[str]:
+    """
+    :return: the paths listed in a manifest, skipping blank lines and lines starting with `#`.
+    """
+    base = os.path.dirname(manifest)
+    with open(manifest) as fp:
+        lines = [line.strip() for line in fp]
+    return [os.path.join(base, line) for line in lines if line and not line.startswith('#')]
+
+
+# imports parsed by this worker, shared by every program it runs
+_parsed = {}
+
+
+def _on_timeout(signum, frame):
+    raise JobTimeout()
+
+
+def run_job(args: Namespace, path: str, timeout: float=0) -> JobResult:
+    """
+    Runs a program, capturing its output.
+    :param args: the options to run the program with.
+    :param timeout: how many seconds the program may run for; 0 doesn't limit it. Limits need SIGALRM, so they are
+    ignored where it doesn't exist.
+    """
+    args = copy(args)
+    args.file = path
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    timed = timeout > 0 and hasattr(signal, 'setitimer')
+    start = time.perf_counter()
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        try:
+            if timed:
+                signal.signal(signal.SIGALRM, _on_timeout)
+                signal.setitimer(signal.ITIMER_REAL, timeout)
+            try:
+                status = run_file(args, import_dirs(), _parsed)
+            finally:
+                if timed:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+        except JobTimeout:
+            printerr(f"Timed out after {timeout}s")
+            status = None
+    return JobResult(path, status, stdout.getvalue(), stderr.getvalue(), time.perf_counter() - start)
+
+
+def write_result(result: JobResult, index: int, output_dir: Optional[str]):
+    """
+    Shows what a program wrote, or writes it to files in the output directory: `N-NAME.stdout` and `N-NAME.stderr`,
+    where N is the program's place in the batch.
+    """
+    if output_dir is None:
+        sys.stdout.write(result.stdout)
+        sys.stderr.write(result.stderr)
+        return
+    name = f"{index}-{os.path.basename(result.path)}"
+    for ext, text in [('stdout', result.stdout), ('stderr', result.stderr)]:
+        with open(os.path.join(output_dir, f"{name}.{ext}"), 'w') as fp:
+            fp.write(text)
+
+
+def summarize(results: List[JobResult], wall: float):
+    width = max(len(result.path) for result in results)
+    printerr(f"{'program'.ljust(width)} {'status'.ljust(8)} {'time'.rjust(10)}")
+    for result in results:
+        printerr(f"{result.path.ljust(width)} {result.describe().ljust(8)} {result.elapsed * 1000:8.1f}ms")
+    ok = sum(result.status == 0 for result in results)
+    timed_out = sum(result.timed_out for result in results)
+    failed = len(results) - ok - timed_out
+    printerr(f"{len(results)} programs: {ok} ok, {failed} failed, {timed_out} timed out in {wall:.2f}s")
+
+
+def batch_main(argv: List[str]) -> int:
+    """
+    The entry point of `sbl batch`.
+    :return: the exit status, which is 1 if any program failed or timed out.
+    """
+    args = parse_batch_args(argv)
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(args.jobs or None) as executor:
+        futures = [executor.submit(run_job, args, path, args.timeout) for path in args.files]
+        for index, (path, future) in enumerate(zip(args.files, futures)):
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                # a worker was killed, by a signal or for running out of memory; every job it hadn't finished is lost
+                # along with the pool
+                message = "A worker process died before this program finished\n"
+                result = JobResult(path, WORKER_DIED, '', message, time.perf_counter() - start)
+            write_result(result, index, args.output_dir)
+            results += [result]
+    summarize(results, time.perf_counter() - start)
+    return 0 if all(result.status == 0 for result in results) else 1
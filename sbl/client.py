@@ -0,0 +1,93 @@
+# client.py
+# A thin client for `sbl serve`: sends a command line to the server, and shows the output of the program as it runs.
+#
+# This is started for every program it runs, so it only imports what it needs from the standard library.
+import json
+import os
+import socket
+import sys
+
+# Where the server listens unless told otherwise.
+SOCKET_ENV = 'SBL_SOCKET'
+
+# Each message from the server is a frame: a kind, the length of the data, and the data.
+STDOUT = b'o'
+STDERR = b'e'
+EXIT = b'x'
+FRAME_HEADER = 5
+
+
+def default_socket() -> str:
+    if SOCKET_ENV in os.environ:
+        return os.environ[SOCKET_ENV]
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or '/tmp'
+    return os.path.join(runtime_dir, f"sbl-{os.getuid()}.sock")
+
+
+def frame(kind: bytes, data: bytes) -> bytes:
+    return kind + len(data).to_bytes(FRAME_HEADER - 1, 'big') + data
+
+
+def read_frame(fp):
+    """
+    :return: the kind and data of the next frame, or None if the connection was closed.
+    """
+    header = fp.read(FRAME_HEADER)
+    if len(header) < FRAME_HEADER:
+        return None
+    size = int.from_bytes(header[1:], 'big')
+    return header[:1], fp.read(size)
+
+
+def request(argv, socket_path: str=None, stdout=None, stderr=None) -> int:
+    """
+    Runs a program on the server.
+    :param argv: the `sbl` command line to run, without `sbl` itself; it is run in the current directory, and imports
+    are found with the current `SBL_PATH`.
+    :param stdout: where to write what the program writes to standard output; defaults to `sys.stdout`.
+    :param stderr: where to write what the program writes to standard error; defaults to `sys.stderr`.
+    :return: the exit status of the program.
+    :raise OSError: if the server can't be reached.
+    """
+    stdout = sys.stdout if stdout is None else stdout
+    stderr = sys.stderr if stderr is None else stderr
+    message = {'argv': list(argv), 'cwd': os.getcwd(), 'env': {'SBL_PATH': os.environ.get('SBL_PATH')}}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path or default_socket())
+        sock.sendall(json.dumps(message).encode() + b'\n')
+        with sock.makefile('rb') as fp:
+            while True:
+                received = read_frame(fp)
+                if received is None:
+                    stderr.write("sbl: the server closed the connection\n")
+                    return 1
+                kind, data = received
+                if kind == EXIT:
+                    return int(data)
+                out = stdout if kind == STDOUT else stderr
+                out.write(data.decode('utf-8'))
+                out.flush()
+
+
+def main():
+    argv = sys.argv[1:]
+    socket_path = None
+    if argv[:1] == ['--socket'] and len(argv) > 1:
+        socket_path, argv = argv[1], argv[2:]
+    elif argv[:1] and argv[0].startswith('--socket='):
+        socket_path, argv = argv[0].split('=', 1)[1], argv[1:]
+    try:
+        status = request(argv, socket_path)
+    except OSError as e:
+        print(f"sbl: could not reach the server at {socket_path or default_socket()}: {e.strerror or e}",
+              file=sys.stderr)
+        print("sbl: start it with `sbl serve`", file=sys.stderr)
+        status = 1
+    except KeyboardInterrupt:
+        # closing the connection stops the program
+        status = 130
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
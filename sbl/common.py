@@ -1,10 +1,11 @@
 from typing import *
-from sys import stderr
+import sys
 from abc import ABCMeta, abstractmethod
 
 
 def printerr(*args, **kwargs):
-    print(*args, **kwargs, file=stderr)
+    # looked up on every call, so that redirecting sys.stderr redirects errors too
+    print(*args, **kwargs, file=sys.stderr)
 
 
 def underline_source(source: str, rng: 'Range'):
@@ -0,0 +1,196 @@
+# program.py
+# Compiling a program once and running it any number of times, for Python code that embeds SBL.
+import os
+import threading
+from types import MappingProxyType
+
+from sbl.syntax.prepro import *
+from sbl.vm.vm import *
+from sbl.vm.byteview import ByteView
+from sbl.vm.files import FileTable
+from sbl.vm.pyjit import JitVM, JitCode
+from sbl.vm.regvm import RegVM
+
+
+def to_val(value: Any) -> Val:
+    """
+    Converts a Python value to an SBL value. Booleans, integers, strings, and None become the SBL values of the same
+    kind; bytes become bytes; lists and tuples become local stacks, and dicts become maps. SBL values are left alone.
+    :raise TypeError: if the value (or anything inside of it) has no SBL equivalent, or a dict has a key that SBL maps
+    can't have.
+    """
+    if isinstance(value, Val):
+        return value
+    elif isinstance(value, bool):
+        return Val(value, ValType.BOOL)
+    elif isinstance(value, int):
+        return Val(value, ValType.INT)
+    elif isinstance(value, str):
+        return Val(value, ValType.STRING)
+    elif value is None:
+        return Val(None, ValType.NIL)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        return Val(ByteView(bytes(value)), ValType.BYTES)
+    elif isinstance(value, (list, tuple)):
+        return Val([to_val(item) for item in value], ValType.STACK)
+    elif isinstance(value, dict):
+        items = {to_val(key): to_val(item) for key, item in value.items()}
+        for key in items:
+            if key.type not in KEY_TYPES:
+                raise TypeError(f"map keys can not be {key.type.value}s")
+        return Val(items, ValType.MAP)
+    raise TypeError(f"{type(value).__name__} values can't be passed to SBL")
+
+
+def from_val(val: Val) -> Any:
+    """
+    Converts an SBL value to a Python value, the other way around from `to_val`. Characters become strings, string
+    builders become the string built so far, and arrays are given as they are stored, since they never change. Files,
+    tasks, and channels are given as the objects the VM uses for them.
+    """
+    if val.type is ValType.NIL:
+        return None
+    elif val.type is ValType.STACK:
+        return [from_val(item) for item in val.val]
+    elif val.type is ValType.MAP:
+        return {from_val(key): from_val(item) for key, item in val.val.items()}
+    elif val.type is ValType.BYTES:
+        return val.val.tobytes()
+    elif val.type is ValType.BUILDER:
+        return ''.join(val.val)
+    return val.val
+
+
+# The classes of VM each engine uses, by the names `sbl --engine` takes.
+ENGINES = {
+    'interp': VM,
+    'pyjit': JitVM,
+    'regvm': RegVM,
+}
+
+
+class Program:
+    """
+    A compiled program, which any number of VMs can run, at the same time in separate threads if need be.
+
+    A program is never changed once it is compiled: VMs only ever read its bytecode, constant stacks and maps are
+    copied by a VM the first time it changes them, and adaptive VMs rewrite copies of the bytecode of their own. So
+    making a VM only costs making its state; the `pyjit` engine's translation of the program is made once, the first
+    time a VM needs it, and shared after that. Programs can be pickled, to run them in other processes.
+    """
+    def __init__(self, funs: FunTable, source_name: str, builtins=BUILTINS):
+        """
+        :param funs: the compiled program, which must not be changed after this.
+        :param source_name: the name of the file the program was compiled from, for errors.
+        :param builtins: the builtin functions available to the program.
+        """
+        self._funs = funs
+        self._source_name = source_name
+        self._builtins = builtins
+        self._jit_code = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def compile(source: str, source_name: str='<program>', search_dirs: List[str]=None,
+                inline_threshold: int=INLINE_THRESHOLD, persistent_stacks: bool=False) -> 'Program':
+        """
+        Compiles source text into a program.
+        :param source_name: the name of the file the source came from; relative imports are found next to it.
+        :param search_dirs: where else to look for imports.
+        :param inline_threshold: the largest function body to inline into callers, as the compiler takes.
+        :param persistent_stacks: whether local stacks are persistent, as the compiler takes.
+        :raise ParseError: if the source, or a file it imports, doesn't parse.
+        :raise PreprocessImportError: if an import can't be found.
+        :raise ChainedError: if an imported file has an error.
+        :raise CompileError: if the program doesn't compile.
+        """
+        ast = Parser(source, source_name).parse()
+        ast += Preprocess(source_name, search_dirs or [], ast, [os.path.abspath(source_name)]).preprocess()
+        funs = Compiler(ast, {'file': source_name}, inline_threshold=inline_threshold,
+                        persistent_stacks=persistent_stacks).compile()
+        return Program(funs, source_name)
+
+    @staticmethod
+    def load(path: str, search_dirs: List[str]=None, **options) -> 'Program':
+        """
+        Compiles a file into a program.
+        :param options: compiler options, as `compile` takes.
+        :raise OSError: if the file can't be read.
+        """
+        with open(path) as fp:
+            source = fp.read()
+        return Program.compile(source, path, search_dirs, **options)
+
+    @property
+    def funs(self) -> Mapping[str, Fun]:
+        """
+        The program's functions, which may be looked at but not changed.
+        """
+        return MappingProxyType(self._funs)
+
+    @property
+    def source_name(self) -> str:
+        return self._source_name
+
+    @property
+    def builtins(self) -> Mapping[str, Callable]:
+        return MappingProxyType(self._builtins)
+
+    def jit_code(self) -> JitCode:
+        """
+        :return: the program translated to Python, for the `pyjit` engine.
+        """
+        with self._lock:
+            if self._jit_code is None:
+                self._jit_code = JitCode(self._funs, self._builtins)
+            return self._jit_code
+
+    def vm(self, engine: str='interp', stdin: TextIO=None, stdout: TextIO=None, **options) -> VM:
+        """
+        Makes a VM to run this program.
+        :param engine: how to run the program; one of the names in `ENGINES`.
+        :param stdin: the stream the program reads standard input from; defaults to `sys.stdin`.
+        :param stdout: the stream the program writes standard output to; defaults to `sys.stdout`. Streams shared
+        between VMs running in separate threads have to be safe to write to from several threads.
+        :param options: options for the engine's VM class, like `output_buffer` or `adaptive`.
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"unknown engine: {engine!r}")
+        if engine == 'pyjit':
+            options['jit_code'] = self.jit_code()
+        vm = ENGINES[engine](self._funs, self._builtins, **options)
+        if stdin is not None or stdout is not None:
+            vm.state.files = FileTable(options.get('output_buffer', OUTPUT_BUFFER), stdin, stdout)
+        return vm
+
+    def run(self, *inputs, fname: str='main', engine: str='interp', stdin: TextIO=None, stdout: TextIO=None,
+            **options) -> List[Any]:
+        """
+        Runs a function of this program in a new VM, starting with some inputs on the global stack.
+        :param inputs: values to push onto the global stack, converted with `to_val`; the last one ends up on top.
+        :param fname: the function to run.
+        :param engine: how to run the program, as `vm` takes.
+        :param options: options for the VM, as `vm` takes.
+        :return: what the function left on the global stack, bottom first, converted with `from_val`.
+        :raise ValueError: if the program has no such function.
+        :raise VMError: if the program fails. Errors inside of builtins are raised as a ChainedError.
+        """
+        if fname not in self._funs:
+            raise ValueError(f"no such function: `{fname}`")
+        vm = self.vm(engine, stdin, stdout, **options)
+        vm.state.stack = [to_val(value) for value in inputs]
+        vm.run(fname)
+        return [from_val(val) for val in vm.state.stack]
+
+    def __getstate__(self):
+        # the translation and the lock can't be pickled, and are made again when needed; the standard builtins are
+        # closures, so they are left for the other side to find
+        builtins = None if self._builtins is BUILTINS else self._builtins
+        return {'funs': self._funs, 'source_name': self._source_name, 'builtins': builtins}
+
+    def __setstate__(self, state):
+        builtins = BUILTINS if state['builtins'] is None else state['builtins']
+        self.__init__(state['funs'], state['source_name'], builtins)
+
+    def __repr__(self):
+        return f"Program({self._source_name!r}, {len(self._funs)} functions)"
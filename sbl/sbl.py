@@ -7,6 +7,12 @@ from argparse import ArgumentParser
 import argparse
 
 from sbl.vm.vm import *
+from sbl.vm.pyjit import JitVM
+from sbl.vm.regvm import RegVM
+from sbl.vm.aot import ModuleWriter
+from sbl.vm.memo import MEMO_SIZE
+from sbl.vm.checkpoint import Checkpoint, CheckpointError, CHECKPOINT_SIGNAL
+from sbl.vm.profiler import ProfilingVM, Sampler, SAMPLE_INTERVAL, write_collapsed
 from sbl.syntax.prepro import *
 from sbl.common import *
 
@@ -15,21 +21,149 @@ from sbl.common import *
 # * elbr - elif-style branch constructs
 # * Labels + goto?
 
-def parse_args():
+def parse_compile_args(argv):
+    parser = ArgumentParser(prog='sbl compile', description="Compiles SBL code to a standalone Python module.")
+    parser.add_argument('-v', '--verbose', action='count', help='Show detailed information', default=0)
+    parser.add_argument('--inline-threshold', metavar='N', type=int, default=INLINE_THRESHOLD,
+                        help='Largest function body (in instructions) to inline into callers; 0 disables inlining')
+    parser.add_argument('--persistent-stacks', action='store_true',
+                        help='Make local stacks persistent, so that changing one never changes a copy of it')
+    parser.add_argument('-o', '--output', metavar='OUT', type=str,
+                        help='Python module to write; defaults to FILE with a .py extension')
+    parser.add_argument('file', metavar='FILE', type=str, help='File to compile')
+    args = parser.parse_args(argv)
+    if args.output is None:
+        args.output = path.splitext(args.file)[0] + '.py'
+    return args
+
+
+def add_run_args(parser: ArgumentParser):
+    """
+    Adds the options for compiling and running programs, which `sbl` and `sbl batch` share.
+    """
+    parser.add_argument('-v', '--verbose', action='count', help='Show detailed information', default=0)
+    parser.add_argument('--inline-threshold', metavar='N', type=int, default=INLINE_THRESHOLD,
+                        help='Largest function body (in instructions) to inline into callers; 0 disables inlining')
+    parser.add_argument('--persistent-stacks', action='store_true',
+                        help='Make local stacks persistent, so that changing one never changes a copy of it')
+    parser.add_argument('--adaptive', action='store_true', help='Specialize hot instructions while running')
+    parser.add_argument('--memoize', action='store_true', help='Cache the results of pure functions')
+    parser.add_argument('--memo-size', metavar='N', type=int, default=MEMO_SIZE,
+                        help='Number of results to keep in the memoization cache')
+    parser.add_argument('--engine', choices=['interp', 'pyjit', 'regvm'], default='interp',
+                        help='How to run the program: interp interprets bytecode, pyjit translates it to Python first, '
+                             'and regvm runs hot functions in registers')
+    parser.add_argument('--output-buffer', metavar='N', type=int, default=OUTPUT_BUFFER,
+                        help='Number of characters of output to buffer before writing them; 0 writes them right away')
+    parser.add_argument('--workers', metavar='N', type=int, default=0,
+                        help='Number of processes pmap uses; 0 uses one per CPU, and 1 runs pmap in this process')
+    parser.add_argument('--chunk-size', metavar='N', type=int, default=0,
+                        help='Number of items pmap sends to a process at a time; 0 picks a size for each stack')
+    parser.add_argument('--max-instructions', metavar='N', type=int, default=0,
+                        help='Stop the program after about this many instructions; 0 never stops it')
+    parser.add_argument('--max-stack', metavar='N', type=int, default=0,
+                        help='Stop the program if the global stack holds more than this many items; 0 never stops it')
+    parser.add_argument('--max-depth', metavar='N', type=int, default=0,
+                        help='Stop the program if it calls functions more than this deep; 0 never stops it')
+    parser.add_argument('--time-limit', metavar='SECONDS', type=float, default=0,
+                        help='Stop the program if it runs for longer than this; 0 never stops it')
+
+
+def check_run_args(parser: ArgumentParser, args):
+    args.output = None
+    if args.engine != 'interp' and (args.adaptive or args.memoize):
+        parser.error('--adaptive and --memoize only apply to the interp engine')
+
+
+def parse_args(argv: List[str]=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['compile']:
+        return parse_compile_args(argv[1:])
     parser = ArgumentParser(description="Runs SBL code.")
     # TODO: -c option like python has
-    parser.add_argument('-v', '--verbose', action='count', help='Show detailed information', default=0)
+    add_run_args(parser)
+    parser.add_argument('--checkpoint', metavar='CKPT', type=str,
+                        help='Save checkpoints of the program to CKPT when it calls checkpoint, or when this process '
+                             f'gets {CHECKPOINT_SIGNAL.name}')
+    parser.add_argument('--checkpoint-every', metavar='N', type=int, default=0,
+                        help='Also save a checkpoint after about every N instructions')
+    parser.add_argument('--resume', metavar='CKPT', type=str,
+                        help='Carry on from a checkpoint saved by the same program, instead of starting it')
+    parser.add_argument('--profile', choices=['calls', 'sample'],
+                        help='Report where the program spent its time: calls times every call to every function, and '
+                             'sample looks at what the program is running every so often')
+    parser.add_argument('--profile-interval', metavar='SECONDS', type=float, default=SAMPLE_INTERVAL,
+                        help='Time between samples when sampling')
+    parser.add_argument('--profile-output', metavar='STACKS', type=str,
+                        help='Also write the stacks profiled to STACKS, in the collapsed format that flame graph '
+                             'tools read')
     parser.add_argument('file', metavar='FILE', type=str, help='File to run')
     parser.add_argument('argv', metavar='ARGV', nargs=argparse.REMAINDER, help='Program arguments')
-    return parser.parse_args()
+    args = parser.parse_args(argv)
+    check_run_args(parser, args)
+    if args.engine != 'interp' and (args.checkpoint or args.resume):
+        parser.error('--checkpoint and --resume only apply to the interp engine')
+    if args.engine != 'interp' and args.profile:
+        parser.error('--profile only applies to the interp engine')
+    if args.profile_output and not args.profile:
+        parser.error('--profile-output needs --profile')
+    if args.checkpoint_every and not args.checkpoint:
+        parser.error('--checkpoint-every needs --checkpoint')
+    return args
 
 
-def main():
-    IMPORT_PATH = 'SBL_PATH'
-    error = False
+IMPORT_PATH = 'SBL_PATH'
+
+
+def import_dirs(environ: Mapping[str, str]=None) -> List[str]:
+    """
+    :param environ: the environment to find the import path in; defaults to this process's.
+    """
+    environ = os.environ if environ is None else environ
+    return environ[IMPORT_PATH].split(':') if environ.get(IMPORT_PATH) else []
 
-    search_dirs = os.environ[IMPORT_PATH].split(':') if IMPORT_PATH in os.environ else []
+
+def main():
+    if sys.argv[1:2] == ['batch']:
+        from sbl.batch import batch_main
+        sys.exit(batch_main(sys.argv[2:]))
+    if sys.argv[1:2] == ['serve']:
+        from sbl.server import serve_main
+        sys.exit(serve_main(sys.argv[2:]))
     args = parse_args()
+    status = run_file(args, import_dirs())
+    if status != 0:
+        sys.exit(status)
+
+
+def write_profile(profile, stacks_path: str=None):
+    """
+    Reports a profile of a run to standard error.
+    :param profile: the ProfilingVM or Sampler that profiled the run.
+    :param stacks_path: where to write the stacks profiled, if anywhere.
+    """
+    if isinstance(profile, Sampler):
+        profile.stop()
+    printerr("Profile:")
+    profile.report(sys.stderr)
+    if stacks_path is not None:
+        try:
+            write_collapsed(stacks_path, profile.collapsed())
+        except OSError as e:
+            printerr(f"Could not write the profiled stacks to {stacks_path}: {e.strerror or e}")
+
+
+def run_file(args, search_dirs: List[str], parsed: Dict[str, Source]=None, compiled: 'CompileCache'=None) -> int:
+    """
+    Compiles a file, and either runs it or writes it out as a module, reporting any errors.
+    :param args: the parsed command line arguments.
+    :param search_dirs: where to look for imports.
+    :param parsed: parsed imports to share with other programs, as Preprocess takes.
+    :param compiled: programs compiled by earlier runs, which are used instead of compiling the file again if none of
+    their files have changed since.
+    :return: the exit status.
+    """
+    error = False
     fname = args.file
     verbose = args.verbose
     source_name = fname
@@ -40,23 +174,57 @@ def main():
             source = fp.read()
     except FileNotFoundError:
         printerr(f"File not found: `{fname}`")
-        sys.exit(1)
+        return 1
     # build the compiler parts and compile
     try:
-        # parse
-        parser = Parser(source, fname)
-        ast = parser.parse()
-        # preprocess (get imports)
-        prepro = Preprocess(fname, search_dirs, ast, [path.abspath(fname)])
-        ast += prepro.preprocess()
-        # compile to bytecode
-        compiler = Compiler(ast, { 'file': source_name })
-        fun_table = compiler.compile()
+        fun_table = compiled.get(args, search_dirs) if compiled is not None else None
+        if fun_table is None:
+            # parse
+            parser = Parser(source, fname)
+            ast = parser.parse()
+            # preprocess (get imports)
+            prepro = Preprocess(fname, search_dirs, ast, [path.abspath(fname)], parsed)
+            ast += prepro.preprocess()
+            # compile to bytecode
+            compiler = Compiler(ast, { 'file': source_name }, inline_threshold=args.inline_threshold,
+                                persistent_stacks=args.persistent_stacks)
+            fun_table = compiler.compile()
+            if compiled is not None:
+                # the preprocessor lists every file it read, starting with this one
+                compiled.put(args, search_dirs, fun_table, prepro.ignore)
+        if args.output is not None:
+            module = ModuleWriter(fun_table, source_name).write()
+            with open(args.output, 'w') as fp:
+                fp.write(module)
         # empty programs are valid; just don't run anything
-        if len(fun_table) > 0:
-            vm = VM(fun_table)
+        elif len(fun_table) > 0:
+            limits = Limits(args.max_instructions, args.max_stack, args.max_depth, args.time_limit)
+            if args.engine == 'pyjit':
+                vm = JitVM(fun_table, output_buffer=args.output_buffer, workers=args.workers,
+                           chunk_size=args.chunk_size, limits=limits)
+            elif args.engine == 'regvm':
+                vm = RegVM(fun_table, output_buffer=args.output_buffer, workers=args.workers,
+                           chunk_size=args.chunk_size, limits=limits)
+            else:
+                vm_class = ProfilingVM if args.profile == 'calls' else VM
+                vm = vm_class(fun_table, adaptive=args.adaptive, memo_size=args.memo_size if args.memoize else 0,
+                              output_buffer=args.output_buffer, workers=args.workers, chunk_size=args.chunk_size,
+                              limits=limits, checkpoint=args.checkpoint, checkpoint_every=args.checkpoint_every)
+            resume = None
+            if args.resume is not None:
+                try:
+                    resume = Checkpoint.read(args.resume, fun_table)
+                except (CheckpointError, OSError) as e:
+                    printerr(f"Could not resume from {args.resume}: {e}")
+                    return 1
+            profile = vm if args.profile == 'calls' else None
+            if args.profile == 'sample':
+                profile = Sampler(vm, args.profile_interval)
+                profile.start()
             try:
-                vm.run()
+                vm.run(resume=resume)
+                if verbose and vm.memo:
+                    vm.memo.dump()
             except KeyboardInterrupt:
                 printerr()
                 printerr("VM interrupted; shutting down.")
@@ -64,6 +232,10 @@ def main():
                     if verbose >= 2:
                         vm.dump_funtable()
                     vm.dump_state()
+            finally:
+                # programs that fail are worth seeing the profile of too
+                if profile is not None:
+                    write_profile(profile, args.profile_output)
     except PreprocessImportError as e:
         printerr(f"Preprocess error in {fname}:")
         printerr(f"{' ' * 4}{e.path}: {e}")
@@ -94,7 +266,6 @@ def main():
         if verbose:
             printerr(f"{' '*4}{e}")
         error = True
-    if error:
-        sys.exit(1)
+    return 1 if error else 0
 
 
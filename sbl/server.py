@@ -0,0 +1,297 @@
+# server.py
+# `sbl serve`: runs programs for `sbl.client` on a Unix socket, so that they don't pay for starting Python, importing
+# SBL, and compiling unchanged files every time.
+import io
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import traceback
+from argparse import ArgumentParser
+from contextlib import redirect_stdout, redirect_stderr
+
+from sbl.client import *
+from sbl.common import *
+from sbl.sbl import parse_args, import_dirs, run_file
+from sbl.vm.compile import FunTable
+
+
+class CompileCache:
+    """
+    Compiled programs, along with the files they were compiled from. A program is compiled again once any of its files
+    change.
+    """
+    def __init__(self):
+        self.programs = {}
+
+    @staticmethod
+    def key(args, search_dirs: List[str]) -> tuple:
+        return os.path.abspath(args.file), args.inline_threshold, args.persistent_stacks, tuple(search_dirs)
+
+    @staticmethod
+    def stamp(paths: List[str]) -> Optional[tuple]:
+        """
+        :return: when each file was last changed, and how big it is, or None if any of them are gone.
+        """
+        try:
+            stats = [os.stat(p) for p in paths]
+        except OSError:
+            return None
+        return tuple((p, stat.st_mtime_ns, stat.st_size) for p, stat in zip(paths, stats))
+
+    def get(self, args, search_dirs: List[str]) -> Optional[FunTable]:
+        """
+        :return: the program compiled from the file in `args`, if none of its files have changed since.
+        """
+        key = self.key(args, search_dirs)
+        if key not in self.programs:
+            return None
+        fun_table, stamp = self.programs[key]
+        if self.stamp([p for p, _, _ in stamp]) != stamp:
+            del self.programs[key]
+            return None
+        return fun_table
+
+    def put(self, args, search_dirs: List[str], fun_table: FunTable, paths: List[str]):
+        """
+        :param paths: every file the program was compiled from.
+        """
+        stamp = self.stamp(paths)
+        if stamp is not None:
+            self.programs[self.key(args, search_dirs)] = (fun_table, stamp)
+
+
+class FrameWriter(io.TextIOBase):
+    """
+    A text stream that sends everything written to it to a client, as it is written.
+    """
+    def __init__(self, sock: socket.socket, kind: bytes):
+        self.sock = sock
+        self.kind = kind
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if text:
+            self.sock.sendall(frame(self.kind, text.encode('utf-8')))
+        return len(text)
+
+
+class ClientGone(BaseException):
+    """
+    Stops a program when the client that asked for it hangs up.
+    """
+
+
+# The server's own subcommands, which clients can't run.
+SERVER_COMMANDS = {'batch', 'serve'}
+
+
+class Server:
+    """
+    A pool of worker processes, all taking connections from the same socket. Each worker runs one program at a time
+    and keeps its own cache of compiled programs; workers that die are replaced.
+    """
+    def __init__(self, socket_path: str, workers: int=0):
+        """
+        :param workers: how many worker processes to use; 0 uses one per CPU.
+        """
+        self.socket_path = socket_path
+        self.workers = workers or os.cpu_count() or 1
+        self.sock = None
+        self.pids = set()
+        self.cache = CompileCache()
+        # the connection whose program a worker is running, and the connection whose client hung up; a program is only
+        # stopped when they're the same
+        self.current = None
+        self.gone = None
+
+    def listen(self):
+        """
+        :raise OSError: if the socket can't be made, or another server is already listening on it.
+        """
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except OSError:
+                # left behind by a server that didn't shut down cleanly
+                os.unlink(self.socket_path)
+            else:
+                raise OSError(f"a server is already listening on {self.socket_path}")
+            finally:
+                probe.close()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # only this user may connect
+        umask = os.umask(0o177)
+        try:
+            self.sock.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+        self.sock.listen()
+
+    def serve_forever(self):
+        """
+        Starts the workers, and replaces them as they die, until this process is interrupted or terminated.
+        """
+        signal.signal(signal.SIGTERM, _on_terminate)
+        try:
+            while True:
+                while len(self.pids) < self.workers:
+                    self._start_worker()
+                pid, _ = os.wait()
+                self.pids.discard(pid)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in self.pids:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.pids.clear()
+        self.sock.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def _start_worker(self):
+        pid = os.fork()
+        if pid != 0:
+            self.pids.add(pid)
+            return
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGUSR1, self._on_client_gone)
+            while True:
+                conn, _ = self.sock.accept()
+                with conn:
+                    self.handle(conn)
+        except KeyboardInterrupt:
+            pass
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            # leave the server's own cleanup to the server
+            os._exit(status)
+
+    def _on_client_gone(self, signum, frame):
+        if self.current is not None and self.current is self.gone:
+            raise ClientGone()
+
+    def _watch(self, conn: socket.socket):
+        """
+        Waits for the client to hang up while its program runs, and stops the program if it does.
+        """
+        try:
+            while conn.recv(4096):
+                pass
+        except OSError:
+            pass
+        if self.current is conn:
+            self.gone = conn
+            signal.pthread_kill(threading.main_thread().ident, signal.SIGUSR1)
+
+    def handle(self, conn: socket.socket):
+        """
+        Runs the program a client asked for, sending it what the program writes, and then its exit status.
+        """
+        with conn.makefile('rb') as fp:
+            line = fp.readline()
+        if not line:
+            return
+        message = json.loads(line)
+        argv = message['argv']
+        stdout = FrameWriter(conn, STDOUT)
+        stderr = FrameWriter(conn, STDERR)
+        watcher = threading.Thread(target=self._watch, args=(conn,), daemon=True)
+        self.current = conn
+        try:
+            watcher.start()
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                # programs run by the server have nothing to read
+                sys.stdin = io.StringIO()
+                status = self.run(argv, message['cwd'], message['env'])
+            self.current = None
+            conn.sendall(frame(EXIT, str(status).encode()))
+        except (ClientGone, OSError):
+            # the client hung up; there's nobody left to tell
+            pass
+        finally:
+            self.current = None
+            sys.stdin = sys.__stdin__
+            # wakes the watcher up
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            watcher.join()
+
+    def run(self, argv: List[str], cwd: str, env: Mapping[str, str]) -> int:
+        """
+        Runs an `sbl` command line, reporting errors to standard error.
+        :param cwd: the directory to run it in.
+        :param env: the client's environment, for finding imports.
+        :return: the exit status.
+        """
+        if argv[:1] and argv[0] in SERVER_COMMANDS:
+            printerr(f"sbl: `sbl {argv[0]}` can't be run through the server")
+            return 2
+        try:
+            os.chdir(cwd)
+            args = parse_args(argv)
+            return run_file(args, import_dirs(env), compiled=self.cache)
+        except SystemExit as e:
+            # from argparse
+            return e.code if isinstance(e.code, int) else 1
+        except OSError as e:
+            printerr(f"sbl: {e}")
+            return 1
+        except Exception:
+            # a bug in SBL shouldn't take the worker down with it
+            traceback.print_exc()
+            return 1
+
+
+def _on_terminate(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def parse_serve_args(argv: List[str]):
+    parser = ArgumentParser(prog='sbl serve',
+                            description="Runs SBL programs for `python -m sbl.client` on a Unix socket, keeping "
+                                        "compiled programs cached between runs.")
+    parser.add_argument('--socket', metavar='PATH', type=str, default=default_socket(),
+                        help=f"Socket to listen on; defaults to ${SOCKET_ENV}, or a socket in $XDG_RUNTIME_DIR or /tmp")
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=0,
+                        help='Number of programs to run at once; 0 uses one per CPU')
+    return parser.parse_args(argv)
+
+
+def serve_main(argv: List[str]) -> int:
+    """
+    The entry point of `sbl serve`.
+    :return: the exit status.
+    """
+    args = parse_serve_args(argv)
+    server = Server(args.socket, args.jobs)
+    try:
+        server.listen()
+    except OSError as e:
+        printerr(f"sbl serve: {e.strerror or e}")
+        return 1
+    printerr(f"Serving on {args.socket} with {server.workers} workers")
+    server.serve_forever()
+    return 0
@@ -31,6 +31,7 @@ class ItemType(Enum):
     STRING = 'string'
     BOOL = 'boolean'
     STACK = 'stack'
+    MAP = 'map'
     NIL = 'nil'
 
     def to_val_type(self) -> ValType:
@@ -42,6 +43,7 @@ class ItemType(Enum):
             ItemType.NIL: ValType.NIL,
             ItemType.BOOL: ValType.BOOL,
             ItemType.STACK: ValType.STACK,
+            ItemType.MAP: ValType.MAP,
         }
         return mapping[self]
 
@@ -60,16 +62,21 @@ class Item(AST):
             return True
         elif self.type is ItemType.IDENT:
             return False
+        elif self.type is ItemType.MAP:
+            # maps hold a list of (key, value) item pairs
+            return all(key.is_const() and val.is_const() for key, val in self.val)
         else:
             assert self.type is ItemType.STACK, f'for some reason got {self.type}'
             assert isinstance(self.val, list)
             return all(map(Item.is_const, self.val))
 
     def to_val(self) -> Val:
-        assert (self.type is ItemType.STACK and self.is_const()) or self.type is not ItemType.STACK
+        assert self.type not in [ItemType.STACK, ItemType.MAP] or self.is_const()
         if self.type is ItemType.STACK:
             # handle stacks specially
             return Val(list(map(Item.to_val, self.val)), self.type.to_val_type())
+        elif self.type is ItemType.MAP:
+            return Val({key.to_val(): val.to_val() for key, val in self.val}, self.type.to_val_type())
         else:
             return Val(self.val, self.type.to_val_type())
 
@@ -85,7 +92,7 @@ class Item(AST):
     @staticmethod
     def lookaheads() -> List[TokenType]:
         return [TokenType.IDENT, TokenType.NUM, TokenType.CHAR, TokenType.STRING, TokenType.NIL, TokenType.T,
-                TokenType.F, TokenType.LBRACK]
+                TokenType.F, TokenType.LBRACK, TokenType.LPAREN]
 
 
 class StackAction(AST):
@@ -118,6 +118,8 @@ class Parser:
         # stack literals are special, so try to match those first
         if self._can_expect(TokenType.LBRACK):
             return self._expect_stack()
+        elif self._can_expect(TokenType.LPAREN):
+            return self._expect_map()
         type_map = {
             TokenType.NUM: ItemType.INT,
             TokenType.IDENT: ItemType.IDENT,
@@ -145,6 +147,22 @@ class Parser:
             end = copy(self.curr.range.end)
         return Item(Range(start, end), items, ItemType.STACK)
 
+    def _expect_map(self) -> Item:
+        start = copy(self.curr.range.start)
+        self._next_expect(TokenType.LPAREN)
+        end = copy(self.curr.range.start)
+        items = []
+        while not self._try_expect(TokenType.RPAREN):
+            items += [self._expect_item()]
+            end = copy(self.curr.range.end)
+        if len(items) % 2 != 0:
+            raise ParseError('map literals need a value for every key', Range(start, end), self.source_path)
+        keys = items[::2]
+        for key in keys:
+            if key.type in [ItemType.STACK, ItemType.MAP]:
+                raise ParseError(f'map keys can not be {key.type.value}s', key.range, self.source_path)
+        return Item(Range(start, end), list(zip(keys, items[1::2])), ItemType.MAP)
+
     def _expect_ident(self) -> str:
         return self._next_expect(TokenType.IDENT).payload
 
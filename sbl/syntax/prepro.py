@@ -12,13 +12,18 @@ def _path_find(import_path: List[str], filename: str):
         return fullpath
 
 class Preprocess:
-    def __init__(self, path: str, search_dirs: List[str], ast: Source, ignore=None):
+    def __init__(self, path: str, search_dirs: List[str], ast: Source, ignore=None, parsed: Dict[str, Source]=None):
+        """
+        :param parsed: parsed imports, by absolute path. Imports are looked up here before they are parsed, and added
+        after, so that programs sharing this can share the work of parsing their imports.
+        """
         if ignore is None:
             ignore = []
         self.path = path
         self.search_dirs = search_dirs
         self.ast = ast
         self.ignore = ignore
+        self.parsed = parsed
 
     def preprocess(self) -> Source:
         src = []
@@ -36,18 +41,24 @@ class Preprocess:
                 rm += [top]
                 continue
             self.ignore += [abs_include]
-            with open(inc_path) as fp:
-                source = fp.read()
-                try:
+            try:
+                if self.parsed is not None and abs_include in self.parsed:
+                    # preprocessing removes the imports from the AST, so it gets a copy
+                    ast = list(self.parsed[abs_include])
+                else:
+                    with open(inc_path) as fp:
+                        source = fp.read()
                     parser = Parser(source, inc_path)
                     ast = parser.parse()
-                    prepro = Preprocess(inc_path, self.search_dirs, ast, self.ignore)
-                    src += prepro.preprocess()
-                    src += prepro.ast
-                except ParseError as e:
-                    raise ChainedError(inc_path, e)
-                except ChainedError as e:
-                    raise ChainedError(inc_path, e)
+                    if self.parsed is not None:
+                        self.parsed[abs_include] = list(ast)
+                prepro = Preprocess(inc_path, self.search_dirs, ast, self.ignore, self.parsed)
+                src += prepro.preprocess()
+                src += prepro.ast
+            except ParseError as e:
+                raise ChainedError(inc_path, e)
+            except ChainedError as e:
+                raise ChainedError(inc_path, e)
             rm += [top]
         for r in rm:
             self.ast.remove(r)
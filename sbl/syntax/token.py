@@ -36,6 +36,8 @@ class TokenType(Enum):
     RBRACE = 'right brace'
     LBRACK = 'left square bracket'
     RBRACK = 'right square bracket'
+    LPAREN = 'left parenthesis'
+    RPAREN = 'right parenthesis'
 
 
 class Token:
@@ -88,6 +90,14 @@ class Token:
     def rbrack(rng: Range):
         return Token(TokenType.RBRACK, rng)
 
+    @staticmethod
+    def lparen(rng: Range):
+        return Token(TokenType.LPAREN, rng)
+
+    @staticmethod
+    def rparen(rng: Range):
+        return Token(TokenType.RPAREN, rng)
+
     @staticmethod
     def ident(rng: Range, ident: str):
         return Token(TokenType.IDENT, rng, ident)
@@ -168,6 +178,14 @@ class Tokenizer:
             start = end = copy(self.pos)
             self._adv()
             return Token.rbrack(Range(start, end))
+        elif self.curr_ch == '(':
+            start = end = copy(self.pos)
+            self._adv()
+            return Token.lparen(Range(start, end))
+        elif self.curr_ch == ')':
+            start = end = copy(self.pos)
+            self._adv()
+            return Token.rparen(Range(start, end))
         elif self.curr_ch == '"':
             # string
             start = copy(self.pos)
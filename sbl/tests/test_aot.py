@@ -0,0 +1,72 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from unittest import TestCase
+from sbl.syntax.prepro import *
+from sbl.vm.aot import *
+
+
+class TestAot(TestCase):
+    def compile_source(self, source_text: str, path: str='test', **options) -> FunTable:
+        ast = Parser(source_text, path).parse()
+        ast += Preprocess(path, [], ast).preprocess()
+        return Compiler(ast, meta={'file': path}, **options).compile()
+
+    def load_module(self, module_source: str) -> dict:
+        namespace = {'__name__': 'compiled'}
+        exec(compile(module_source, 'compiled.py', 'exec'), namespace)
+        return namespace
+
+    def test_reachable(self):
+        fun_table = self.compile_source('a { b; } b { 1 .@; } c { a; } main { a; }', inline_threshold=0)
+        self.assertEqual(reachable(fun_table), ['a', 'b', 'main'])
+        module = self.load_module(ModuleWriter(fun_table, 'test').write())
+        self.assertEqual(set(module['FUNS']), {'a', 'b', 'main'})
+
+    def test_module(self):
+        with open('test.sbl') as fp:
+            source = fp.read()
+        out = io.StringIO()
+        with redirect_stdout(out):
+            VM(self.compile_source(source, 'test.sbl')).run()
+        module = self.load_module(ModuleWriter(self.compile_source(source, 'test.sbl'), 'test.sbl').write())
+        compiled_out = io.StringIO()
+        with redirect_stdout(compiled_out):
+            self.assertEqual(module['main'](module['run'], module['FUNS'], 'test.sbl', []), 0)
+        self.assertEqual(compiled_out.getvalue(), out.getvalue())
+
+    def test_standalone(self):
+        # running a compiled module never loads the front end
+        fun_table = self.compile_source('main { "hello" println; }')
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'hello.py'), 'w') as fp:
+                fp.write(ModuleWriter(fun_table, 'test').write())
+            check = "import sys, runpy; runpy.run_path(sys.argv[1]) ; " \
+                    "print(sorted(m for m in sys.modules if m.startswith('sbl.') and m != 'sbl.vm.jitrt' and " \
+                    "m not in ('sbl.common', 'sbl.vm', 'sbl.vm.val', 'sbl.vm.funs', 'sbl.vm.arrays', 'sbl.vm.pvec', " \
+                    "'sbl.vm.byteview', 'sbl.vm.files', 'sbl.vm.sched', 'sbl.vm.pmap')))"
+            env = dict(os.environ, PYTHONPATH=os.getcwd())
+            result = subprocess.run([sys.executable, '-c', check, os.path.join(tmp, 'hello.py')], env=env,
+                                    stdout=subprocess.PIPE, check=True, universal_newlines=True)
+            self.assertEqual(result.stdout, '[]\n')
+            result = subprocess.run([sys.executable, os.path.join(tmp, 'hello.py')], env=env,
+                                    stdout=subprocess.PIPE, check=True, universal_newlines=True)
+            self.assertEqual(result.stdout, 'hello\n')
+
+    def test_errors(self):
+        fun_table = self.compile_source('f { .@; } main { f; }', inline_threshold=0)
+        module = self.load_module(ModuleWriter(fun_table, 'test').write())
+        runtime = module['Runtime'](module['FUNS'])
+        with self.assertRaises(VMError) as cm:
+            module['run'](runtime)
+        self.assertEqual(str(cm.exception), 'attempted to pop an empty stack')
+        self.assertEqual(str(cm.exception.source_range), '1:6-6')
+        self.assertEqual([(f.name, f.callsite) for f in runtime.state.call_stack],
+                         [('main', '<init>'), ('f', '`main` at test:1:18-18')])
+        # functions the translator can't structure are a compile error
+        fun_table['f'].bc.insert(0, BC.jmp(fun_table['f'].bc[0].meta, Val(1, ValType.INT)))
+        with self.assertRaises(CompileError):
+            ModuleWriter(fun_table, 'test').write()
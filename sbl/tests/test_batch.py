@@ -0,0 +1,84 @@
+import io
+import os
+import tempfile
+from contextlib import redirect_stdout, redirect_stderr
+from unittest import TestCase
+from unittest.mock import patch
+import sbl.batch
+from sbl.batch import *
+
+
+def _crashing_job(args, path: str, timeout: float=0) -> JobResult:
+    # kills the worker running it, as running out of memory would
+    if path.endswith('fail.sbl'):
+        os._exit(1)
+    return run_job(args, path, timeout)
+
+
+class TestBatch(TestCase):
+    PROGRAMS = {
+        'lib.sbl': 'double { ^ +; }',
+        'ok.sbl': 'import "lib.sbl"; main { 21 double println; }',
+        'fail.sbl': 'import "lib.sbl"; main { "before" println [] 3 get; }',
+        'loop.sbl': 'main { T; loop { } }',
+    }
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        for name, source in self.PROGRAMS.items():
+            with open(self.path(name), 'w') as fp:
+                fp.write(source)
+        self.environ = dict(os.environ)
+        os.environ['SBL_PATH'] = self.tmp.name
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        self.tmp.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.tmp.name, name)
+
+    def test_run_job(self):
+        args = parse_batch_args(['--timeout', '0.2', self.path('ok.sbl')])
+        result = run_job(args, self.path('ok.sbl'))
+        self.assertEqual((result.status, result.stdout, result.stderr), (0, '42\n', ''))
+        result = run_job(args, self.path('fail.sbl'))
+        self.assertEqual((result.status, result.stdout, result.describe()), (1, 'before\n', 'exit 1'))
+        self.assertIn('index 3 is out of range for a stack with 0 items', result.stderr)
+        # the import was only parsed once
+        self.assertEqual(list(sbl.batch._parsed), [os.path.abspath(self.path('lib.sbl'))])
+        result = run_job(args, self.path('loop.sbl'), timeout=0.2)
+        self.assertTrue(result.timed_out)
+        self.assertEqual(result.stderr, 'Timed out after 0.2s\n')
+
+    def test_batch(self):
+        with open(self.path('jobs.txt'), 'w') as fp:
+            fp.write('ok.sbl\n# skipped\n\nfail.sbl\nloop.sbl\n')
+        out = io.StringIO()
+        err = io.StringIO()
+        with redirect_stdout(out), redirect_stderr(err):
+            status = batch_main(['-j', '2', '--timeout', '0.5', '-m', self.path('jobs.txt'),
+                                 '--output-dir', self.path('out')])
+        self.assertEqual(status, 1)
+        self.assertEqual(out.getvalue(), '')
+        summary = err.getvalue().splitlines()
+        self.assertEqual([line.split()[1] for line in summary[1:4]], ['ok', 'exit', 'timeout'])
+        self.assertEqual(summary[-1].split(' in ')[0], '3 programs: 1 ok, 1 failed, 1 timed out')
+        with open(self.path('out/0-ok.sbl.stdout')) as fp:
+            self.assertEqual(fp.read(), '42\n')
+        with open(self.path('out/1-fail.sbl.stdout')) as fp:
+            self.assertEqual(fp.read(), 'before\n')
+
+    def test_worker_died(self):
+        out = io.StringIO()
+        err = io.StringIO()
+        with patch('sbl.batch.run_job', _crashing_job), redirect_stdout(out), redirect_stderr(err):
+            status = batch_main(['-j', '1', self.path('ok.sbl'), self.path('fail.sbl'), self.path('loop.sbl')])
+        self.assertEqual(status, 1)
+        self.assertEqual(out.getvalue(), '42\n')
+        lines = err.getvalue().splitlines()
+        self.assertEqual(lines[0], 'A worker process died before this program finished')
+        summary = lines[-5:]
+        self.assertEqual([line.split()[1] for line in summary[1:4]], ['ok', 'crashed', 'crashed'])
+        self.assertEqual(summary[-1].split(' in ')[0], '3 programs: 1 ok, 2 failed, 0 timed out')
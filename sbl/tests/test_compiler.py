@@ -1,16 +1,17 @@
 from unittest import TestCase
 from sbl.syntax.prepro import *
 from sbl.vm.compile import *
+from sbl.vm.analysis import *
 from sbl.vm.bc import *
 from sbl.vm.val import *
 
 
 class TestCompiler(TestCase):
-    def compile_source(self, source_text: str) -> FunTable:
+    def compile_source(self, source_text: str, **options) -> FunTable:
         path = 'test'
         ast = Parser(source_text, path).parse()
         ast += Preprocess(path, [], ast).preprocess()
-        return Compiler(ast, meta={'file': path}).compile()
+        return Compiler(ast, meta={'file': path}, **options).compile()
 
     def test_push(self):
         fun_table = self.compile_source('''
@@ -58,3 +59,118 @@ class TestCompiler(TestCase):
             BC.pop(None, Val(None, ValType.NIL)),
             BC.ret(None),
         ])
+
+    def test_inline(self):
+        source = '''
+            square { ^ *; }
+            fact { ^ 1 >; br { .@ ^ 1 - fact *; } el { .@; } }
+            main { 3 square fact; }
+        '''
+        fun_table = self.compile_source(source, specialize=False)
+        self.assertEqual(fun_table['main'].bc, [
+            BC.push(None, Val(3, ValType.INT)),
+            BC.call(None, Val('^', ValType.IDENT)),
+            BC.call(None, Val('*', ValType.IDENT)),
+            BC.call(None, Val('fact', ValType.IDENT)),
+            BC.ret(None),
+        ])
+        # inlined code keeps the source location of the callee
+        self.assertEqual(fun_table['main'].bc[1].meta['where'], fun_table['square'].bc[0].meta['where'])
+        self.assertEqual(fun_table['main'].bc[1].meta['inlined_from'], 'square')
+
+        fun_table = self.compile_source(source, inline_threshold=0)
+        self.assertEqual(fun_table['main'].bc, [
+            BC.push(None, Val(3, ValType.INT)),
+            BC.call(None, Val('square', ValType.IDENT)),
+            BC.call(None, Val('fact', ValType.IDENT)),
+            BC.ret(None),
+        ])
+
+    def test_inline_jumps(self):
+        fun_table = self.compile_source('''
+            abs { ^ 0 <; br { .@ u-; } el { .@; } }
+            main { T; br { 5 abs; } }
+        ''', specialize=False)
+        # jumps in both the caller and the inlined body are relocated
+        self.assertEqual(fun_table['main'].bc, [
+            BC.push(None, Val(True, ValType.BOOL)),
+            BC.jmpz(None, Val(11, ValType.INT)),
+            BC.push(None, Val(5, ValType.INT)),
+            BC.call(None, Val('^', ValType.IDENT)),
+            BC.push(None, Val(0, ValType.INT)),
+            BC.call(None, Val('<', ValType.IDENT)),
+            BC.jmpz(None, Val(10, ValType.INT)),
+            BC.pop(None, Val(None, ValType.NIL)),
+            BC.call(None, Val('u-', ValType.IDENT)),
+            BC.jmp(None, Val(11, ValType.INT)),
+            BC.pop(None, Val(None, ValType.NIL)),
+            BC.ret(None),
+        ])
+
+    def test_stack_effects(self):
+        fun_table = self.compile_source('''
+            square { ^ *; }
+            fact { ^ 1 >; br { .@ ^ 1 - fact *; } el { .@; } }
+            fill { .n; n 0 >; loop { .@ n n 1 - .n n 0 >; } .@; }
+            drain { $ 0 >; loop { .@ .@ $ 0 >; } .@; }
+            main { 3 square fact; }
+        ''', inline_threshold=0)
+        self.assertEqual(fun_table['square'].effect, StackEffect(1, 0, 0))
+        self.assertEqual(fun_table['fact'].effect, StackEffect(1, 0, 0))
+        self.assertTrue(fun_table['fact'].effect.is_fixed())
+        # pushes a variable number of items, but never pops more than it was given
+        self.assertTrue(fun_table['fill'].effect.is_safe())
+        self.assertFalse(fun_table['fill'].effect.is_fixed())
+        self.assertFalse(fun_table['drain'].effect.is_safe())
+
+    def test_static_underflow(self):
+        with self.assertRaises(CompileError):
+            self.compile_source('main { 1 .a .b; }')
+        with self.assertRaises(CompileError):
+            self.compile_source('main { T; br { 1; } el { 2; } + +; }')
+        # callees only need an upper bound, so calling them with too few items is left to the VM
+        self.compile_source('f { .@; } main { f; }', inline_threshold=0)
+
+    def test_specialize(self):
+        fun_table = self.compile_source('''
+            count {
+                10 .n;
+                n 0 >;
+                loop { .@ n 1 - .n n 0 >; }
+                .@ .x x 1 +;
+            }
+        ''')
+        self.assertEqual(fun_table['count'].bc, [
+            BC.push(None, Val(10, ValType.INT)),
+            BC.pop(None, Val('n', ValType.IDENT)),
+            BC.load(None, Val('n', ValType.IDENT)),
+            BC.push(None, Val(0, ValType.INT)),
+            BC.int_op(None, BCType.INT_GT),
+            BC.jmpz(None, Val(15, ValType.INT)),
+            BC.pop(None, Val(None, ValType.NIL)),
+            BC.load(None, Val('n', ValType.IDENT)),
+            BC.push(None, Val(1, ValType.INT)),
+            BC.int_op(None, BCType.INT_SUB),
+            BC.pop(None, Val('n', ValType.IDENT)),
+            BC.load(None, Val('n', ValType.IDENT)),
+            BC.push(None, Val(0, ValType.INT)),
+            BC.int_op(None, BCType.INT_GT),
+            BC.jmp(None, Val(5, ValType.INT)),
+            BC.pop(None, Val(None, ValType.NIL)),
+            BC.pop(None, Val('x', ValType.IDENT)),
+            BC.load(None, Val('x', ValType.IDENT)),
+            BC.push(None, Val(1, ValType.INT)),
+            # x came from a value of unknown type
+            BC.call(None, Val('+', ValType.IDENT)),
+            BC.ret(None),
+        ])
+
+    def test_maps(self):
+        fun_table = self.compile_source('main { (1 2) (1 x) .@ .@; }')
+        self.assertEqual(fun_table['main'].bc[:5], [
+            BC.push(None, Val({Val(1, ValType.INT): Val(2, ValType.INT)}, ValType.MAP)),
+            BC.push(None, Val({}, ValType.MAP)),
+            BC.push(None, Val(1, ValType.INT)),
+            BC.load(None, Val('x', ValType.IDENT)),
+            BC.putl(None),
+        ])
@@ -129,3 +129,24 @@ class TestParser(TestCase):
         self.assertEqual(p._expect_import().path, 'foo.sbl')
         self.assertEqual(p._expect_import().path, 'bar.sbl')
         self.assertTrue(p.is_end())
+
+    def test_maps(self):
+        p = Parser("""
+            (1 "one" 'a [1 2]) () (x (T F))
+            (1)
+            ([1] 2)
+            """, 'test')
+        item = p._expect_item()
+        self.assertEqual(item.type, ItemType.MAP)
+        self.assertEqual([(key.val, val.type) for key, val in item.val], [(1, ItemType.STRING), ('a', ItemType.STACK)])
+        self.assertEqual(item.to_val(), Val({Val(1, ValType.INT): Val("one", ValType.STRING),
+                                             Val('a', ValType.CHAR): Val([Val(1, ValType.INT), Val(2, ValType.INT)],
+                                                                         ValType.STACK)}, ValType.MAP))
+        self.assert_item(p._expect_item(), ItemType.MAP, [])
+        item = p._expect_item()
+        self.assertFalse(item.is_const())
+        self.assertEqual(item.val[0][1].type, ItemType.MAP)
+        with self.assertRaises(ParseError):
+            p._expect_item()
+        with self.assertRaises(ParseError):
+            p._expect_item()
@@ -0,0 +1,78 @@
+import io
+import os
+import tempfile
+from contextlib import redirect_stdout
+from unittest import TestCase
+from sbl.syntax.prepro import *
+from sbl.vm.profiler import *
+
+
+class TestProfiler(TestCase):
+    SOURCE = '''
+    fib { ^ 2 <; br { .@; } el { .@ ^ 1 - fib .a 2 - fib a +; } }
+    square { ^ *; }
+    main {
+        3 square .@ 4 square .@;
+        10 fib println;
+    }
+    '''
+
+    def compile_source(self, source_text: str) -> FunTable:
+        path = 'test'
+        ast = Parser(source_text, path).parse()
+        ast += Preprocess(path, [], ast).preprocess()
+        return Compiler(ast, meta={'file': path}, inline_threshold=0).compile()
+
+    def test_calls(self):
+        vm = ProfilingVM(self.compile_source(self.SOURCE))
+        out = io.StringIO()
+        with redirect_stdout(out):
+            vm.run()
+        self.assertEqual(out.getvalue(), '55\n')
+        self.assertEqual({name: stats.calls for name, stats in vm.stats.items()}, {'main': 1, 'square': 2, 'fib': 177})
+        for stats in vm.stats.values():
+            self.assertLessEqual(stats.own, stats.total)
+        # recursive calls are only counted once towards a function's total time
+        self.assertLessEqual(vm.stats['fib'].total, vm.stats['main'].total)
+        stacks = dict(vm.collapsed())
+        self.assertIn('main;square', stacks)
+        # fib(10) goes as deep as fib(1)
+        self.assertIn(';'.join(['main'] + ['fib'] * 10), stacks)
+        self.assertNotIn(';'.join(['main'] + ['fib'] * 11), stacks)
+        report = io.StringIO()
+        vm.report(report, top=2)
+        lines = report.getvalue().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].endswith('fib (test:2:5-65)'))
+
+    def test_sample(self):
+        fun_table = self.compile_source(self.SOURCE)
+        vm = VM(fun_table)
+        sampler = Sampler(vm)
+        main = fun_table['main']
+        vm.state.push_fun(main, '<init>')
+        # at the call to fib
+        vm.state.call_stack[-1].pc = [bc.val and bc.val.val for bc in main.bc].index('fib')
+        vm.state.push_fun(fun_table['fib'], 'main')
+        for _ in range(3):
+            sampler.sample()
+        vm.state.pop_fun()
+        sampler.sample()
+        self.assertEqual(sampler.samples, 4)
+        self.assertEqual(dict(sampler.collapsed()), {'main (test:6);fib (test:2)': 3, 'main (test:6)': 1})
+        report = io.StringIO()
+        sampler.report(report)
+        lines = report.getvalue().splitlines()
+        self.assertEqual(lines[0], '4 samples')
+        self.assertEqual(lines[2].split(), ['3', '75.0%', '3', '75.0%', 'fib', '(test:2:5-65)'])
+        self.assertEqual(lines[3].split(), ['1', '25.0%', '4', '100.0%', 'main', '(test:4:5-7:5)'])
+        self.assertEqual(lines[5].split(), ['3', '75.0%', 'test:2', 'in', 'fib'])
+        # samples are taken in the background while a program runs
+        with Sampler(VM(fun_table), interval=0.0001) as sampler:
+            with redirect_stdout(io.StringIO()):
+                sampler.vm.run()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'stacks')
+            write_collapsed(path, sampler.collapsed())
+            with open(path) as fp:
+                self.assertEqual(sum(int(line.rsplit(' ', 1)[1]) for line in fp), sampler.samples)
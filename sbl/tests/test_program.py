@@ -0,0 +1,57 @@
+import io
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from sbl.program import *
+
+
+class TestProgram(TestCase):
+    SOURCE = '''
+    square { ^ *; }
+    half { 2 /; }
+    tally { .n [1 2 3] .s s n push .s s; }
+    main { "hello" println; }
+    '''
+
+    def test_run(self):
+        program = Program.compile(self.SOURCE)
+        self.assertEqual(program.run(7, fname='square'), [49])
+        self.assertEqual(program.run('a', 2, 3, fname='square'), ['a', 2, 9])
+        # the constant stack is copied when it's changed, so every run starts from the same one
+        for engine in ENGINES:
+            with self.subTest(engine=engine):
+                self.assertEqual(program.run(4, fname='tally', engine=engine), [[1, 2, 3, 4]])
+                self.assertEqual(program.run(5, fname='tally', engine=engine), [[1, 2, 3, 5]])
+        out = io.StringIO()
+        self.assertEqual(program.run(stdout=out), [])
+        self.assertEqual(out.getvalue(), 'hello\n')
+        with self.assertRaises(ValueError):
+            program.run(fname='missing')
+        with self.assertRaises(ChainedError):
+            program.run('a', fname='half')
+        with self.assertRaises(TypeError):
+            program.run(1.5)
+        with self.assertRaises(TypeError):
+            program.run({(1, 2): 3})
+
+    def test_threads(self):
+        program = Program.compile(self.SOURCE)
+
+        def serve(n: int):
+            out = io.StringIO()
+            engine = list(ENGINES)[n % len(ENGINES)]
+            return program.run(n, fname='tally', engine=engine) + program.run(stdout=out) + [out.getvalue()]
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(serve, range(32)))
+        self.assertEqual(results, [[[1, 2, 3, n], 'hello\n'] for n in range(32)])
+
+    def test_values(self):
+        values = [None, True, 3, 'text', b'bytes', [1, [2]], {'key': [None]}]
+        self.assertEqual([from_val(to_val(value)) for value in values], values)
+        self.assertEqual(from_val(to_val((1, 2))), [1, 2])
+
+    def test_pickle(self):
+        program = pickle.loads(pickle.dumps(Program.compile(self.SOURCE)))
+        self.assertIs(program.builtins['+'], BUILTINS['+'])
+        self.assertEqual(program.run(3, fname='square', engine='pyjit'), [9])
@@ -0,0 +1,45 @@
+import random
+from unittest import TestCase
+
+from sbl.vm.pvec import *
+
+
+class TestPVec(TestCase):
+    def test_build(self):
+        # sizes around the edges of the tail and of each level of the trie
+        for size in [0, 1, WIDTH - 1, WIDTH, WIDTH + 1, WIDTH * WIDTH, WIDTH * WIDTH + WIDTH + 1, WIDTH ** 3 + 3]:
+            items = list(range(size))
+            vec = PVec(items)
+            self.assertEqual(len(vec), size)
+            self.assertEqual(vec.tolist(), items)
+            self.assertEqual(vec, PVec().extend(items))
+            if size:
+                self.assertEqual((vec[0], vec[-1], vec[size // 2]), (0, size - 1, size // 2))
+        with self.assertRaises(IndexError):
+            PVec([1])[1]
+        with self.assertRaises(IndexError):
+            PVec().pop()
+
+    def test_versions(self):
+        rng = random.Random(0)
+        vec = PVec()
+        items = []
+        versions = []
+        for step in range(20000):
+            choice = rng.random()
+            if choice < 0.6 or not items:
+                vec = vec.append(step)
+                items.append(step)
+            elif choice < 0.85:
+                vec, item = vec.pop()
+                self.assertEqual(item, items.pop())
+            else:
+                index = rng.randrange(len(items))
+                vec = vec.set(index, -step)
+                items[index] = -step
+            if step % 500 == 0:
+                versions += [(vec, list(items))]
+        # old versions are never changed by making new ones
+        for vec, items in versions:
+            self.assertEqual(vec.tolist(), items)
+        self.assertEqual(versions[-1][0][3:10], versions[-1][1][3:10])
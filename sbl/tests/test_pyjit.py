@@ -0,0 +1,107 @@
+import io
+from contextlib import redirect_stdout
+from unittest import TestCase
+from sbl.syntax.prepro import *
+from sbl.vm.pyjit import *
+
+
+class TestPyJit(TestCase):
+    def compile_source(self, source_text: str, path: str='test', **options) -> FunTable:
+        ast = Parser(source_text, path).parse()
+        ast += Preprocess(path, [], ast).preprocess()
+        return Compiler(ast, meta={'file': path}, **options).compile()
+
+    def run_vm(self, vm: VM) -> (str, List[Val]):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            vm.run()
+        return out.getvalue(), vm.state.stack
+
+    def assertConforms(self, source_text: str, path: str='test', **options):
+        """
+        Asserts that a program is fully translated, and does the same thing translated as it does interpreted.
+        """
+        fun_table = self.compile_source(source_text, path, **options)
+        jit = JitVM(fun_table)
+        self.assertEqual(set(jit.jitted), set(fun_table))
+        self.assertEqual(self.run_vm(jit), self.run_vm(VM(fun_table)))
+
+    def test_conformance(self):
+        with open('test.sbl') as fp:
+            self.assertConforms(fp.read(), 'test.sbl')
+        with open('test.sbl') as fp:
+            self.assertConforms(fp.read(), 'test.sbl', inline_threshold=0, specialize=False)
+        with open('test.sbl') as fp:
+            self.assertConforms(fp.read(), 'test.sbl', persistent_stacks=True)
+        self.assertConforms('''
+            fact { ^ 1 >; br { .@ ^ 1 - fact *; } el { .@; } }
+            main { 5 fact println [1 2 3] pop println .@; }
+        ''')
+        # nested branches, including a `br` whose block ends with a `br`/`el`
+        self.assertConforms('''
+            classify {
+                .n;
+                n 0 <; br { .@ "negative"; } el {
+                    .@ n 0 ==; br { .@ "zero"; } el { .@ n 100 <; br { .@ "small"; } el { .@ "large"; } }
+                }
+            }
+            check { ^ 1 ==; br { .@ ^ 2 ==; br { .@ "two"; } el { .@ "not two"; } } .@; }
+            main {
+                5 u- classify println 0 classify println 5 classify println 500 classify println
+                1 check;
+                0 .i; i 3 <; loop { .@ i 0 .j; j 3 <; loop { .@ j println j 1 + .j; j 3 <; } .@ .@ i 1 + .i; i 3 <; } .@;
+            }
+        ''')
+        # maps built from locals, and keyed builtins
+        self.assertConforms('''
+            count {
+                .s () .m 0 .i; s len .n .@; i n <;
+                loop { .@ s i get .k .@ m k get ^ @ ==; br { .@ .@ 0; } el { .@; } 1 + .c .@ m k c put .m i 1 + .i; i n <; }
+                .@ m;
+            }
+            main { ["a" "b" "a" "c" "a"] count ^ println "a" get println .@ 1 .x (x "x" "y" x) println; }
+        ''')
+
+    def test_errors(self):
+        # errors point at the same place as they do in the interpreter
+        sources = [
+            'f { x; } main { f; }',
+            'f { .@; } main { f; }',
+            'f { .3; } main { 1 2 f; }',
+            'f { 1 "a" -; } main { f; }',
+            'f { nil [] 1 pushl; } main { f; }',
+        ]
+        for source in sources:
+            fun_table = self.compile_source(source, inline_threshold=0)
+            errors = []
+            for vm in [VM(fun_table), JitVM(fun_table)]:
+                try:
+                    self.run_vm(vm)
+                except VMError as e:
+                    errors += [str(e)]
+                    errors += [vm.state.current_loc()]
+                except ChainedError as e:
+                    errors += [str(e.err)]
+                    errors += [vm.state.current_loc()]
+            self.assertEqual(len(errors), 4, source)
+            self.assertEqual(errors[:2], errors[2:], source)
+
+    def test_fallback(self):
+        # calls to unknown functions are left to the interpreter to report
+        fun_table = self.compile_source('g { 1 println; } main { g; }', inline_threshold=0)
+        fun_table['g'].bc[0] = BC.call(fun_table['g'].bc[0].meta, Val('nowhere', ValType.IDENT))
+        jit = JitVM(fun_table)
+        self.assertEqual(set(jit.jitted), {'main'})
+        with self.assertRaises(VMError):
+            jit.run()
+
+    def test_metered(self):
+        fun_table = self.compile_source('main { 0 .i; i 3 <; loop { .@ i 1 + .i; i 3 <; } }')
+        jit_code = JitCode(fun_table)
+        self.assertNotIn('meter', JitVM(fun_table, jit_code=jit_code).source)
+        # only the limits that are set are checked, and translations for them are shared
+        source = JitVM(fun_table, limits=Limits(instructions=100), jit_code=jit_code).source
+        self.assertIn('meter.next_check', source)
+        self.assertNotIn('max_stack', source)
+        self.assertIs(jit_code.metered(Limits(instructions=5)), jit_code.metered(Limits(time=1)))
+        self.assertIs(jit_code.metered(Limits()), jit_code)
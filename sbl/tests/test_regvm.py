@@ -0,0 +1,91 @@
+import io
+from contextlib import redirect_stdout
+from unittest import TestCase
+from sbl.syntax.prepro import *
+from sbl.vm.regvm import *
+
+
+class TestRegVM(TestCase):
+    def compile_source(self, source_text: str, path: str='test', **options) -> FunTable:
+        ast = Parser(source_text, path).parse()
+        ast += Preprocess(path, [], ast).preprocess()
+        return Compiler(ast, meta={'file': path}, **options).compile()
+
+    def run_vm(self, vm: VM) -> (str, List[Val]):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            vm.run()
+        return out.getvalue(), vm.state.stack
+
+    def assertConforms(self, source_text: str, path: str='test', **options) -> RegVM:
+        fun_table = self.compile_source(source_text, path, **options)
+        regvm = RegVM(fun_table, hot_calls=1)
+        self.assertEqual(self.run_vm(regvm), self.run_vm(VM(fun_table)))
+        return regvm
+
+    def test_ir(self):
+        fun_table = self.compile_source('''
+            f { .x .y y y 1 + *; }
+            g { .n n 0 >; br { .@ n; } el { .@ n u-; } }
+            main { 1 2 f 3 g .@ .@; }
+        ''', inline_threshold=0)
+        builder = IRBuilder(fun_table, BUILTINS)
+        # `.x` is never loaded, so its store is dead; loads of `y` read the register it was stored from
+        self.assertEqual(str(optimize(builder.build(fun_table['f']))), '\n'.join([
+            'f: need 2',
+            'B0:',
+            '    s2 = CONST Val(integer `1`)',
+            '    s1 = CALL_INT +(s0, s2)',
+            '    s0 = CALL_INT *(s0, s1)',
+            '    RET s0',
+        ]))
+        ir = optimize(builder.build(fun_table['g']))
+        self.assertEqual([instr.format(ir.names) for instr in ir.blocks[2].instrs], ['s0 = CALL u-(`n`)'])
+        # functions whose stack depth isn't known exactly can't be translated
+        fun_table = self.compile_source('main { 0 .i; i 3 <; loop { i 1 + .i; i 3 <; } }')
+        self.assertIsNone(IRBuilder(fun_table, BUILTINS).build(fun_table['main']))
+
+    def test_conformance(self):
+        with open('test.sbl') as fp:
+            source = fp.read()
+        self.assertConforms(source, 'test.sbl')
+        self.assertConforms(source, 'test.sbl', inline_threshold=0, specialize=False)
+        regvm = self.assertConforms('''
+            fib { ^ 2 <; br { .@; } el { .@ .n n 1 - fib n 2 - fib +; } }
+            count { .n 0 .i; i n <; loop { .@ i println i 1 + .i; i n <; } .@; }
+            mixed { + ; }
+            depth { $; }
+            deep { depth; }
+            main { 12 fib println 3 count 1 2 mixed "a" "b" mixed 7 8 deep 9 depth; }
+        ''', inline_threshold=0)
+        self.assertEqual({name for name, code in regvm.code.items() if code is not None},
+                         {'fib', 'count', 'mixed', 'depth', 'deep', 'main'})
+        # maps built from locals, and keyed builtins
+        self.assertConforms('''
+            count {
+                .s () .m 0 .i; s len .n .@; i n <;
+                loop { .@ s i get .k .@ m k get ^ @ ==; br { .@ .@ 0; } el { .@; } 1 + .c .@ m k c put .m i 1 + .i; i n <; }
+                .@ m;
+            }
+            main { ["a" "b" "a" "c" "a"] count ^ println "a" get println .@ 1 .x (x "x" "y" x) println; }
+        ''', inline_threshold=0)
+
+    def test_errors(self):
+        # errors point at the same place as they do in the interpreter
+        sources = [
+            'f { x; } main { f; }',
+            'f { 1 "a" -; } main { f; }',
+            'f { nil 1 pushl; } main { f; }',
+        ]
+        for source in sources:
+            fun_table = self.compile_source(source, inline_threshold=0)
+            errors = []
+            for vm in [VM(fun_table), RegVM(fun_table, hot_calls=1)]:
+                try:
+                    self.run_vm(vm)
+                except VMError as e:
+                    errors += [str(e), vm.state.current_loc()]
+                except ChainedError as e:
+                    errors += [str(e.err), vm.state.current_loc()]
+            self.assertEqual(len(errors), 4, source)
+            self.assertEqual(errors[:2], errors[2:], source)
@@ -0,0 +1,74 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import TestCase
+from sbl import client
+from sbl.server import *
+
+
+class TestServer(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.write('lib.sbl', 'double { ^ +; }')
+        self.write('main.sbl', 'import "lib.sbl"; main { 21 double println; }')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.tmp.name, name)
+
+    def write(self, name: str, source: str):
+        with open(self.path(name), 'w') as fp:
+            fp.write(source)
+
+    def test_compile_cache(self):
+        cache = CompileCache()
+        args = parse_args([self.path('main.sbl')])
+        search_dirs = [self.tmp.name]
+        self.assertEqual(run_file(args, search_dirs, compiled=cache), 0)
+        fun_table = cache.get(args, search_dirs)
+        self.assertIsNotNone(fun_table)
+        self.assertIs(cache.get(args, search_dirs), fun_table)
+        # other options compile the program differently
+        self.assertIsNone(cache.get(parse_args(['--inline-threshold=0', self.path('main.sbl')]), search_dirs))
+        # changing an import compiles the program again
+        stat = os.stat(self.path('lib.sbl'))
+        os.utime(self.path('lib.sbl'), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertIsNone(cache.get(args, search_dirs))
+
+    def test_serve(self):
+        socket_path = self.path('sbl.sock')
+        env = dict(os.environ, PYTHONPATH=os.getcwd())
+        server = subprocess.Popen([sys.executable, '-c', 'import sys; from sbl.sbl import main; main()', 'serve',
+                                   '--socket', socket_path, '-j', '2'], env=env, stderr=subprocess.PIPE)
+        try:
+            self.assertIn(b'Serving on', server.stderr.readline())
+            environ = dict(os.environ)
+            os.environ['SBL_PATH'] = self.tmp.name
+            try:
+                out = io.StringIO()
+                err = io.StringIO()
+                self.assertEqual(client.request([self.path('main.sbl')], socket_path, out, err), 0)
+                self.assertEqual((out.getvalue(), err.getvalue()), ('42\n', ''))
+                # changes are picked up by the next run
+                self.write('lib.sbl', 'double { ^ ^ + +; }')
+                out = io.StringIO()
+                self.assertEqual(client.request([self.path('main.sbl')], socket_path, out, io.StringIO()), 0)
+                self.assertEqual(out.getvalue(), '63\n')
+                err = io.StringIO()
+                self.assertEqual(client.request([self.path('missing.sbl')], socket_path, io.StringIO(), err), 1)
+                self.assertIn('File not found', err.getvalue())
+                self.assertEqual(client.request(['--engine=bogus', 'main.sbl'], socket_path, io.StringIO(),
+                                                io.StringIO()), 2)
+            finally:
+                os.environ.clear()
+                os.environ.update(environ)
+        finally:
+            server.terminate()
+            server.wait(10)
+            server.stderr.close()
+        self.assertFalse(os.path.exists(socket_path))
@@ -0,0 +1,554 @@
+import io
+import mmap
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from functools import partial
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+from sbl.syntax.prepro import *
+from sbl.vm.vm import *
+from sbl.vm import arrays, files
+from sbl.vm.byteview import ByteView
+from sbl.vm.checkpoint import Checkpoint, CheckpointError
+from sbl.vm.pyjit import JitVM
+from sbl.vm.regvm import RegVM
+
+
+class TestVM(TestCase):
+    def compile_source(self, source_text: str, **options) -> FunTable:
+        path = 'test'
+        ast = Parser(source_text, path).parse()
+        ast += Preprocess(path, [], ast).preprocess()
+        return Compiler(ast, meta={'file': path}, **options).compile()
+
+    def run_source(self, source_text: str, compile_options=None, **options) -> str:
+        vm = VM(self.compile_source(source_text, **(compile_options or {})), **options)
+        out = io.StringIO()
+        with redirect_stdout(out):
+            vm.run()
+        return out.getvalue()
+
+    def test_run(self):
+        self.assertEqual(self.run_source('''
+            fact { ^ 1 >; br { .@ ^ 1 - fact *; } el { .@; } }
+            main { 5 fact println [1 2 3] pop println .@; }
+        '''), '120\n3\n')
+
+    def test_underflow(self):
+        # f is proven safe given one item, so calling it with none falls back to the checked path
+        with self.assertRaises(VMError):
+            self.run_source('f { .@; } main { f; }', compile_options={'inline_threshold': 0})
+        with self.assertRaises(VMError):
+            self.run_source('f { .2; } main { 1 f; }', compile_options={'inline_threshold': 0})
+
+    def test_adaptive(self):
+        fun_table = self.compile_source('''
+            add { +; }
+            main {
+                0 .i;
+                i 20 <;
+                loop {
+                    .@;
+                    i i add .@;
+                    i 1 + .i;
+                    i 20 <;
+                }
+                .@;
+                1 2 add "a" "a" add;
+            }
+        ''', inline_threshold=0)
+        vm = VM(fun_table, adaptive=True)
+        vm.run()
+        self.assertEqual(vm.state.stack, [Val(3, ValType.INT), Val("aa", ValType.STRING)])
+        # the shared program is never rewritten
+        self.assertEqual(fun_table['add'].bc[0].code, BCType.CALL)
+        # `+` in `add` was quickened for integers, then put back when it saw strings
+        site = vm.adaptive.sites[('add', 0)]
+        self.assertEqual((site.quickenings, site.deopts), (1, 1))
+        self.assertEqual(vm.funs['add'].bc[0].code, BCType.CALL)
+        self.assertIsInstance(vm.funs['main'].bc[7], QuickBC)
+
+    def test_memoize(self):
+        source = '''
+            fib { ^ 2 <; br { .@; } el { .@ .n n 1 - fib n 2 - fib +; } }
+            show { ^ println; }
+            main { 25 fib show .@; }
+        '''
+        fun_table = self.compile_source(source)
+        self.assertTrue(fun_table['fib'].pure)
+        self.assertFalse(fun_table['show'].pure)
+        self.assertFalse(fun_table['main'].pure)
+        vm = VM(fun_table, memo_size=8)
+        out = io.StringIO()
+        with redirect_stdout(out):
+            vm.run()
+        self.assertEqual(out.getvalue(), '75025\n')
+        # each fib(n) is computed once, and the cache never grows past its bound
+        self.assertEqual(vm.memo.misses['fib'], 26)
+        self.assertEqual(vm.memo.hits['fib'], 23)
+        self.assertEqual(len(vm.memo.entries), 8)
+        # changing a memoized stack or map, or a stack inside of one, leaves the cached result alone
+        source = '''
+            mk { [1 2 3]; }
+            nested { [[1] 2] (1 [3]); }
+            main {
+                mk 9 push println mk println;
+                nested .m .s s 0 get 7 push .@ .@ m 1 get 8 push .@ .@ nested println println s println m println;
+            }
+        '''
+        self.assertEqual(self.run_source(source, {'inline_threshold': 0}, memo_size=8),
+                         '[1, 2, 3, 9]\n[1, 2, 3]\n(1: [3])\n[[1], 2]\n[[1, 7], 2]\n(1: [3, 8])\n')
+
+    def test_stack_builtins(self):
+        self.assertEqual(self.run_source('''
+            main {
+                [10 20 30] .s;
+                s 0 get println .@;
+                s 1 u- get println .@;
+                s 1 99 set peek println .@;
+                s 1 3 slice println .@;
+                s [40 50] extend println;
+                s [1 2] concat println;
+                s reverse println;
+                [3 1 2] sort println;
+                ["b" "a"] sort println;
+                [] 0 0 slice println .@;
+            }
+        '''), '10\n30\n30\n[99, 30]\n[10, 99, 30, 40, 50]\n[10, 99, 30, 40, 50, 1, 2]\n[50, 40, 30, 99, 10]\n'
+              '[1, 2, 3]\n[a, b]\n[]\n')
+        errors = [
+            ('main { [1 2] 2 get; }', 'get', 'index 2 is out of range for a stack with 2 items'),
+            ('main { [1 2] 3 u- get; }', 'get', 'index -3 is out of range for a stack with 2 items'),
+            ('main { [1 2] "a" get; }', 'get', 'expected an integer index for `get` function; instead got ValType.STRING'),
+            ('main { 1 peek; }', 'peek', 'expected a stack for `peek` function; instead got ValType.INT'),
+            ('main { [] peek; }', 'peek', 'attempted to peek at an empty stack'),
+            ('main { [1 "a"] sort; }', 'sort', 'can only sort stacks of integers, characters, or strings of one type; '
+                                               'instead got integer, string'),
+        ]
+        for source, name, message in errors:
+            with self.assertRaises(ChainedError) as cm:
+                self.run_source(source)
+            self.assertEqual(str(cm.exception.err), message)
+            start = source.index(name) + 1
+            self.assertEqual(str(cm.exception.err.source_range), f"1:{start}-{start + len(name) - 1}")
+
+    def test_maps(self):
+        self.assertEqual(self.run_source('''
+            main {
+                (1 "one" "two" 2) .m;
+                m 1 get println .@;
+                m "three" get println .@;
+                m 3 "three" put 1 delete 9 delete len println .@;
+                m "two" has println 1 has println .@;
+                m keys println .@;
+                m println;
+                5 .x (x [x] 'c T) println;
+                () 1 (1 2) put 1 get 1 get println .@ .@;
+            }
+        '''), 'one\nNil\n2\nT\nF\n[two, 3]\n(two: 2, 3: three)\n(5: [5], c: T)\n2\n')
+        errors = [
+            ('main { (1 2) [1] get; }', 'get', 'map keys can not be stacks (in `get` function)'),
+            ('main { [1] 1 2 put; }', 'put', 'expected a map for `put` function; instead got ValType.STACK'),
+            ('main { 1 2 has; }', 'has', 'expected a map for `has` function; instead got ValType.INT'),
+        ]
+        for source, name, message in errors:
+            with self.assertRaises(ChainedError) as cm:
+                self.run_source(source)
+            self.assertEqual(str(cm.exception.err), message)
+            start = source.index(name) + 1
+            self.assertEqual(str(cm.exception.err.source_range), f"1:{start}-{start + len(name) - 1}")
+        with self.assertRaises(VMError) as cm:
+            self.run_source('main { [1] .k (k 1); }')
+        self.assertEqual(str(cm.exception), 'map keys can not be stacks')
+        # maps are unhashable, so they can't be keys of other maps
+        self.assertEqual(hash(Val(1, ValType.INT)), hash(Val(1, ValType.INT)))
+        self.assertNotEqual(Val(1, ValType.INT), Val('1', ValType.STRING))
+        with self.assertRaises(TypeError):
+            hash(Val({}, ValType.MAP))
+
+    def test_arrays(self):
+        source = '''
+            main {
+                0 5 range .a;
+                a println a len println .@;
+                a a * 1 + println;
+                a 2 * a - println;
+                10 a - println;
+                a 3 / println;
+                a 2 >= println;
+                a sum println a max println a min println;
+                [4 5 6] array ^ println unarray 7 push println;
+                a 2 == sum println;
+            }
+        '''
+        expected = '<0, 1, 2, 3, 4>\n5\n<1, 2, 5, 10, 17>\n<0, 1, 2, 3, 4>\n<10, 9, 8, 7, 6>\n<0, 0, 0, 1, 1>\n' \
+                   '<0, 0, 1, 1, 1>\n10\n4\n0\n<4, 5, 6>\n[4, 5, 6, 7]\n1\n'
+        backends = [False, True] if arrays.numpy is not None else [False]
+        for use_numpy in backends:
+            with self.subTest(use_numpy=use_numpy):
+                old, arrays.USE_NUMPY = arrays.USE_NUMPY, use_numpy
+                try:
+                    self.assertEqual(self.run_source(source), expected)
+                finally:
+                    arrays.USE_NUMPY = old
+        errors = [
+            ('main { 0 3 range 0 2 range +; }', '+', 'arrays of length 3 and 2 can not be combined with `+`'),
+            ('main { 0 3 range "a" +; }', '+', 'ValType.STRING is not compatible with arrays in `+`'),
+            ('main { 0 3 range 0 /; }', '/', 'attempted to divide by zero'),
+            ('main { 0 0 range max; }', 'max', 'attempted to take the max of an empty array'),
+            ('main { [1 "a"] array; }', 'array', 'expected a stack of integers for `array` function; instead got '
+                                                 'ValType.STRING'),
+            ('main { [0x7fffffffffffffff] array 1 +; }', '+', 'result of `+` does not fit in an array'),
+        ]
+        for source, name, message in errors:
+            with self.assertRaises(ChainedError) as cm:
+                self.run_source(source)
+            self.assertEqual(str(cm.exception.err), message)
+            start = source.rindex(name) + 1
+            self.assertEqual(str(cm.exception.err.source_range), f"1:{start}-{start + len(name) - 1}")
+
+    def test_constant_stacks(self):
+        source = '''
+            fresh { [1 2 [3]] 4 push pop .@ pop 5 push .@; }
+            counts { (1 0) 1 get 1 + .v 1 v put; }
+            main {
+                fresh println fresh println counts println counts println
+                [] .s s 1 push .@ s println;
+            }
+        '''
+        fun_table = self.compile_source(source)
+        expected = '[1, 2]\n[1, 2]\n(1: 1)\n(1: 1)\n[1]\n'
+        for _ in range(2):
+            # constants are copied the first time they are changed, so every run sees the same values
+            vm = VM(fun_table)
+            out = io.StringIO()
+            with redirect_stdout(out):
+                vm.run()
+            self.assertEqual(out.getvalue(), expected)
+        self.assertEqual(str(fun_table['fresh'].bc[0].val), '[1, 2, [3]]')
+
+    def test_persistent_stacks(self):
+        source = '''
+            main {
+                [1 2 3] .s;
+                s 4 push .t s println t println;
+                s pop .x .u s println u println x println;
+                s 0 9 set reverse println s [5] extend sort println s println;
+                1 .y [y 2] .v v ^ 3 push println println;
+            }
+        '''
+        self.assertEqual(self.run_source(source, {'persistent_stacks': True}),
+                         '[1, 2, 3]\n[1, 2, 3, 4]\n[1, 2, 3]\n[1, 2]\n3\n[3, 2, 9]\n[1, 2, 3, 5]\n[1, 2, 3]\n'
+                         '[1, 2, 3]\n[1, 2]\n')
+        # without persistent stacks, every local that holds a stack sees changes to it
+        self.assertEqual(self.run_source('main { [1 2 3] .s s 4 push .@ s println; }'), '[1, 2, 3, 4]\n')
+
+    def test_strings(self):
+        self.assertEqual(self.run_source('''
+            main {
+                "foo" "bar" + 'x + 'a "b" + + println;
+                "hello" 1 get println 1 u- get println 1 4 slice println .@;
+                builder "n=" append 3 append ', append @ append ^ finish println " done" append finish println;
+                [1 "a" 'b] ", " join println;
+                "stack" chars ^ 0 get println .@ ^ len println .@ "" join println;
+                "abc" chars ^ unchars println 'd push reverse unchars println;
+            }
+        '''), 'foobarxab\ne\no\nell\nn=3,Nil\nn=3,Nil done\n1, a, b\ns\n5\nstack\nabc\ndcba\n')
+        errors = [
+            ('main { "ab" 2 get; }', 'get', 'index 2 is out of range for a string with 2 characters'),
+            ('main { 1 2 append; }', 'append', 'expected a string builder for `append` function; instead got '
+                                               'ValType.INT'),
+            ('main { [1] unchars; }', 'unchars', 'expected a stack of characters for `unchars` function; instead got '
+                                                 'ValType.INT'),
+            ('main { "a" 1 +; }', '+', 'ValType.STRING is not compatible with ValType.INT'),
+        ]
+        for source, name, message in errors:
+            with self.assertRaises(ChainedError) as cm:
+                self.run_source(source)
+            self.assertEqual(str(cm.exception.err), message)
+            start = source.rindex(name) + 1
+            self.assertEqual(str(cm.exception.err.source_range), f"1:{start}-{start + len(name) - 1}")
+
+    def test_bytes(self):
+        self.assertEqual(self.run_source('''
+            main {
+                "héllo, world" bytes .b;
+                b len println 0 get println .@;
+                b 8 13 slice ^ println decode println .@;
+                b ", " bytes find println 0x6f find println 0x7a find println .@;
+                b 8 9 slice .w .@ [104 105] bytes w concat decode println;
+                "abc" bytes "abc" bytes == println;
+            }
+        '''), "13\n104\nb'world'\nworld\n6\n5\n-1\nhiw\nT\n")
+        errors = [
+            ('main { [256] bytes; }', 'bytes', 'byte values must be from 0 to 255; instead got 256'),
+            ('main { [255] bytes decode; }', 'decode', 'bytes are not valid UTF-8: invalid start byte at index 0'),
+            ('main { "a" bytes "a" find; }', 'find', 'expected bytes or an integer byte to find for `find` function; '
+                                                     'instead got ValType.STRING'),
+            ('main { [1] "a" bytes concat; }', 'concat', 'expected a stack for `concat` function; instead got '
+                                                         'ValType.BYTES'),
+        ]
+        for source, name, message in errors:
+            with self.assertRaises(ChainedError) as cm:
+                self.run_source(source)
+            self.assertEqual(str(cm.exception.err), message)
+            start = source.rindex(name) + 1
+            self.assertEqual(str(cm.exception.err.source_range), f"1:{start}-{start + len(name) - 1}")
+        # slices share the memory of the bytes they came from
+        data = ByteView(b'0123456789')
+        view = data[2:8][1:3]
+        self.assertIs(view.data, data.data)
+        self.assertEqual((view.tobytes(), view.find(b'4'), view[-1]), (b'34', 1, ord('4')))
+
+    def test_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'lines.txt')
+            self.assertEqual(self.run_source('''
+                main {
+                    "PATH" "w" open "one\\n" write 't write "wo\\n" write flush close;
+                    0 .n "PATH" "r" open readline;
+                    loop { .line n 1 + .n line print readline; } .2 n println;
+                    "PATH" "rb" open 4 read println 100 read println 100 read println close;
+                    "PATH" "r" open readall print readall println .@;
+                    "PATH" "a" open "three\\n" write;
+                }
+            '''.replace('PATH', path)), "one\ntwo\n2\nb'one\\n'\nb'two\\n'\nNil\none\ntwo\n\n")
+            # files left open are closed, and flushed, when the program ends
+            with open(path) as fp:
+                self.assertEqual(fp.read(), 'one\ntwo\nthree\n')
+            # big binary reads are memory-mapped
+            threshold = files.MMAP_THRESHOLD
+            files.MMAP_THRESHOLD = 4
+            try:
+                vm = VM(self.compile_source(f'main {{ "{path}" "rb" open 4 read .@ readall; }}'))
+                vm.run()
+                # finding a byte value in a memory-mapped view
+                found = VM(self.compile_source(f'main {{ "{path}" "rb" open readall 104 find .i 122 find .j i j; }}'))
+                found.run()
+            finally:
+                files.MMAP_THRESHOLD = threshold
+            self.assertIsInstance(vm.state.stack[-1].val.data, mmap.mmap)
+            self.assertEqual(vm.state.stack[-1].val.tobytes(), b'two\nthree\n')
+            self.assertEqual(len(vm.state.files.handles), 0)
+            self.assertIsInstance(found.state.stack[-3].val.data, mmap.mmap)
+            self.assertEqual([val.val for val in found.state.stack[-2:]], [9, -1])
+            errors = [
+                ('main { "PATH/missing" "r" open; }', 'open',
+                 f"could not open '{path}/missing': Not a directory"),
+                ('main { "PATH" "rw" open; }', 'open', "unknown file mode: 'rw'"),
+                ('main { "PATH" "ab" open "a" write; }', 'write',
+                 'expected bytes to write to a binary file for `write` function; instead got ValType.STRING'),
+                ('main { "PATH" "r" open "a" write; }', 'write', f"could not write <file '{path}' (r)>: not writable"),
+                ('main { "PATH" "r" open 0 read; }', 'read', 'read size must be positive; instead got 0'),
+            ]
+            for source, name, message in errors:
+                source = source.replace('PATH', path)
+                with self.assertRaises(ChainedError) as cm:
+                    self.run_source(source)
+                self.assertEqual(str(cm.exception.err), message)
+                start = source.rindex(name) + 1
+                self.assertEqual(str(cm.exception.err.source_range), f"1:{start}-{start + len(name) - 1}")
+
+    def test_stdio(self):
+        with patch('sys.stdin', io.StringIO('one\ntwo\nthree\n')):
+            self.assertEqual(self.run_source('''
+                main { stdin readline; loop { .line "> " line + print readline; } .2; }
+            '''), '> one\n> two\n> three\n')
+        with patch('sys.stdin', io.StringIO('one\ntwo\nthree\nfour\n')):
+            self.assertEqual(self.run_source('''
+                main {
+                    stdin readline print 3 read println readline print;
+                    readall print readall println readline println .@;
+                }
+            '''), 'one\ntwo\n\nthree\nfour\n\nNil\n')
+        # output is written when the buffer fills up, is flushed, or the program ends
+        out = io.StringIO()
+        seen = []
+
+        # stands in for `$`, recording what has been written so far
+        def record(vm_state):
+            seen.append(out.getvalue())
+            vm_state.push(Val(0, ValType.INT))
+
+        builtins = dict(BUILTINS, **{'$': record})
+        fun_table = self.compile_source('main { "ab" print $ "cd" print $ stdout flush .@ $ "e" print .3; }')
+        with redirect_stdout(out):
+            VM(fun_table, builtins=builtins, output_buffer=4).run()
+        self.assertEqual(seen, ['', 'abcd', 'abcd'])
+        self.assertEqual(out.getvalue(), 'abcde')
+        with self.assertRaises(ChainedError) as cm:
+            self.run_source('main { stdout readline; }')
+        self.assertEqual(str(cm.exception.err), "could not readline <file '<stdout>' (w)>: not readable")
+
+    def test_tasks(self):
+        self.assertEqual(self.run_source('''
+            square {
+                .chs chs 0 get .in 1 get .out .@;
+                in recv; loop { .x out x x * send .@ recv; } .2 out close;
+            }
+            main {
+                2 channel .in 2 channel .out [in out] "square" spawn .t;
+                in 1 send 2 send 3 send close;
+                out recv; loop { println recv; } .2 t wait println;
+            }
+        '''), '1\n4\n9\n[]\n')
+        # tasks take turns when they yield
+        self.assertEqual(self.run_source('''
+            count { .name 0 .i; i 3 <; loop { .@ name print i println yield i 1 + .i; i 3 <; } .@ name; }
+            main { "a" "count" spawn "b" "count" spawn .b wait println b wait println; }
+        '''), 'a0\nb0\na1\nb1\na2\nb2\n[a]\n[b]\n')
+        errors = [
+            ('main { 1 channel recv; }', 'recv', 'deadlock: every task is waiting on a channel or another task'),
+            # the channel's only sender finishes without sending anything
+            ('worker { .@; } main { 1 channel .c; c "worker" spawn .@; c recv println; }', 'recv',
+             'deadlock: every task is waiting on a channel or another task'),
+            ('main { @ "nope" spawn; }', 'spawn', 'No such function: `nope`'),
+            ('main { 1 channel ^ close 1 send; }', 'send',
+             'could not send on <closed channel (0/1)>: channel is closed'),
+        ]
+        for source, name, message in errors:
+            with self.assertRaises(ChainedError) as cm:
+                self.run_source(source)
+            self.assertEqual(str(cm.exception.err), message)
+            start = source.rindex(name) + 1
+            self.assertEqual(str(cm.exception.err.source_range), f"1:{start}-{start + len(name) - 1}")
+        # errors in other tasks end the program
+        with self.assertRaises(ChainedError) as cm:
+            self.run_source('f { .@ 0 channel; } main { @ "f" spawn wait; }')
+        self.assertEqual(str(cm.exception.err), 'channel capacity must be positive; instead got 0')
+
+    @skipUnless(hasattr(os, 'mkfifo'), 'needs named pipes')
+    def test_task_io(self):
+        # opening a pipe blocks until the other end is opened, which only happens if other tasks run in the meantime
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'pipe')
+            os.mkfifo(path)
+            self.assertEqual(self.run_source('''
+                reader { .@ "PATH" "r" open readline .line close line; }
+                main { @ "reader" spawn "PATH" "w" open "hello\\n" write close wait println; }
+            '''.replace('PATH', path)), '[hello\n]\n')
+
+    def test_pmap(self):
+        source = '''
+            square { ^ *; }
+            check { ^ 5 ==; br { .@ .x [] x get .@; } el { .@; } }
+            main { [1 2 3 4 5 6 7] "square" pmap println [1 2 3 "a"] "check" pmap println [1 2 5 3] "check" pmap; }
+        '''
+        for options in [{'workers': 1}, {'workers': 2, 'chunk_size': 2}]:
+            with self.subTest(**options):
+                with self.assertRaises(ChainedError) as cm:
+                    self.run_source(source, **options)
+                self.assertEqual(str(cm.exception.err),
+                                 '`check` failed on item 2: index 5 is out of range for a stack with 0 items')
+                start = source.split('\n')[2].index('get') + 1
+                self.assertEqual(str(cm.exception.err.source_range), f"3:{start}-{start + 2}")
+                out = io.StringIO()
+                with redirect_stdout(out):
+                    self.assertRaises(ChainedError, VM(self.compile_source(source), **options).run)
+                self.assertEqual(out.getvalue(), '[1, 4, 9, 16, 25, 36, 49]\n[1, 2, 3, a]\n')
+        # workers that don't fork have the program sent to them, which the default start method on some platforms does
+        with self.subTest(start_method='spawn'):
+            spawn = partial(ProcessPoolExecutor, mp_context=multiprocessing.get_context('spawn'))
+            with patch('sbl.vm.pmap.ProcessPoolExecutor', spawn):
+                out = self.run_source('sq { ^ *; } main { [1 2 3 4 5 6 7] "sq" pmap println; }', workers=2)
+            self.assertEqual(out, '[1, 4, 9, 16, 25, 36, 49]\n')
+        errors = [
+            ('count { $; } main { [1] "count" pmap; }', 'pmap', '`count` is not pure, so it can not be mapped'),
+            ('none { .@; } main { [1] "none" pmap; }', 'pmap',
+             '`none` has to take one item and leave at least one to be mapped; instead its effect is ( 1 -- 0 )'),
+            ('main { [1] "nope" pmap; }', 'pmap', 'No such function: `nope`'),
+            ('f { .@ 1; } main { [] stdin push "f" pmap; }', 'pmap', 'can not map over files'),
+        ]
+        for source, name, message in errors:
+            with self.assertRaises(ChainedError) as cm:
+                self.run_source(source)
+            self.assertEqual(str(cm.exception.err), message)
+            start = source.rindex(name) + 1
+            self.assertEqual(str(cm.exception.err.source_range), f"1:{start}-{start + len(name) - 1}")
+
+    def test_limits(self):
+        source = '''
+            deep { 1 deep; }
+            grow { T; loop { 1; } }
+            spin { T; loop { } }
+            count { 0 .i; i 100 <; loop { .@ i 1 + .i; i 100 <; } .@ i; }
+            main { count println; }
+        '''
+        cases = [
+            (Limits(instructions=5000), 'spin', 'instruction limit of 5000 exceeded', '4:28-30'),
+            (Limits(time=0.05), 'spin', 'time limit of 0.05s exceeded', '4:28-30'),
+            (Limits(depth=20), 'deep', 'call depth limit of 20 exceeded', '2:20-20'),
+            (Limits(stack=100), 'grow', 'global stack limit of 100 items exceeded', '3:28-33'),
+        ]
+        fun_table = self.compile_source(source, inline_threshold=0)
+        for vm_class in [VM, JitVM, RegVM]:
+            for limits, fname, message, where in cases:
+                with self.subTest(vm_class=vm_class.__name__, fname=fname):
+                    vm = vm_class(fun_table, limits=limits)
+                    with self.assertRaises(VMError) as cm:
+                        vm.run(fname)
+                    self.assertEqual(str(cm.exception), message)
+                    self.assertEqual(str(cm.exception.source_range), where)
+            # programs within their limits run as usual, and each run starts over
+            vm = vm_class(fun_table, limits=Limits(instructions=5000, stack=10, depth=5, time=10))
+            for _ in range(2):
+                out = io.StringIO()
+                with redirect_stdout(out):
+                    vm.run()
+                self.assertEqual(out.getvalue(), '100\n')
+
+    def test_checkpoint(self):
+        source = '''
+            count {
+                .n 0 .i [] .items items .alias; i n <;
+                loop { .@ items i push .@ i println; i 2 ==; br { .@ checkpoint; } el { .@; } i 1 + .i; i n <; }
+                .@ alias;
+            }
+            main { "start" println 5 count println; }
+        '''
+        fun_table = self.compile_source(source, inline_threshold=0)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'count.ckpt')
+            out = io.StringIO()
+            with redirect_stdout(out):
+                VM(fun_table, checkpoint=path).run()
+            self.assertEqual(out.getvalue(), 'start\n0\n1\n2\n3\n4\n[0, 1, 2, 3, 4]\n')
+            # carries on from just after the call to `checkpoint`, with locals that shared a stack still sharing it
+            out = io.StringIO()
+            with redirect_stdout(out):
+                VM(fun_table).run(resume=Checkpoint.read(path, fun_table))
+            self.assertEqual(out.getvalue(), '3\n4\n[0, 1, 2, 3, 4]\n')
+            # checkpoints can only be resumed by the program that saved them
+            with self.assertRaises(CheckpointError):
+                Checkpoint.read(path, self.compile_source(source.replace('5 count', '6 count'), inline_threshold=0))
+            # checkpoints taken every so often can be resumed from wherever they were taken
+            fun_table = self.compile_source('''
+                triangle { .n 0 .i 0 .total; i n <; loop { .@ total i + .total i 1 + .i; i n <; } .@ total; }
+                main {
+                    [] .totals 0 .j; j 20 <; loop { .@ totals j triangle push .totals j 1 + .j; j 20 <; } .@ totals println;
+                }
+            ''', inline_threshold=0)
+            path = os.path.join(tmp, 'sum.ckpt')
+            with redirect_stdout(io.StringIO()):
+                VM(fun_table, checkpoint=path, checkpoint_every=500).run()
+            resumed = Checkpoint.read(path, fun_table)
+            self.assertGreater(len(resumed.frames), 0)
+            out = io.StringIO()
+            with redirect_stdout(out):
+                VM(fun_table).run(resume=resumed)
+            self.assertEqual(out.getvalue(), f"{[j * (j - 1) // 2 for j in range(20)]}\n")
+        errors = [
+            ({}, 'main { checkpoint; }', '`checkpoint` can only be used in programs run with a checkpoint file'),
+            ({'checkpoint': 'unused'}, 'f { checkpoint; } main { 1 "f" spawn checkpoint; }',
+             'can not checkpoint while other tasks are running'),
+            ({'checkpoint': 'unused'}, 'main { stdin checkpoint; }',
+             'could not checkpoint to unused: can not checkpoint files'),
+        ]
+        for options, source, message in errors:
+            with self.subTest(source=source):
+                with self.assertRaises(ChainedError) as cm:
+                    self.run_source(source, **options)
+                self.assertEqual(str(cm.exception.err), message)
@@ -0,0 +1,92 @@
+# adaptive.py
+# Run-time specialization ("quickening") of hot instructions.
+from sbl.common import *
+from sbl.vm.bc import *
+
+# How many times a site has to run before it is quickened.
+WARMUP = 8
+# The most a site's warmup can grow to after repeated deoptimizations.
+MAX_WARMUP = 1024
+
+
+class Site:
+    """
+    Execution counters for a single instruction.
+    """
+    def __init__(self, bc: BC):
+        self.original = bc
+        self.executions = 0
+        # how many executions in a row have seen the same operand types
+        self.stable = 0
+        self.signature = None
+        self.warmup = WARMUP
+        self.quickenings = 0
+        self.deopts = 0
+
+
+class Adaptive:
+    """
+    Counts executions of CALL and LOAD instructions, and rewrites the ones that get hot into quickened instructions.
+    Quickened instructions that depend on operand types check them first, and put the original instruction back when the
+    check fails.
+    """
+    def __init__(self, vm):
+        self.vm = vm
+        self.sites = {}
+
+    def observe(self, fun_state, bc: BC, stack: List[Val]):
+        """
+        Records an execution of a generic instruction, quickening it if it is hot.
+        """
+        key = (fun_state.name, fun_state.pc)
+        site = self.sites.get(key)
+        if site is None:
+            site = self.sites[key] = Site(bc)
+        site.executions += 1
+        signature = self._signature(bc, stack)
+        if signature == site.signature:
+            site.stable += 1
+        else:
+            site.signature = signature
+            site.stable = 1
+        if site.executions >= site.warmup:
+            quick = self._quicken(fun_state, bc, site)
+            if quick is not None:
+                fun_state.fun.bc[fun_state.pc] = quick
+                site.quickenings += 1
+
+    def deopt(self, fun_state, bc: QuickBC):
+        """
+        Puts back the original instruction of a quickened instruction whose guard failed.
+        """
+        fun_state.fun.bc[fun_state.pc] = bc.original
+        site = self.sites[(fun_state.name, fun_state.pc)]
+        site.deopts += 1
+        site.executions = 0
+        site.stable = 0
+        site.warmup = min(site.warmup * 2, MAX_WARMUP)
+
+    def _signature(self, bc: BC, stack: List[Val]):
+        if bc.code is BCType.CALL and bc.val.val in INT_OPS and len(stack) >= 2:
+            return stack[-2].type, stack[-1].type
+        return None
+
+    def _quicken(self, fun_state, bc: BC, site: Site) -> Optional[QuickBC]:
+        vm = self.vm
+        if bc.code is BCType.LOAD:
+            return QuickBC(BCType.LOAD_FAST, bc)
+        name = bc.val.val
+        if name in vm.builtins:
+            if name in INT_OPS and site.stable >= site.warmup and site.signature == (ValType.INT, ValType.INT):
+                return QuickBC(BCType.CALL_INT, bc, INT_BINOPS[INT_OPS[name]])
+            return QuickBC(BCType.CALL_BUILTIN, bc, vm.builtins[name])
+        elif name in vm.funs:
+            return QuickBC(BCType.CALL_FUN, bc, (vm.funs[name], vm.callsite(fun_state, bc)))
+        return None
+
+    def dump(self):
+        printerr("adaptive sites:")
+        for (name, pc), site in sorted(self.sites.items()):
+            current = self.vm.funs[name].bc[pc]
+            printerr(f"{' ' * 4}{name}:{pc:05} {str(site.original).strip()} executions={site.executions} "
+                     f"quickenings={site.quickenings} deopts={site.deopts} now={current.code.value}")
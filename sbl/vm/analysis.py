@@ -0,0 +1,491 @@
+# analysis.py
+# Static analyses over compiled bytecode.
+from sbl.common import *
+from sbl.vm.bc import *
+from sbl.vm.funs import BUILTIN_EFFECTS, IMPURE_BUILTINS
+
+INF = float('inf')
+
+
+class BasicBlock:
+    """
+    A straight-line run of instructions, from `start` up to (but not including) `end`.
+    """
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.succs = []
+
+    def __repr__(self):
+        return f"BasicBlock({self.start}..{self.end} -> {[b.start for b in self.succs]})"
+
+
+def basic_blocks(bc: List[BC]) -> List[BasicBlock]:
+    """
+    Splits a function's bytecode into basic blocks, linked by their successors. The first block is the entry block.
+    """
+    leaders = {0}
+    for pc, instr in enumerate(bc):
+        if instr.code in [BCType.JMP, BCType.JMPZ]:
+            leaders |= {instr.val.val, pc + 1}
+        elif instr.code is BCType.RET:
+            leaders |= {pc + 1}
+    leaders = sorted(l for l in leaders if l < len(bc))
+    blocks = [BasicBlock(start, end) for start, end in zip(leaders, leaders[1:] + [len(bc)])]
+    by_start = {block.start: block for block in blocks}
+    for block in blocks:
+        last = bc[block.end - 1]
+        if last.code is BCType.JMP:
+            block.succs = [by_start[last.val.val]]
+        elif last.code is BCType.JMPZ:
+            block.succs = [by_start[block.end], by_start[last.val.val]]
+        elif last.code is not BCType.RET:
+            block.succs = [by_start[block.end]]
+    return blocks
+
+
+class StackEffect:
+    """
+    The effect a function has on the global stack: how many items it needs when called, and the range of how many
+    items it adds (or removes) by the time it returns.
+    """
+    def __init__(self, need, min_delta, max_delta):
+        self.need = need
+        self.min_delta = min_delta
+        self.max_delta = max_delta
+
+    def is_safe(self) -> bool:
+        """
+        Whether the function is proven to never underflow the stack, given `need` items when called.
+        """
+        return self.need != INF
+
+    def is_fixed(self) -> bool:
+        return self.is_safe() and self.min_delta == self.max_delta
+
+    def __eq__(self, other):
+        return isinstance(other, StackEffect) and (self.need, self.min_delta, self.max_delta) == \
+            (other.need, other.min_delta, other.max_delta)
+
+    def __str__(self):
+        if not self.is_safe():
+            return "( ? )"
+        lo = self.need + self.min_delta
+        hi = self.need + self.max_delta
+        out = str(lo) if lo == hi else f"{lo}..{hi}"
+        return f"( {self.need} -- {out} )"
+
+    def __repr__(self):
+        return f"StackEffect{self}"
+
+
+UNKNOWN_EFFECT = StackEffect(INF, -INF, INF)
+
+
+class StackAnalysis:
+    """
+    Computes the stack effect of every function in a function table.
+
+    Each function is interpreted abstractly with an interval of stack depths, relative to the depth it was called
+    with. Joins take the widest interval, and intervals that keep changing across loop back-edges are widened to
+    infinity. Recursive functions are solved by iterating over the whole table until the effects stop changing.
+    """
+    # How many times a block's entry interval may change before it gets widened.
+    WIDEN_AFTER = 3
+    # How many times the whole table may be re-analyzed before giving up on the functions that are still changing.
+    MAX_ROUNDS = 12
+
+    def __init__(self, funs, builtins, builtin_effects=BUILTIN_EFFECTS):
+        self.funs = funs
+        self.builtins = builtins
+        self.builtin_effects = builtin_effects
+        # None means the function has not been seen to return (yet)
+        self.effects = {name: None for name in funs}
+
+    def analyze(self):
+        """
+        Annotates each function in the table with its stack effect.
+        :raises CompileError: if `main` is certain to underflow the stack.
+        """
+        rounds = 0
+        pinned = set()
+        while True:
+            changed = []
+            for name in self.funs:
+                if name in pinned:
+                    continue
+                effect = self._analyze_fun(self.funs[name])
+                if effect != self.effects[name]:
+                    self.effects[name] = effect
+                    changed += [name]
+            if not changed:
+                break
+            rounds += 1
+            if rounds >= self.MAX_ROUNDS:
+                # give up on anything that hasn't settled; its callers get re-analyzed on the next round
+                for name in changed:
+                    self.effects[name] = UNKNOWN_EFFECT
+                pinned |= set(changed)
+        for name, fun in self.funs.items():
+            fun.effect = self.effects[name]
+        if 'main' in self.funs and not any('main' in self._callees(fun) for fun in self.funs.values()):
+            self._check_main(self.funs['main'])
+        return self.funs
+
+    def _callees(self, fun) -> List[str]:
+        return [bc.val.val for bc in fun.bc if bc.code is BCType.CALL]
+
+    def instr_effect(self, instr: BC):
+        """
+        Gets the effect of a single instruction as a tuple of (items needed, smallest delta, largest delta), or None if
+        the instruction never finishes.
+        """
+        code = instr.code
+        if code in [BCType.PUSH, BCType.LOAD]:
+            return 0, 1, 1
+        elif code is BCType.POP:
+            return 1, -1, -1
+        elif code is BCType.POPN:
+            return instr.val.val, -instr.val.val, -instr.val.val
+        elif code is BCType.PUSHL:
+            return 2, -1, -1
+        elif code is BCType.PUTL:
+            return 3, -2, -2
+        elif code is BCType.JMPZ:
+            return 1, 0, 0
+        elif code in INT_OPS.values():
+            return 2, -1, -1
+        elif code in [BCType.JMP, BCType.RET]:
+            return 0, 0, 0
+        assert code is BCType.CALL
+        name = instr.val.val
+        if name in self.builtins:
+            if name not in self.builtin_effects:
+                return INF, -INF, INF
+            need, leave = self.builtin_effects[name]
+            return need, leave - need, leave - need
+        effect = self.effects.get(name, UNKNOWN_EFFECT)
+        if effect is None:
+            return None
+        return effect.need, effect.min_delta, effect.max_delta
+
+    def depths(self, fun) -> List[Optional[Tuple[float, float]]]:
+        """
+        Gets the interval of stack depths, relative to the depth at the start of the function, before each instruction.
+        Unreachable instructions get None.
+        """
+        blocks = basic_blocks(fun.bc)
+        entry = {blocks[0].start: (0, 0)}
+        changes = {}
+        todo = [blocks[0]]
+        while todo:
+            block = todo.pop()
+            state = entry[block.start]
+            for pc in range(block.start, block.end):
+                state = self._step(fun.bc[pc], state)
+                if state is None:
+                    break
+            if state is None:
+                continue
+            for succ in block.succs:
+                old = entry.get(succ.start)
+                new = state if old is None else (min(old[0], state[0]), max(old[1], state[1]))
+                if new == old:
+                    continue
+                changes[succ.start] = changes.get(succ.start, 0) + 1
+                if old is not None and changes[succ.start] > self.WIDEN_AFTER:
+                    new = (-INF if new[0] < old[0] else new[0], INF if new[1] > old[1] else new[1])
+                entry[succ.start] = new
+                todo.append(succ)
+        depths = [None] * len(fun.bc)
+        for block in blocks:
+            state = entry.get(block.start)
+            for pc in range(block.start, block.end):
+                depths[pc] = state
+                if state is not None:
+                    state = self._step(fun.bc[pc], state)
+        return depths
+
+    def _step(self, instr: BC, state):
+        effect = self.instr_effect(instr)
+        if effect is None:
+            return None
+        _, min_delta, max_delta = effect
+        return state[0] + min_delta, state[1] + max_delta
+
+    def _analyze_fun(self, fun) -> Optional[StackEffect]:
+        depths = self.depths(fun)
+        need = 0
+        exits = []
+        for instr, state in zip(fun.bc, depths):
+            if state is None:
+                continue
+            effect = self.instr_effect(instr)
+            if effect is None:
+                continue
+            need = max(need, effect[0] - state[0])
+            if instr.code is BCType.RET:
+                exits += [state]
+        if not exits:
+            return None
+        if need == INF:
+            return UNKNOWN_EFFECT
+        return StackEffect(need, min(lo for lo, _ in exits), max(hi for _, hi in exits))
+
+    def _check_main(self, fun):
+        """
+        `main` always starts with an empty stack, so any instruction that needs more items than can possibly be on the
+        stack is an error. User functions are skipped, since their need is an upper bound and not a hard requirement.
+        """
+        for instr, state in zip(fun.bc, self.depths(fun)):
+            # a negative depth means a callee must have already failed at run-time
+            if state is None or state[1] < 0 or (instr.code is BCType.CALL and instr.val.val not in self.builtins):
+                continue
+            effect = self.instr_effect(instr)
+            if effect is not None and effect[0] != INF and effect[0] > state[1]:
+                what = f"`{instr.val.val}`" if instr.code is BCType.CALL else instr.code.value
+                raise CompileError(f"stack underflow: {what} needs {effect[0]} item(s), but the stack can only have "
+                                   f"{state[1]} here", instr.meta['where'])
+
+
+def _arith_types(lhs, rhs):
+    if ValType.ARRAY in [lhs, rhs]:
+        return ValType.ARRAY,
+    # the generic arithmetic builtins raise an error unless both operands have the same type
+    return (lhs,) if lhs is not None and lhs == rhs else (None,)
+
+
+def _plus_types(lhs, rhs):
+    # strings and characters concatenate into strings
+    if lhs in [ValType.STRING, ValType.CHAR] and rhs in [ValType.STRING, ValType.CHAR]:
+        return ValType.STRING,
+    return _arith_types(lhs, rhs)
+
+
+def _compare_types(lhs, rhs):
+    # comparisons with arrays are elementwise
+    if ValType.ARRAY in [lhs, rhs]:
+        return ValType.ARRAY,
+    return (ValType.BOOL,) if lhs is not None and rhs is not None else (None,)
+
+
+# Gets the types a builtin leaves on the stack from the types of the items it needs, with the top item last. Builtins
+# that are missing from this table leave items of unknown type.
+BUILTIN_TYPES = {
+    '+': _plus_types,
+    '*': _arith_types,
+    '-': _arith_types,
+    '/': _arith_types,
+    'u-': lambda item: (ValType.INT,),
+    '==': _compare_types,
+    '!=': _compare_types,
+    '<=': _compare_types,
+    '>=': _compare_types,
+    '<': _compare_types,
+    '>': _compare_types,
+    'pop': lambda stack: (ValType.STACK, None),
+    'push': lambda stack, item: (ValType.STACK,),
+    'len': lambda item: (item, ValType.INT),
+    'get': lambda coll, key: (coll, {ValType.STRING: ValType.CHAR, ValType.BYTES: ValType.INT}.get(coll)),
+    'set': lambda stack, index, item: (ValType.STACK,),
+    'peek': lambda stack: (ValType.STACK, None),
+    'slice': lambda coll, start, end: (coll, coll),
+    'extend': lambda stack, items: (ValType.STACK,),
+    'concat': lambda lhs, rhs: (lhs,),
+    'reverse': lambda stack: (ValType.STACK,),
+    'sort': lambda stack: (ValType.STACK,),
+    'put': lambda map, key, val: (ValType.MAP,),
+    'has': lambda map, key: (ValType.MAP, ValType.BOOL),
+    'delete': lambda map, key: (ValType.MAP,),
+    'keys': lambda map: (ValType.MAP, ValType.STACK),
+    'array': lambda stack: (ValType.ARRAY,),
+    'unarray': lambda arr: (ValType.STACK,),
+    'range': lambda start, stop: (ValType.ARRAY,),
+    'sum': lambda arr: (ValType.INT,),
+    'min': lambda arr: (ValType.INT,),
+    'max': lambda arr: (ValType.INT,),
+    'builder': lambda: (ValType.BUILDER,),
+    'append': lambda builder, item: (ValType.BUILDER,),
+    'finish': lambda builder: (ValType.STRING,),
+    'join': lambda stack, sep: (ValType.STRING,),
+    'chars': lambda text: (ValType.STACK,),
+    'unchars': lambda stack: (ValType.STRING,),
+    'bytes': lambda item: (ValType.BYTES,),
+    'decode': lambda data: (ValType.STRING,),
+    'find': lambda haystack, needle: (haystack, ValType.INT),
+    'open': lambda path, mode: (ValType.FILE,),
+    'close': lambda file: (),
+    'read': lambda file, size: (ValType.FILE, None),
+    'readline': lambda file: (ValType.FILE, None),
+    'readall': lambda file: (ValType.FILE, None),
+    'write': lambda file, data: (ValType.FILE,),
+    'flush': lambda file: (ValType.FILE,),
+    'stdin': lambda: (ValType.FILE,),
+    'stdout': lambda: (ValType.FILE,),
+    'spawn': lambda arg, name: (ValType.TASK,),
+    'yield': lambda: (),
+    'checkpoint': lambda: (),
+    'wait': lambda task: (ValType.STACK,),
+    'channel': lambda capacity: (ValType.CHANNEL,),
+    'send': lambda chan, item: (ValType.CHANNEL,),
+    'recv': lambda chan: (ValType.CHANNEL, None),
+    'pmap': lambda stack, name: (ValType.STACK,),
+    '$': lambda: (ValType.INT,),
+    '^': lambda item: (item, item),
+}
+
+
+class TypeState:
+    """
+    What is known about the types of the values in a function frame at a single point. `stack` holds the types of the
+    topmost items on the global stack, with the top item last; anything below them is unknown, as is any type that is
+    None. `locals` maps local names to their types.
+    """
+    def __init__(self, stack: Tuple=(), locals: Mapping[str, ValType]=None):
+        self.stack = stack
+        self.locals = locals if locals is not None else {}
+
+    def join(self, other: 'TypeState') -> 'TypeState':
+        size = min(len(self.stack), len(other.stack))
+        lhs = self.stack[len(self.stack) - size:]
+        rhs = other.stack[len(other.stack) - size:]
+        stack = tuple(l if l == r else None for l, r in zip(lhs, rhs))
+        locals = {name: ty for name, ty in self.locals.items() if other.locals.get(name) == ty}
+        return TypeState(stack, locals)
+
+    def __eq__(self, other):
+        return isinstance(other, TypeState) and self.stack == other.stack and self.locals == other.locals
+
+
+class TypeInference:
+    """
+    Infers the types of stack items and locals at each instruction, and replaces builtin calls whose operands are known
+    to be integers with specialized instructions.
+
+    This expects the function table to have been through the stack analysis already, since the stack effect of a user
+    function tells which items it may have replaced.
+    """
+    def __init__(self, funs, builtins, builtin_effects=BUILTIN_EFFECTS):
+        self.funs = funs
+        self.builtins = builtins
+        self.builtin_effects = builtin_effects
+
+    def specialize(self):
+        for fun in self.funs.values():
+            types = self.types(fun)
+            for pc, instr in enumerate(fun.bc):
+                state = types[pc]
+                if state is None or instr.code is not BCType.CALL or instr.val.val not in INT_OPS:
+                    continue
+                if state.stack[-2:] == (ValType.INT, ValType.INT):
+                    fun.bc[pc] = BC.int_op(instr.meta, INT_OPS[instr.val.val])
+        return self.funs
+
+    def types(self, fun) -> List[Optional[TypeState]]:
+        """
+        Gets the type state before each instruction. Unreachable instructions get None.
+        """
+        blocks = basic_blocks(fun.bc)
+        entry = {blocks[0].start: TypeState()}
+        todo = [blocks[0]]
+        while todo:
+            block = todo.pop()
+            state = entry[block.start]
+            for pc in range(block.start, block.end):
+                state = self._step(fun.bc[pc], state)
+            for succ in block.succs:
+                old = entry.get(succ.start)
+                new = state if old is None else old.join(state)
+                if new != old:
+                    entry[succ.start] = new
+                    todo.append(succ)
+        types = [None] * len(fun.bc)
+        for block in blocks:
+            state = entry.get(block.start)
+            for pc in range(block.start, block.end):
+                types[pc] = state
+                if state is not None:
+                    state = self._step(fun.bc[pc], state)
+        return types
+
+    def _step(self, instr: BC, state: TypeState) -> TypeState:
+        code = instr.code
+        stack = state.stack
+        locals = state.locals
+        if code is BCType.PUSH:
+            stack += (instr.val.type,)
+        elif code is BCType.LOAD:
+            stack += (locals.get(instr.val.val),)
+        elif code is BCType.POP:
+            if instr.val.type is ValType.IDENT:
+                locals = dict(locals)
+                locals[instr.val.val] = stack[-1] if stack else None
+            stack = stack[:-1]
+        elif code is BCType.POPN:
+            stack = stack[:max(0, len(stack) - instr.val.val)]
+        elif code is BCType.PUSHL:
+            stack = stack[:-2] + (ValType.STACK,)
+        elif code is BCType.PUTL:
+            stack = stack[:-3] + (ValType.MAP,)
+        elif code in [BCType.INT_ADD, BCType.INT_SUB, BCType.INT_MUL]:
+            stack = stack[:-2] + (ValType.INT,)
+        elif code in INT_OPS.values():
+            stack = stack[:-2] + (ValType.BOOL,)
+        elif code is BCType.CALL:
+            stack = self._call_types(instr.val.val, stack)
+        return TypeState(stack, locals)
+
+    def _call_types(self, name: str, stack: Tuple) -> Tuple:
+        if name in self.builtins:
+            if name not in self.builtin_effects:
+                return ()
+            need, leave = self.builtin_effects[name]
+            args = stack[len(stack) - need:] if len(stack) >= need else (None,) * need
+            result = BUILTIN_TYPES[name](*args) if name in BUILTIN_TYPES else (None,) * leave
+            return stack[:max(0, len(stack) - need)] + tuple(result)
+        effect = self.funs[name].effect
+        if effect is None or not effect.is_fixed():
+            return ()
+        # items below what the function needs are never touched by it
+        return stack[:max(0, len(stack) - effect.need)] + (None,) * (effect.need + effect.min_delta)
+
+
+class PurityAnalysis:
+    """
+    Finds functions whose results depend only on the items they need from the stack: they have a fixed stack effect,
+    do no I/O, don't mutate local stacks, and only call other pure functions.
+
+    This expects the function table to have been through the stack analysis already.
+    """
+    def __init__(self, funs, builtins, builtin_effects=BUILTIN_EFFECTS, impure_builtins=IMPURE_BUILTINS):
+        self.funs = funs
+        self.builtins = builtins
+        self.builtin_effects = builtin_effects
+        self.impure_builtins = impure_builtins
+
+    def analyze(self):
+        # start by assuming every candidate is pure, so recursive functions can be pure too
+        pure = {name for name, fun in self.funs.items() if fun.effect is not None and fun.effect.is_fixed()}
+        changed = True
+        while changed:
+            changed = False
+            for name in list(pure):
+                if not self._is_pure(self.funs[name], pure):
+                    pure.remove(name)
+                    changed = True
+        for name, fun in self.funs.items():
+            fun.pure = name in pure
+        return self.funs
+
+    def _is_pure(self, fun, pure: Set[str]) -> bool:
+        for instr in fun.bc:
+            if instr.code in [BCType.PUSHL, BCType.PUTL]:
+                return False
+            elif instr.code is BCType.CALL:
+                name = instr.val.val
+                if name in self.builtins:
+                    if name in self.impure_builtins or name not in self.builtin_effects:
+                        return False
+                elif name not in pure:
+                    return False
+        return True
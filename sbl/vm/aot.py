@@ -0,0 +1,97 @@
+# aot.py
+# Ahead-of-time compilation of SBL programs to standalone Python modules.
+from sbl.vm.pyjit import *
+
+
+def reachable(funs: FunTable, root: str='main') -> List[str]:
+    """
+    Finds the functions that can be called starting from a root function.
+    :return: the names of the reachable functions, in the order they appear in the function table.
+    """
+    seen = set()
+    todo = [root] if root in funs else []
+    while todo:
+        name = todo.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        todo += [bc.val.val for bc in funs[name].bc if bc.code is BCType.CALL and bc.val.val in funs]
+    return [name for name in funs if name in seen]
+
+
+class ModuleWriter:
+    """
+    Writes a compiled program out as the source of a Python module that only imports sbl.vm.jitrt. Running the module
+    runs the program; importing it exposes `run(runtime)` and the `FUNS` table.
+    """
+    def __init__(self, funs: FunTable, source_name: str, builtins=BUILTINS):
+        self.funs = FunTable(**{name: funs[name] for name in reachable(funs)})
+        self.source_name = source_name
+        self.builtins = builtins
+        # literal source of each distinct meta, to its index in METAS
+        self.metas = {}
+
+    def write(self) -> str:
+        gen = PyGen(self.funs, self.builtins)
+        code = gen.generate()
+        if gen.unstructured:
+            name = next(name for name in self.funs if name in gen.unstructured)
+            raise CompileError(f"function `{name}` has control flow that can't be compiled to Python",
+                               self.funs[name].meta['where'])
+        funs = []
+        for fun in self.funs.values():
+            instrs = ''.join(f"\n        Instr({repr(str(bc))}, {self._meta(bc.meta)})," for bc in fun.bc)
+            funs += [f"    {repr(fun.name)}: FunInfo({repr(fun.name)}, {self._meta(fun.meta)}, [{instrs}\n    ]),"]
+        out = [
+            f"# Compiled from {self.source_name} by `sbl compile`. Do not edit.",
+            "from sbl.vm.jitrt import *",
+            "",
+            "METAS = [",
+        ]
+        out += [f"    {meta}," for meta in self.metas]
+        out += ["]", "FUNS = {"]
+        out += funs
+        out += ["}", "CONSTS = ["]
+        out += [f"    {literal(val)}," for val in gen.consts]
+        out += ["]", "", code, ""]
+        out += [
+            "def run(runtime: Runtime):",
+            "    try:",
+            f"        f_main(runtime.state, '<init>')" if 'main' in self.funs else "        pass",
+            "    finally:",
+            "        runtime.state.files.close_all()",
+            "",
+            "",
+            "if __name__ == '__main__':",
+            f"    sys.exit(main(run, FUNS, {repr(self.source_name)}))",
+        ]
+        return '\n'.join(out) + '\n'
+
+    def _meta(self, meta: Mapping[str, Any]) -> str:
+        source = literal(meta)
+        if source not in self.metas:
+            self.metas[source] = len(self.metas)
+        return f"METAS[{self.metas[source]}]"
+
+
+def literal(obj) -> str:
+    """
+    Writes a value out as Python source that rebuilds it.
+    """
+    if isinstance(obj, Val):
+        return f"Val({literal(obj.val)}, ValType.{obj.type.name}{', True' if obj.frozen else ''})"
+    elif isinstance(obj, Range):
+        return f"Range({literal(obj.start)}, {literal(obj.end)})"
+    elif isinstance(obj, Pos):
+        return f"Pos({obj.col}, {obj.line}, {obj.idx})"
+    elif isinstance(obj, PVec):
+        return f"PVec({literal(obj.tolist())})"
+    elif isinstance(obj, dict):
+        return '{' + ', '.join(f"{literal(k)}: {literal(v)}" for k, v in obj.items()) + '}'
+    elif isinstance(obj, list):
+        return '[' + ', '.join(map(literal, obj)) + ']'
+    elif isinstance(obj, tuple):
+        return '(' + ''.join(f"{literal(item)}, " for item in obj) + ')'
+    else:
+        assert obj is None or isinstance(obj, (bool, int, float, str)), f"no literal for {type(obj)}"
+        return repr(obj)
@@ -0,0 +1,98 @@
+# arrays.py
+# Homogeneous 64-bit integer arrays, for bulk arithmetic that doesn't go through the VM one item at a time.
+#
+# Arrays are backed by NumPy when it is installed, and by `array('q')` otherwise. Either way, an array is never changed
+# after it is made, so arrays can be shared freely between locals.
+import operator
+from array import array
+from itertools import repeat
+
+from sbl.common import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Whether new arrays are made with NumPy. This can be turned off to compare the two backends.
+USE_NUMPY = numpy is not None
+
+# Elementwise operators, by builtin name. Comparisons give 1 where they hold, and 0 where they don't; division rounds
+# down, like Python's `//`.
+OPS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.floordiv,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+COMPARE_OPS = {'==', '!=', '<', '<=', '>', '>='}
+
+REDUCTIONS = {
+    'sum': sum,
+    'min': min,
+    'max': max,
+}
+
+
+def is_numpy(arr) -> bool:
+    return numpy is not None and isinstance(arr, numpy.ndarray)
+
+
+def from_ints(ints) -> Any:
+    """
+    Makes an array from integers.
+    :raise OverflowError: if any of the integers don't fit in 64 bits.
+    """
+    if USE_NUMPY:
+        return numpy.array(list(ints), dtype=numpy.int64)
+    return array('q', ints)
+
+
+def arange(start: int, stop: int) -> Any:
+    """
+    Makes an array of the integers from start up to (but not including) stop.
+    """
+    if USE_NUMPY:
+        return numpy.arange(start, max(start, stop), dtype=numpy.int64)
+    return array('q', range(start, stop))
+
+
+def binop(op: str, lhs, rhs) -> Any:
+    """
+    Applies an operator elementwise. Either operand may be an integer, which is combined with every element of the
+    other; arrays must be the same length. Dividing by zero is left to the caller to check.
+    :param op: the name of the builtin, which is a key of OPS.
+    :raise OverflowError: if a result doesn't fit in 64 bits. NumPy arrays wrap around instead.
+    """
+    fn = OPS[op]
+    if is_numpy(lhs) or is_numpy(rhs):
+        result = fn(lhs, rhs)
+        return result.astype(numpy.int64) if op in COMPARE_OPS else result
+    if isinstance(lhs, int):
+        items = map(fn, repeat(lhs), rhs)
+    elif isinstance(rhs, int):
+        items = map(fn, lhs, repeat(rhs))
+    else:
+        items = map(fn, lhs, rhs)
+    return array('q', items)
+
+
+def has_zero(arr) -> bool:
+    return bool((arr == 0).any()) if is_numpy(arr) else 0 in arr
+
+
+def reduce(name: str, arr) -> int:
+    """
+    Reduces an array to a single integer. min and max need at least one element.
+    :param name: the name of the builtin, which is a key of REDUCTIONS.
+    """
+    if is_numpy(arr):
+        return int(getattr(arr, name)())
+    return REDUCTIONS[name](arr)
@@ -1,3 +1,4 @@
+import operator
 from sbl.vm.val import Val, ValType
 from enum import *
 
@@ -9,6 +10,8 @@ class BCType(Enum):
     POP = 'POP'
     # Pushes the top item of the global stack into the next item, which is expected to be a local stack.
     PUSHL = 'PUSHL'
+    # Pops a value and then a key off the stack, and puts them into the next item, which is expected to be a map.
+    PUTL = 'PUTL'
     # Pops N items off the stack into nothing.
     POPN = 'POPN'
     # Loads a stored value from memory and pushes its value onto the stack.
@@ -21,6 +24,53 @@ class BCType(Enum):
     CALL = 'CALL'
     # Returns from a function.
     RET = 'RET'
+    # Integer arithmetic and comparisons, emitted in place of builtin calls when both operands are known to be integers.
+    INT_ADD = 'INT_ADD'
+    INT_SUB = 'INT_SUB'
+    INT_MUL = 'INT_MUL'
+    INT_EQ = 'INT_EQ'
+    INT_NE = 'INT_NE'
+    INT_LT = 'INT_LT'
+    INT_LE = 'INT_LE'
+    INT_GT = 'INT_GT'
+    INT_GE = 'INT_GE'
+    # Quickened instructions, which the VM only writes over its own copy of the bytecode when running adaptively.
+    # Calls a builtin integer operation, after checking that both operands are integers.
+    CALL_INT = 'CALL_INT'
+    # Calls a builtin without looking it up.
+    CALL_BUILTIN = 'CALL_BUILTIN'
+    # Calls a user-defined function without looking it up.
+    CALL_FUN = 'CALL_FUN'
+    # Loads a local that has always been defined at this instruction.
+    LOAD_FAST = 'LOAD_FAST'
+
+
+# Builtins that have a specialized integer instruction.
+INT_OPS = {
+    '+': BCType.INT_ADD,
+    '-': BCType.INT_SUB,
+    '*': BCType.INT_MUL,
+    '==': BCType.INT_EQ,
+    '!=': BCType.INT_NE,
+    '<': BCType.INT_LT,
+    '<=': BCType.INT_LE,
+    '>': BCType.INT_GT,
+    '>=': BCType.INT_GE,
+}
+
+# The operation and result type of each specialized integer instruction. Operations take the second item on the stack
+# first, and the top item second.
+INT_BINOPS = {
+    BCType.INT_ADD: (operator.add, ValType.INT),
+    BCType.INT_SUB: (operator.sub, ValType.INT),
+    BCType.INT_MUL: (operator.mul, ValType.INT),
+    BCType.INT_EQ: (operator.eq, ValType.BOOL),
+    BCType.INT_NE: (operator.ne, ValType.BOOL),
+    BCType.INT_LT: (operator.lt, ValType.BOOL),
+    BCType.INT_LE: (operator.le, ValType.BOOL),
+    BCType.INT_GT: (operator.gt, ValType.BOOL),
+    BCType.INT_GE: (operator.ge, ValType.BOOL),
+}
 
 class BC:
     def __init__(self, code: BCType, meta=None, val: Val=None):
@@ -49,12 +99,17 @@ class BC:
 
     @staticmethod
     def push(meta, val: Val) -> 'BC':
-        return BC(BCType.PUSH, meta, val)
+        # pushed values are shared by every run of the function, so stacks and maps are copied on write
+        return BC(BCType.PUSH, meta, val.freeze())
 
     @staticmethod
     def pushl(meta) -> 'BC':
         return BC(BCType.PUSHL, meta)
 
+    @staticmethod
+    def putl(meta) -> 'BC':
+        return BC(BCType.PUTL, meta)
+
     @staticmethod
     def pop(meta, val: Val=None) -> 'BC':
         if val is None:
@@ -90,3 +145,18 @@ class BC:
     @staticmethod
     def load(meta, val: Val) -> 'BC':
         return BC(BCType.LOAD, meta, val)
+
+    @staticmethod
+    def int_op(meta, code: BCType) -> 'BC':
+        assert code in INT_OPS.values(), 'non-integer BCType passed to int_op'
+        return BC(code, meta)
+
+
+class QuickBC(BC):
+    """
+    A quickened instruction, which remembers the instruction it replaced so it can be put back.
+    """
+    def __init__(self, code: BCType, original: BC, cache=None):
+        super().__init__(code, original.meta, original.val)
+        self.original = original
+        self.cache = cache
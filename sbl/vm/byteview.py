@@ -0,0 +1,68 @@
+# byteview.py
+# Immutable views of binary data, which can be sliced without copying.
+from sbl.common import *
+
+
+class ByteView:
+    """
+    A run of bytes in an immutable buffer. Slicing a view makes another view of the same buffer, so no bytes are copied
+    until they have to be: `memoryview` gives them to anything that takes a buffer, and `tobytes` copies them out.
+    """
+    __slots__ = ('data', 'start', 'stop')
+
+    def __init__(self, data: bytes, start: int=0, stop: Optional[int]=None):
+        self.data = data
+        self.start = start
+        self.stop = len(data) if stop is None else stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            assert step == 1, 'byte views can only be sliced contiguously'
+            return ByteView(self.data, self.start + start, self.start + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('ByteView index out of range')
+        return self.data[self.start + index]
+
+    def __iter__(self):
+        return iter(self.memoryview())
+
+    def memoryview(self) -> memoryview:
+        return memoryview(self.data)[self.start:self.stop]
+
+    def tobytes(self) -> bytes:
+        if self.start == 0 and self.stop == len(self.data):
+            return self.data
+        return self.data[self.start:self.stop]
+
+    def find(self, needle: Union[bytes, memoryview, int]) -> int:
+        """
+        :param needle: bytes to find, or a single byte value.
+        :return: the index of the first occurrence of the needle in this view, or -1 if there is none.
+        """
+        # memory-mapped buffers only find bytes-like needles
+        if isinstance(needle, int):
+            needle = bytes([needle])
+        index = self.data.find(needle, self.start, self.stop)
+        return index - self.start if index >= 0 else -1
+
+    def __add__(self, other: 'ByteView') -> 'ByteView':
+        return ByteView(b''.join([self.memoryview(), other.memoryview()]))
+
+    def __eq__(self, other):
+        if not isinstance(other, ByteView):
+            return NotImplemented
+        return self.memoryview() == other.memoryview()
+
+    __hash__ = None
+
+    def __str__(self):
+        return repr(self.tobytes())
+
+    def __repr__(self):
+        return f"ByteView({self.tobytes()!r})"
@@ -0,0 +1,269 @@
+# checkpoint.py
+# Saving the state of a running program to a file, and carrying on from it later.
+#
+# A checkpoint holds the global stack and the call stack, with each function's locals and where it's up to, along with
+# a fingerprint of the program, so that it's only ever resumed by the program that saved it. The interpreter keeps SBL
+# call frames on the Python stack, so checkpoints can only be taken where every function but the innermost is waiting
+# on a call to the next one, and resuming calls back into each of them in turn.
+#
+# Values are written with `marshal`, grouped so that the common case of a long stack of plain values is a bytes object
+# of type codes and a list of Python values, which `marshal` and `zlib` deal with quickly.
+import gc
+import hashlib
+import marshal
+import os
+import signal
+import zlib
+
+from sbl.common import *
+from sbl.vm import arrays
+from sbl.vm.bc import BCType
+from sbl.vm.byteview import ByteView
+from sbl.vm.pvec import PVec
+from sbl.vm.val import Val, ValType, CharSeq
+
+MAGIC = b'SBLCKPT1'
+
+# Asks a program being checkpointed to save a checkpoint at the next call or loop.
+CHECKPOINT_SIGNAL = signal.SIGUSR2
+
+# Values whose Python values are written as they are.
+PLAIN_TYPES = {ValType.INT, ValType.IDENT, ValType.CHAR, ValType.STRING, ValType.NIL, ValType.BOOL}
+
+# Values that only make sense in the process that made them.
+UNSAVABLE_TYPES = {ValType.FILE, ValType.TASK, ValType.CHANNEL}
+
+# Type codes are looked up by the id of the type, since hashing an enum member runs Python code.
+TYPES = list(ValType)
+CODES = {id(ty): code for code, ty in enumerate(TYPES)}
+PLAIN_CODES = bytes(CODES[id(ty)] for ty in PLAIN_TYPES)
+
+# How stacks are stored.
+LIST = 0
+PERSISTENT = 1
+CHARS = 2
+# Stands in for a stack or map that was already written, so that values shared between locals stay shared.
+REF = 3
+
+
+class CheckpointError(Exception):
+    """
+    Raised when a checkpoint can't be saved or loaded.
+    """
+
+
+def fingerprint(funs: Mapping[str, Any]) -> bytes:
+    """
+    :return: a hash of a program's bytecode. Instructions quickened by an adaptive VM are hashed as they were compiled.
+    """
+    digest = hashlib.sha256()
+    for name in sorted(funs):
+        digest.update(name.encode() + b'\0')
+        for bc in funs[name].bc:
+            digest.update(str(getattr(bc, 'original', bc)).encode() + b'\n')
+    return digest.digest()
+
+
+class Encoder:
+    def __init__(self):
+        self.seen = {}
+
+    def encode_all(self, vals: List[Val]) -> tuple:
+        codes = bytes(map(CODES.__getitem__, map(id, [val.type for val in vals])))
+        if not codes.translate(None, PLAIN_CODES):
+            return codes, [val.val for val in vals]
+        return codes, [val.val if val.type in PLAIN_TYPES else self.encode(val) for val in vals]
+
+    def encode(self, val: Val) -> Any:
+        ty = val.type
+        if ty in UNSAVABLE_TYPES:
+            raise CheckpointError(f"can not checkpoint {ty.value}s")
+        elif ty is ValType.ARRAY:
+            return val.val.tolist()
+        elif ty is ValType.BYTES:
+            return val.val.tobytes()
+        elif ty is ValType.BUILDER:
+            return ''.join(val.val)
+        # stacks and maps can be changed in place, so a value shared between locals is written once
+        if id(val) in self.seen:
+            return REF, self.seen[id(val)]
+        self.seen[id(val)] = len(self.seen)
+        if ty is ValType.MAP:
+            return self.encode_all(list(val.val)), self.encode_all(list(val.val.values()))
+        elif isinstance(val.val, CharSeq):
+            return CHARS, val.val.text
+        elif isinstance(val.val, PVec):
+            return PERSISTENT, self.encode_all(list(val.val))
+        return LIST, self.encode_all(val.val)
+
+
+class Decoder:
+    def __init__(self):
+        self.seen = []
+
+    def decode_all(self, encoded: tuple) -> List[Val]:
+        codes, data = encoded
+        types = list(map(TYPES.__getitem__, codes))
+        if not codes.translate(None, PLAIN_CODES):
+            return list(map(Val, data, types))
+        return [Val(item, ty) if ty in PLAIN_TYPES else self.decode(item, ty) for item, ty in zip(data, types)]
+
+    def decode(self, item: Any, ty: ValType) -> Val:
+        if ty is ValType.ARRAY:
+            return Val(arrays.from_ints(item), ty)
+        elif ty is ValType.BYTES:
+            return Val(ByteView(item), ty)
+        elif ty is ValType.BUILDER:
+            return Val([item], ty)
+        elif item[0] == REF:
+            return self.seen[item[1]]
+        # made before its contents, which may refer back to it
+        val = Val(None, ty)
+        self.seen += [val]
+        if ty is ValType.MAP:
+            keys, items = item
+            val.val = dict(zip(self.decode_all(keys), self.decode_all(items)))
+        elif item[0] == CHARS:
+            val.val = CharSeq(item[1])
+            val.frozen = True
+        elif item[0] == PERSISTENT:
+            val.val = PVec(self.decode_all(item[1]))
+        else:
+            val.val = self.decode_all(item[1])
+        return val
+
+
+class Checkpoint:
+    """
+    A saved state of a program: its global stack, and the function calls it was in the middle of, outermost first.
+    Each call is a (function name, callsite, pc, locals) tuple; every function but the innermost is at the call to the
+    next one, and the innermost carries on from its pc.
+    """
+    def __init__(self, stack: List[Val], frames: List[tuple]):
+        self.stack = stack
+        self.frames = frames
+
+    def write(self, path: str, funs: Mapping[str, Any]):
+        """
+        Writes this checkpoint out. The file is replaced all at once, so that a process dying part of the way through
+        leaves the last checkpoint alone.
+        :param funs: the program that is running.
+        :raise CheckpointError: if any of the values can't be saved.
+        :raise OSError: if the file can't be written.
+        """
+        encoder = Encoder()
+        # in the order they are read back in, so that references to values already written point back
+        stack = encoder.encode_all(self.stack)
+        frames = [(name, callsite, pc, list(locals), encoder.encode_all(list(locals.values())))
+                  for name, callsite, pc, locals in self.frames]
+        data = marshal.dumps((stack, frames))
+        temp = path + '.tmp'
+        with open(temp, 'wb') as fp:
+            fp.write(MAGIC + fingerprint(funs) + zlib.compress(data, 1))
+        os.replace(temp, path)
+
+    @staticmethod
+    def read(path: str, funs: Mapping[str, Any]) -> 'Checkpoint':
+        """
+        :param funs: the program to resume.
+        :raise CheckpointError: if the file isn't a checkpoint, or it was saved by a different program.
+        :raise OSError: if the file can't be read.
+        """
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        if not data.startswith(MAGIC):
+            raise CheckpointError(f"{path} is not a checkpoint")
+        digest = fingerprint(funs)
+        if data[len(MAGIC):len(MAGIC) + len(digest)] != digest:
+            raise CheckpointError(f"{path} was saved by a different program")
+        try:
+            stack, frames = marshal.loads(zlib.decompress(data[len(MAGIC) + len(digest):]))
+        except (ValueError, EOFError, TypeError, zlib.error) as e:
+            raise CheckpointError(f"{path} is damaged: {e}")
+        decoder = Decoder()
+        # none of the values made here are garbage, so looking for cycles among them is wasted time
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            stack = decoder.decode_all(stack)
+            frames = [(name, callsite, pc, dict(zip(names, decoder.decode_all(locals))))
+                      for name, callsite, pc, names, locals in frames]
+        finally:
+            if collecting:
+                gc.enable()
+        return Checkpoint(stack, frames)
+
+
+class Checkpointer:
+    """
+    Saves checkpoints of a VM's runs: when the program calls `checkpoint`, every `every` instructions (counted the way
+    limits are), or when the process gets CHECKPOINT_SIGNAL.
+    """
+    def __init__(self, vm, path: str, every: int=0):
+        """
+        :param path: the file to save checkpoints to.
+        :param every: how many instructions to run between checkpoints; 0 only saves them when asked.
+        """
+        self.vm = vm
+        self.path = path
+        self.every = every
+        self.next_at = every or sys.maxsize
+        self.requested = False
+
+    def start(self) -> Callable[[], None]:
+        """
+        Starts saving checkpoints when the process gets CHECKPOINT_SIGNAL, if this is the main thread.
+        :return: a function that stops it again.
+        """
+        self.next_at = self.every or sys.maxsize
+        self.requested = False
+        try:
+            previous = signal.signal(CHECKPOINT_SIGNAL, self._on_signal)
+        except ValueError:
+            # signals can only be handled on the main thread
+            return lambda: None
+        return lambda: signal.signal(CHECKPOINT_SIGNAL, previous)
+
+    def _on_signal(self, signum, frame):
+        self.requested = True
+        # saved at the next call or loop
+        if self.vm.meter is not None:
+            self.vm.meter.next_check = 0
+
+    def due(self, count: int) -> bool:
+        return self.requested or count >= self.next_at
+
+    def save(self, state, advance: bool=False):
+        """
+        Saves a checkpoint of a task's state.
+        :param advance: whether the instruction the innermost function is at has been run, so that resuming carries on
+        from the one after it.
+        :raise VMError: if the program is somewhere it can't be resumed from, holds values that can't be saved, or the
+        file can't be written.
+        """
+        vm = self.vm
+        # a checkpoint that can't be saved isn't tried again until the next one is due
+        self.requested = False
+        self.next_at = vm.meter.count + self.every if self.every and vm.meter is not None else sys.maxsize
+        call_stack = state.call_stack
+        if vm.scheduler is not None and any(not task.done for task in vm.scheduler.tasks):
+            raise VMError("can not checkpoint while other tasks are running", vm, *state.current_loc())
+        for caller, callee in zip(call_stack, call_stack[1:]):
+            bc = caller.fun.bc[caller.pc]
+            if bc.code is BCType.CALL_FUN:
+                name = bc.cache[0].name
+            elif bc.code is BCType.CALL:
+                name = bc.val.val
+            else:
+                name = None
+            if name != callee.name:
+                raise VMError(f"can not checkpoint inside of `{callee.name}`, which was called by a builtin", vm,
+                              *state.current_loc())
+        frames = [(fun_state.name, fun_state.callsite, fun_state.pc, fun_state.locals) for fun_state in call_stack]
+        if advance:
+            name, callsite, pc, locals = frames[-1]
+            frames[-1] = (name, callsite, pc + 1, locals)
+        try:
+            Checkpoint(state.stack, frames).write(self.path, vm.funs)
+        except (CheckpointError, OSError) as e:
+            raise VMError(f"could not checkpoint to {self.path}: {e}", vm, *state.current_loc())
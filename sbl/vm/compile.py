@@ -1,6 +1,8 @@
 from sbl.syntax.parse import *
 from sbl.vm.bc import *
 from sbl.vm.funs import BUILTINS
+from sbl.vm.inline import Inliner, INLINE_THRESHOLD
+from sbl.vm.analysis import StackAnalysis, TypeInference, PurityAnalysis
 
 
 class Fun:
@@ -10,6 +12,18 @@ class Fun:
         self.name = name
         self.bc = bc
         self.meta = meta
+        # filled in by the stack and purity analyses
+        self.effect = None
+        self.pure = False
+
+    def copy(self) -> 'Fun':
+        """
+        Copies this function, with its own list of instructions.
+        """
+        fun = Fun(self.name, list(self.bc), self.meta)
+        fun.effect = self.effect
+        fun.pure = self.pure
+        return fun
 
 
 class FunTable(dict):
@@ -33,13 +47,24 @@ class FunTable(dict):
 
 
 class Compiler:
-    def __init__(self, ast, meta=None):
+    def __init__(self, ast, meta=None, inline_threshold: int=INLINE_THRESHOLD, specialize: bool=True,
+                 persistent_stacks: bool=False):
+        """
+        :param ast: the preprocessed source to compile.
+        :param meta: metadata attached to every compiled instruction and function.
+        :param inline_threshold: the largest function body that will be inlined into its callers; 0 disables inlining.
+        :param specialize: whether to replace builtin calls on known integers with specialized instructions.
+        :param persistent_stacks: whether stack literals make persistent stacks, which builtins never change in place.
+        """
         if meta is None:
             meta = {}
         self.ast = ast
         self.fun_names = []
         self.builtins = BUILTINS
         self.meta = meta
+        self.inline_threshold = inline_threshold
+        self.specialize = specialize
+        self.persistent_stacks = persistent_stacks
 
     def compile(self) -> FunTable:
         # First pass: get the names of each function
@@ -47,6 +72,11 @@ class Compiler:
         funs = FunTable()
         for fun in self.ast:
             funs[fun.name] = self._compile_fun(fun)
+        Inliner(funs, self.builtins, self.inline_threshold).inline()
+        StackAnalysis(funs, self.builtins).analyze()
+        if self.specialize:
+            TypeInference(funs, self.builtins).specialize()
+        PurityAnalysis(funs, self.builtins).analyze()
         return funs
 
     def _meta_with(self, **kwargs):
@@ -95,7 +125,7 @@ class Compiler:
                     bc += [None]
                     bc[start_addr] = BC.jmpz(self._meta_with(where=stmt.br_block.range), Val(jmp_offset + end_addr + 1,
                                                                                              ValType.INT))
-                    bc += self._compile_block(stmt.el_block, len(bc))
+                    bc += self._compile_block(stmt.el_block, len(bc) + jmp_offset)
                     bc[end_addr] = BC.jmp(self._meta_with(where=stmt.el_block.range), Val(len(bc) + jmp_offset,
                                                                                           ValType.INT))
                 else:
@@ -130,12 +160,14 @@ class Compiler:
 
     def _compile_item_push(self, item: Item) -> List[BC]:
         meta = self._meta_with(where=item.range)
-        if item.val in self.fun_names + list(self.builtins.keys()):
+        if item.type is ItemType.IDENT and item.val in self.fun_names + list(self.builtins.keys()):
             bc = [BC.call(meta, item.to_val())]
         elif item.type is ItemType.IDENT:
             bc = [BC.load(meta, item.to_val())]
         elif item.type is ItemType.STACK:
             bc = self._compile_local_stack(item)
+        elif item.type is ItemType.MAP:
+            bc = self._compile_map(item)
         else:
             bc = [BC.push(meta, item.to_val())]
         return bc
@@ -146,10 +178,30 @@ class Compiler:
         meta = self._meta_with(where=item.range)
         if item.is_const():
             # allow the stack to be a single value because nothing has to be loaded
-            bc += [BC.push(meta, item.to_val())]
+            val = item.to_val()
+            if self.persistent_stacks:
+                val = self._persistent(val)
+            bc += [BC.push(meta, val)]
         else:
             assert isinstance(item.val, list)
-            bc += [BC.push(meta, Val([], ValType.STACK))]
+            bc += [BC.push(meta, Val(PVec() if self.persistent_stacks else [], ValType.STACK))]
             for item_val in item.val:
                 bc += self._compile_item_push(item_val) + [BC.pushl(meta)]
         return bc
+
+    def _persistent(self, val: Val) -> Val:
+        if val.type is ValType.STACK:
+            return Val(PVec(map(self._persistent, val.val)), ValType.STACK)
+        elif val.type is ValType.MAP:
+            return Val({key: self._persistent(item) for key, item in val.val.items()}, ValType.MAP)
+        return val
+
+    def _compile_map(self, item: Item) -> List[BC]:
+        assert item.type is ItemType.MAP, 'called _compile_map with non-ItemType.MAP item'
+        meta = self._meta_with(where=item.range)
+        if item.is_const():
+            return [BC.push(meta, item.to_val())]
+        bc = [BC.push(meta, Val({}, ValType.MAP))]
+        for key, val in item.val:
+            bc += self._compile_item_push(key) + self._compile_item_push(val) + [BC.putl(meta)]
+        return bc
@@ -0,0 +1,236 @@
+# files.py
+# File handles for SBL programs, and the table that closes them when a program ends.
+import io
+import mmap
+import os
+import sys
+
+from sbl.common import *
+from sbl.vm.byteview import ByteView
+
+# Binary reads of the rest of a file at least this big map the file into memory instead of copying it.
+MMAP_THRESHOLD = 1 << 20
+
+# The modes files can be opened in: reading, writing, appending, or creating; optionally for updating as well (+), and
+# optionally in binary (b).
+MODES = {kind + plus + binary for kind in 'rwax' for plus in ['', '+'] for binary in ['', 'b']}
+
+# How many characters of standard output are buffered before they are written out.
+OUTPUT_BUFFER = 64 * 1024
+
+
+class FileHandle:
+    """
+    An open file. Text files are read and written as UTF-8 strings, and binary files as bytes. Reads and writes go
+    through Python's buffered I/O, so reading a file a line or a chunk at a time only keeps one buffer of it in memory.
+
+    Reads return None at the end of the file, except for `readall`, which returns an empty string or empty bytes.
+    """
+    def __init__(self, path: str, mode: str, table: 'FileTable'):
+        assert mode in MODES
+        self.path = path
+        self.mode = mode
+        self.binary = 'b' in mode
+        self.table = table
+        if self.binary:
+            self.fp = open(path, mode)
+        else:
+            self.fp = open(path, mode, encoding='utf-8')
+
+    @property
+    def closed(self) -> bool:
+        return self.fp.closed
+
+    def _wrap(self, data):
+        return ByteView(data) if self.binary else data
+
+    def read(self, size: int) -> Optional[Union[str, ByteView]]:
+        """
+        :return: up to `size` characters (or bytes) from the file, or None at the end of the file.
+        """
+        data = self.fp.read(size)
+        return self._wrap(data) if data else None
+
+    def readline(self) -> Optional[Union[str, ByteView]]:
+        """
+        :return: the next line of the file, with its line ending, or None at the end of the file.
+        """
+        data = self.fp.readline()
+        return self._wrap(data) if data else None
+
+    def readall(self) -> Union[str, ByteView]:
+        """
+        :return: the rest of the file. Big enough binary files are memory-mapped, which leaves paging the data in to the
+        OS; the map stays valid after the file is closed.
+        """
+        if self.binary and self.fp.readable():
+            if self.fp.writable():
+                self.fp.flush()
+            start = self.fp.tell()
+            size = os.fstat(self.fp.fileno()).st_size
+            if size - start >= MMAP_THRESHOLD:
+                try:
+                    data = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+                except (OSError, ValueError):
+                    # not a regular file; read it normally
+                    pass
+                else:
+                    self.fp.seek(size)
+                    return ByteView(data, start, size)
+        return self._wrap(self.fp.read())
+
+    def write(self, data: Union[str, ByteView]):
+        self.fp.write(data.memoryview() if self.binary else data)
+
+    def flush(self):
+        self.fp.flush()
+
+    def close(self):
+        try:
+            self.fp.close()
+        finally:
+            self.table.handles.discard(self)
+
+    def __str__(self):
+        state = 'closed ' if self.closed else ''
+        return f"<{state}file {self.path!r} ({self.mode})>"
+
+    def __repr__(self):
+        return f"FileHandle({self.path!r}, {self.mode!r})"
+
+
+class StdinHandle(FileHandle):
+    """
+    Standard input, read as text. Unless it was given a stream to read, whatever `sys.stdin` is at the time of each read
+    is used, so that it can be redirected. When standard input is a terminal, standard output is flushed before each
+    read, so that prompts show up.
+    """
+    def __init__(self, table: 'FileTable', stream: TextIO=None):
+        self.path = '<stdin>'
+        self.mode = 'r'
+        self.binary = False
+        self.table = table
+        self.stream = stream
+
+    @property
+    def fp(self):
+        return sys.stdin if self.stream is None else self.stream
+
+    @property
+    def closed(self) -> bool:
+        return False
+
+    def _prompt(self):
+        if self.fp.isatty():
+            self.table.stdout.flush()
+
+    def read(self, size: int) -> Optional[str]:
+        self._prompt()
+        return super().read(size)
+
+    def readline(self) -> Optional[str]:
+        self._prompt()
+        return super().readline()
+
+    def readall(self) -> str:
+        self._prompt()
+        return super().readall()
+
+    def close(self):
+        pass
+
+
+class StdoutHandle(FileHandle):
+    """
+    Standard output, written as text. Writes are gathered into a buffer of up to `size` characters, which is written
+    out when it fills up, is flushed, or the program ends; unless it was given a stream to write to, it is written to
+    whatever `sys.stdout` is at the time. This saves going through Python's `print` for every value, which is much
+    slower than joining strings.
+    """
+    def __init__(self, table: 'FileTable', size: int=OUTPUT_BUFFER, stream: TextIO=None):
+        """
+        :param size: how many characters to buffer; 0 writes everything out right away.
+        """
+        self.path = '<stdout>'
+        self.mode = 'w'
+        self.binary = False
+        self.table = table
+        self.size = size
+        self.stream = stream
+        self.pieces = []
+        self.buffered = 0
+
+    @property
+    def fp(self):
+        return sys.stdout if self.stream is None else self.stream
+
+    @property
+    def closed(self) -> bool:
+        return False
+
+    def read(self, size: int):
+        raise io.UnsupportedOperation('not readable')
+
+    def readline(self):
+        raise io.UnsupportedOperation('not readable')
+
+    def readall(self):
+        raise io.UnsupportedOperation('not readable')
+
+    def write(self, data: str):
+        self.pieces.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.size:
+            self._drain()
+
+    def _drain(self):
+        if self.pieces:
+            text = ''.join(self.pieces)
+            self.pieces = []
+            self.buffered = 0
+            self.fp.write(text)
+
+    def flush(self):
+        self._drain()
+        self.fp.flush()
+
+    def close(self):
+        self.flush()
+
+
+class FileTable:
+    """
+    The files that a run of a program has open, so that the VM can close whatever the program didn't, along with its
+    standard input and output.
+    """
+    def __init__(self, output_buffer: int=OUTPUT_BUFFER, stdin: TextIO=None, stdout: TextIO=None):
+        """
+        :param output_buffer: how many characters of standard output to buffer.
+        :param stdin: the stream to read standard input from; defaults to `sys.stdin`.
+        :param stdout: the stream to write standard output to; defaults to `sys.stdout`.
+        """
+        self.handles = set()
+        self.stdin = StdinHandle(self, stdin)
+        self.stdout = StdoutHandle(self, output_buffer, stdout)
+
+    def open(self, path: str, mode: str) -> FileHandle:
+        """
+        :raise OSError: if the file can't be opened.
+        """
+        handle = FileHandle(path, mode, self)
+        self.handles.add(handle)
+        return handle
+
+    def close_all(self):
+        """
+        Closes every open file, and flushes standard output, even if closing one of them fails.
+        :raise OSError: the first error from flushing a file as it was closed.
+        """
+        error = None
+        for handle in list(self.handles) + [self.stdout]:
+            try:
+                handle.close()
+            except OSError as e:
+                error = error or e
+        if error is not None:
+            raise error
@@ -1,19 +1,64 @@
 from sbl.common import *
 from sbl.vm.val import *
+from sbl.vm import arrays
+from sbl.vm.pvec import PVec
+from sbl.vm.byteview import ByteView
+from sbl.vm.files import MODES
+from sbl.vm.sched import Channel
+from sbl.vm.pmap import UNSENDABLE_TYPES
+
+# The types that `+` concatenates into strings.
+TEXT_TYPES = [ValType.STRING, ValType.CHAR]
+
+
+def _text(item: Val) -> str:
+    """
+    Gets the text that `print` writes for a value.
+    """
+    return 'Nil' if item.type is ValType.NIL else str(item)
+
+
+def _vectorized(vm_state, op: str, lhs: Val, rhs: Val) -> bool:
+    """
+    Runs a binary operator elementwise when either operand is an array. Arrays are combined element by element, and must
+    be the same length; an integer is combined with every element of an array.
+    :param op: the name of the operator.
+    :return: whether either operand was an array, in which case the result has been pushed.
+    """
+    if lhs.type is not ValType.ARRAY and rhs.type is not ValType.ARRAY:
+        return False
+    for item in [lhs, rhs]:
+        if item.type not in [ValType.ARRAY, ValType.INT]:
+            raise VMError(f"{item.type} is not compatible with arrays in `{op}`", vm_state.vm, *vm_state.current_loc())
+    if lhs.type is rhs.type and len(lhs.val) != len(rhs.val):
+        raise VMError(f"arrays of length {len(lhs.val)} and {len(rhs.val)} can not be combined with `{op}`",
+                      vm_state.vm, *vm_state.current_loc())
+    if op == '/' and (rhs.val == 0 if rhs.type is ValType.INT else arrays.has_zero(rhs.val)):
+        raise VMError("attempted to divide by zero", vm_state.vm, *vm_state.current_loc())
+    try:
+        result = arrays.binop(op, lhs.val, rhs.val)
+    except OverflowError:
+        raise VMError(f"result of `{op}` does not fit in an array", vm_state.vm, *vm_state.current_loc())
+    vm_state.push(Val(result, ValType.ARRAY))
+    return True
 
 
 def plus_op(vm_state):
     """
     The `+` operator.
-    Pops two items off of the stack, and performs the operation.
+    Pops two items off of the stack, and performs the operation. Adding strings and characters together concatenates
+    them into a string.
     :param vm_state: the VM state.
     """
-    lhs = vm_state.pop()
     rhs = vm_state.pop()
+    lhs = vm_state.pop()
+    if _vectorized(vm_state, '+', lhs, rhs):
+        return
+    if lhs.type in TEXT_TYPES and rhs.type in TEXT_TYPES:
+        vm_state.push(Val(lhs.val + rhs.val, ValType.STRING))
+        return
     if lhs.type != rhs.type:
         raise VMError(f"{lhs.type} is not compatible with {rhs.type}", vm_state.vm, *vm_state.current_loc())
-    # TODO : string concatenation
-    #if {lhs.type, rhs.type} == {ValType.CHAR, ValType.STRING}:
     vm_state.push(Val(lhs.val + rhs.val, lhs.type))
 
 
@@ -25,6 +70,8 @@ def times_op(vm_state):
     """
     lhs = vm_state.pop()
     rhs = vm_state.pop()
+    if _vectorized(vm_state, '*', lhs, rhs):
+        return
     if lhs.type is not rhs.type:
         raise VMError(f"{lhs.type} is not compatible with {rhs.type}", vm_state.vm, *vm_state.current_loc())
     vm_state.push(Val(lhs.val * rhs.val, lhs.type))
@@ -37,6 +84,8 @@ def minus_op(vm_state):
     """
     rhs = vm_state.pop()
     lhs = vm_state.pop()
+    if _vectorized(vm_state, '-', lhs, rhs):
+        return
     if lhs.type is not rhs.type:
         raise VMError(f"{lhs.type} is not compatible with {rhs.type}", vm_state.vm, *vm_state.current_loc())
     vm_state.push(Val(lhs.val - rhs.val, lhs.type))
@@ -61,6 +110,8 @@ def div_op(vm_state):
     """
     rhs = vm_state.pop()
     lhs = vm_state.pop()
+    if _vectorized(vm_state, '/', lhs, rhs):
+        return
     if lhs.type is not rhs.type:
         raise VMError(f"{lhs.type} is not compatible with {rhs.type}", vm_state.vm, *vm_state.current_loc())
     if rhs.type is ValType.INT and rhs == 0:
@@ -76,6 +127,8 @@ def equals_op(vm_state):
     """
     lhs = vm_state.pop()
     rhs = vm_state.pop()
+    if _vectorized(vm_state, '==', lhs, rhs):
+        return
     vm_state.push(Val(lhs.val == rhs.val, ValType.BOOL))
 
 
@@ -87,6 +140,8 @@ def nequals_op(vm_state):
     """
     lhs = vm_state.pop()
     rhs = vm_state.pop()
+    if _vectorized(vm_state, '!=', lhs, rhs):
+        return
     vm_state.push(Val(lhs.val != rhs.val, ValType.BOOL))
 
 
@@ -98,6 +153,8 @@ def ltequals_op(vm_state):
     """
     rhs = vm_state.pop()
     lhs = vm_state.pop()
+    if _vectorized(vm_state, '<=', lhs, rhs):
+        return
     vm_state.push(Val(lhs.val <= rhs.val, ValType.BOOL))
 
 
@@ -109,6 +166,8 @@ def gtequals_op(vm_state):
     """
     rhs = vm_state.pop()
     lhs = vm_state.pop()
+    if _vectorized(vm_state, '>=', lhs, rhs):
+        return
     vm_state.push(Val(lhs.val >= rhs.val, ValType.BOOL))
 
 
@@ -120,6 +179,8 @@ def less_than_op(vm_state):
     """
     rhs = vm_state.pop()
     lhs = vm_state.pop()
+    if _vectorized(vm_state, '<', lhs, rhs):
+        return
     vm_state.push(Val(lhs.val < rhs.val, ValType.BOOL))
 
 
@@ -131,6 +192,8 @@ def greater_than_op(vm_state):
     """
     rhs = vm_state.pop()
     lhs = vm_state.pop()
+    if _vectorized(vm_state, '>', lhs, rhs):
+        return
     vm_state.push(Val(lhs.val > rhs.val, ValType.BOOL))
 
 
@@ -138,25 +201,21 @@ def print_fn(vm_state):
     """
     The builtin print function.
     Expects one item on top of the stack.
-    Pops the top item of the stack off, writing it to STDOUT, without newline.
+    Pops the top item of the stack off, writing it to STDOUT, without newline. STDOUT is buffered until the program
+    ends, or it is flushed.
     :param vm_state: the VM state.
     """
-    item = vm_state.pop()
-    if item.type == ValType.NIL:
-        print('Nil', end='')
-    else:
-        print(str(item), end='')
+    vm_state.files.stdout.write(_text(vm_state.pop()))
 
 
 def println_fn(vm_state):
     """
     The builtin println function.
     Expects one item on top of the stack.
-    Pops the top item of the stack off, writing it to STDOUT, followed by a newline..
+    Pops the top item of the stack off, writing it to STDOUT, followed by a newline.
     :param vm_state: the VM state.
     """
-    print_fn(vm_state)
-    print()
+    vm_state.files.stdout.write(_text(vm_state.pop()) + '\n')
 
 
 def stack_size_fn(vm_state):
@@ -174,7 +233,9 @@ def tos_fn(vm_state):
     Duplicates the top element of the stack.
     :param vm_state: the VM state.
     """
-    vm_state.push(vm_state.stack[-1])
+    tos = vm_state.pop()
+    vm_state.push(tos)
+    vm_state.push(tos)
 
 
 def pop_fn(vm_state):
@@ -188,7 +249,7 @@ def pop_fn(vm_state):
     if tos.type is not ValType.STACK:
         raise VMError(f"expected a stack for `pop` function; instead got {tos.type}", vm_state.vm,
                       *vm_state.current_loc())
-    val = tos.val.pop()
+    tos, val = tos.pop_item()
     vm_state.push(tos)
     vm_state.push(val)
 
@@ -205,32 +266,803 @@ def push_fn(vm_state):
     if stack.type is not ValType.STACK:
         raise VMError(f"expected a stack for `push` function; instead got {stack.type}", vm_state.vm,
                       *vm_state.current_loc())
-    stack.val.append(tos)
-    vm_state.push(stack)
+    vm_state.push(stack.push_item(tos))
 
 
 def len_fn(vm_state):
     """
     The "length" function for local stacks.
-    Expects the top item of the stack to be a local stack.
+    Expects the top item of the stack to be a local stack, string, map, array, or bytes.
     This function pushes the length of the specified local stack to the global stack.
     :param vm_state: the VM state.
     """
     tos = vm_state.pop()
-    if tos.type not in [ValType.STACK, ValType.STRING]:
-        raise VMError(f"expected a stack or string for `len` function; instead got {tos.type}", vm_state.vm,
-                      *vm_state.current_loc())
+    if tos.type not in [ValType.STACK, ValType.STRING, ValType.MAP, ValType.ARRAY, ValType.BYTES]:
+        raise VMError(f"expected a stack, string, map, array, or bytes for `len` function; instead got {tos.type}",
+                      vm_state.vm, *vm_state.current_loc())
     vm_state.push(tos)
     vm_state.push(Val(len(tos.val), ValType.INT))
 
 
-def open_fn(vm_state):
+def _expect_type(vm_state, val: Val, types: List[ValType], fname: str, what: str):
+    if val.type not in types:
+        raise VMError(f"expected {what} for `{fname}` function; instead got {val.type}", vm_state.vm,
+                      *vm_state.current_loc())
+
+
+def _stack_index(vm_state, stack: Val, index: Val, fname: str, end: bool=False) -> int:
+    """
+    Checks an index into a local stack. Indexes count up from the bottom of the stack, starting at 0; negative indexes
+    count down from the top, with -1 being the top item.
+    :param end: whether the index may point one past the top item, as the end of a slice may.
+    :return: the index, counted from the bottom.
+    """
+    _expect_type(vm_state, index, [ValType.INT], fname, 'an integer index')
+    size = len(stack.val)
+    idx = index.val + size if index.val < 0 else index.val
+    if not 0 <= idx < size + end:
+        what = f"a string with {size} characters" if stack.type is ValType.STRING else f"a stack with {size} items"
+        raise VMError(f"index {index.val} is out of range for {what}", vm_state.vm, *vm_state.current_loc())
+    return idx
+
+
+def _map_key(vm_state, key: Val, fname: str):
+    if key.type not in KEY_TYPES:
+        raise VMError(f"map keys can not be {key.type.value}s (in `{fname}` function)", vm_state.vm,
+                      *vm_state.current_loc())
+
+
+def _own_item(stack: Val, key) -> Val:
+    """
+    Gets an item of a local stack or map to push. Frozen items are shared with a constant or a memoized result, so the
+    stack or map is given its own copy of them first, which changes to the item are then made to.
+    """
+    item = stack.val[key]
+    if item.frozen:
+        if isinstance(stack.val, PVec):
+            return item.share()
+        stack.thaw()
+        item = stack.val[key]
+    return item
+
+
+def get_fn(vm_state):
+    """
+    The "get" function for local stacks, strings, bytes, and maps.
+    Expects the top two items of the stack to be an index, followed by a local stack, string, or bytes; or a key,
+    followed by a map. This function pushes the item at that index of the local stack, the character at that index of
+    the string, the byte (as an integer) at that index of the bytes, or the value for that key in the map (Nil if there
+    is none), leaving the local stack, string, bytes, or map in place.
+    :param vm_state: the VM state.
+    """
+    index = vm_state.pop()
+    stack = vm_state.pop()
+    _expect_type(vm_state, stack, [ValType.STACK, ValType.STRING, ValType.BYTES, ValType.MAP], 'get',
+                 'a stack, string, bytes, or map')
+    if stack.type is ValType.MAP:
+        _map_key(vm_state, index, 'get')
+        vm_state.push(stack)
+        vm_state.push(_own_item(stack, index) if index in stack.val else Val(None, ValType.NIL))
+        return
+    idx = _stack_index(vm_state, stack, index, 'get')
+    vm_state.push(stack)
+    if stack.type is ValType.STRING:
+        vm_state.push(Val(stack.val[idx], ValType.CHAR))
+    elif stack.type is ValType.BYTES:
+        vm_state.push(Val(stack.val[idx], ValType.INT))
+    else:
+        vm_state.push(_own_item(stack, idx))
+
+
+def set_fn(vm_state):
+    """
+    The "set" function for local stacks.
+    Expects the top three items of the stack to be any value, followed by an index, followed by a local stack.
+    This function replaces the item at that index of the local stack with the value, leaving the local stack in place.
+    :param vm_state: the VM state.
+    """
+    val = vm_state.pop()
+    index = vm_state.pop()
+    stack = vm_state.pop()
+    _expect_type(vm_state, stack, [ValType.STACK], 'set', 'a stack')
+    vm_state.push(stack.set_item(_stack_index(vm_state, stack, index, 'set'), val))
+
+
+def peek_fn(vm_state):
+    """
+    The "peek" function for local stacks.
+    Expects the top item of the stack to be a local stack.
+    This function pushes the top item of the local stack, without popping it.
+    :param vm_state: the VM state.
+    """
+    stack = vm_state.pop()
+    _expect_type(vm_state, stack, [ValType.STACK], 'peek', 'a stack')
+    if not stack.val:
+        raise VMError("attempted to peek at an empty stack", vm_state.vm, *vm_state.current_loc())
+    vm_state.push(stack)
+    vm_state.push(_own_item(stack, -1))
+
+
+def slice_fn(vm_state):
+    """
+    The "slice" function for local stacks, strings, and bytes.
+    Expects the top three items of the stack to be an end index, followed by a start index, followed by a local stack,
+    string, or bytes. This function pushes a new local stack, string, or bytes with the items from the start index up
+    to (but not including) the end index, leaving the original in place. Slices of bytes share the original's memory.
+    :param vm_state: the VM state.
+    """
+    end = vm_state.pop()
+    start = vm_state.pop()
+    stack = vm_state.pop()
+    _expect_type(vm_state, stack, [ValType.STACK, ValType.STRING, ValType.BYTES], 'slice', 'a stack, string, or bytes')
+    lo = _stack_index(vm_state, stack, start, 'slice', end=True)
+    hi = _stack_index(vm_state, stack, end, 'slice', end=True)
+    vm_state.push(stack)
+    vm_state.push(Val(stack.val[lo:max(lo, hi)], stack.type))
+
+
+def extend_fn(vm_state):
+    """
+    The "extend" function for local stacks.
+    Expects the top two items of the stack to be local stacks.
+    This function pushes every item of the top local stack onto the one below it, leaving that one in place.
+    :param vm_state: the VM state.
+    """
+    items = vm_state.pop()
+    stack = vm_state.pop()
+    _expect_type(vm_state, items, [ValType.STACK], 'extend', 'a stack')
+    _expect_type(vm_state, stack, [ValType.STACK], 'extend', 'a stack')
+    if isinstance(stack.val, PVec):
+        stack = Val(stack.val.extend(items.val), ValType.STACK)
+    else:
+        stack.thaw()
+        stack.val.extend(items.val)
+    vm_state.push(stack)
+
+
+def concat_fn(vm_state):
+    """
+    The "concat" function for local stacks and bytes.
+    Expects the top two items of the stack to be local stacks, or bytes.
+    This function replaces them with a new local stack or bytes that has the items of the lower one, then those of the
+    top one.
+    :param vm_state: the VM state.
+    """
+    rhs = vm_state.pop()
+    lhs = vm_state.pop()
+    _expect_type(vm_state, lhs, [ValType.STACK, ValType.BYTES], 'concat', 'a stack or bytes')
+    _expect_type(vm_state, rhs, [lhs.type], 'concat', f"{'a stack' if lhs.type is ValType.STACK else 'bytes'}")
+    vm_state.push(Val(lhs.val + rhs.val, lhs.type))
+
+
+def reverse_fn(vm_state):
+    """
+    The "reverse" function for local stacks.
+    Expects the top item of the stack to be a local stack, which this function reverses in place.
+    :param vm_state: the VM state.
+    """
+    stack = vm_state.pop()
+    _expect_type(vm_state, stack, [ValType.STACK], 'reverse', 'a stack')
+    if isinstance(stack.val, PVec):
+        stack = Val(PVec(reversed(stack.val.tolist())), ValType.STACK)
+    else:
+        stack.thaw()
+        stack.val.reverse()
+    vm_state.push(stack)
+
+
+def sort_fn(vm_state):
+    """
+    The "sort" function for local stacks.
+    Expects the top item of the stack to be a local stack of integers, characters, or strings, all of the same type.
+    This function sorts it in place, with the smallest item on the bottom. The sort is stable.
+    :param vm_state: the VM state.
+    """
+    stack = vm_state.pop()
+    _expect_type(vm_state, stack, [ValType.STACK], 'sort', 'a stack')
+    types = {item.type for item in stack.val}
+    if len(types) > 1 or not types <= {ValType.INT, ValType.CHAR, ValType.STRING}:
+        raise VMError(f"can only sort stacks of integers, characters, or strings of one type; instead got "
+                      f"{', '.join(sorted(ty.value for ty in types))}", vm_state.vm, *vm_state.current_loc())
+    if isinstance(stack.val, PVec):
+        stack = Val(PVec(sorted(stack.val, key=lambda item: item.val)), ValType.STACK)
+    else:
+        stack.thaw()
+        stack.val.sort(key=lambda item: item.val)
+    vm_state.push(stack)
+
+
+def put_fn(vm_state):
+    """
+    The "put" function for maps.
+    Expects the top three items of the stack to be any value, followed by a key, followed by a map.
+    This function sets the value for that key in the map, leaving the map in place.
+    :param vm_state: the VM state.
+    """
+    val = vm_state.pop()
+    key = vm_state.pop()
+    table = vm_state.pop()
+    _expect_type(vm_state, table, [ValType.MAP], 'put', 'a map')
+    _map_key(vm_state, key, 'put')
+    table.thaw()
+    table.val[key] = val
+    vm_state.push(table)
+
+
+def has_fn(vm_state):
+    """
+    The "has" function for maps.
+    Expects the top two items of the stack to be a key, followed by a map.
+    This function pushes whether the map has a value for that key, leaving the map in place.
+    :param vm_state: the VM state.
+    """
+    key = vm_state.pop()
+    table = vm_state.pop()
+    _expect_type(vm_state, table, [ValType.MAP], 'has', 'a map')
+    _map_key(vm_state, key, 'has')
+    vm_state.push(table)
+    vm_state.push(Val(key in table.val, ValType.BOOL))
+
+
+def delete_fn(vm_state):
+    """
+    The "delete" function for maps.
+    Expects the top two items of the stack to be a key, followed by a map.
+    This function removes that key from the map if it is there, leaving the map in place.
+    :param vm_state: the VM state.
+    """
+    key = vm_state.pop()
+    table = vm_state.pop()
+    _expect_type(vm_state, table, [ValType.MAP], 'delete', 'a map')
+    _map_key(vm_state, key, 'delete')
+    table.thaw()
+    table.val.pop(key, None)
+    vm_state.push(table)
+
+
+def keys_fn(vm_state):
+    """
+    The "keys" function for maps.
+    Expects the top item of the stack to be a map.
+    This function pushes a new local stack of the map's keys, in the order they were first put, leaving the map in
+    place.
+    :param vm_state: the VM state.
+    """
+    table = vm_state.pop()
+    _expect_type(vm_state, table, [ValType.MAP], 'keys', 'a map')
+    vm_state.push(table)
+    vm_state.push(Val(list(table.val), ValType.STACK))
+
+
+def array_fn(vm_state):
+    """
+    The "array" function.
+    Expects the top item of the stack to be a local stack of integers.
+    This function replaces it with an array of the same integers, from the bottom of the local stack up.
+    :param vm_state: the VM state.
+    """
+    stack = vm_state.pop()
+    _expect_type(vm_state, stack, [ValType.STACK], 'array', 'a stack')
+    for item in stack.val:
+        _expect_type(vm_state, item, [ValType.INT], 'array', 'a stack of integers')
+    try:
+        vm_state.push(Val(arrays.from_ints(item.val for item in stack.val), ValType.ARRAY))
+    except OverflowError:
+        raise VMError("integer is too large to fit in an array", vm_state.vm, *vm_state.current_loc())
+
+
+def unarray_fn(vm_state):
+    """
+    The "unarray" function.
+    Expects the top item of the stack to be an array.
+    This function replaces it with a new local stack of the same integers, with the first one on the bottom.
+    :param vm_state: the VM state.
+    """
+    arr = vm_state.pop()
+    _expect_type(vm_state, arr, [ValType.ARRAY], 'unarray', 'an array')
+    vm_state.push(Val([Val(item, ValType.INT) for item in arr.val.tolist()], ValType.STACK))
+
+
+def range_fn(vm_state):
+    """
+    The "range" function.
+    Expects the top two items of the stack to be an end integer, followed by a start integer.
+    This function replaces them with an array of the integers from the start up to (but not including) the end.
+    :param vm_state: the VM state.
+    """
+    stop = vm_state.pop()
+    start = vm_state.pop()
+    _expect_type(vm_state, stop, [ValType.INT], 'range', 'an integer')
+    _expect_type(vm_state, start, [ValType.INT], 'range', 'an integer')
+    try:
+        vm_state.push(Val(arrays.arange(start.val, stop.val), ValType.ARRAY))
+    except OverflowError:
+        raise VMError("range bounds are too large to fit in an array", vm_state.vm, *vm_state.current_loc())
+
+
+def _reduce(vm_state, name: str):
+    arr = vm_state.pop()
+    _expect_type(vm_state, arr, [ValType.ARRAY], name, 'an array')
+    if name != 'sum' and not len(arr.val):
+        raise VMError(f"attempted to take the {name} of an empty array", vm_state.vm, *vm_state.current_loc())
+    vm_state.push(Val(arrays.reduce(name, arr.val), ValType.INT))
+
+
+def sum_fn(vm_state):
+    """
+    The "sum" function for arrays.
+    Expects the top item of the stack to be an array, and replaces it with the sum of its elements.
+    :param vm_state: the VM state.
+    """
+    _reduce(vm_state, 'sum')
+
+
+def min_fn(vm_state):
+    """
+    The "min" function for arrays.
+    Expects the top item of the stack to be a non-empty array, and replaces it with its smallest element.
+    :param vm_state: the VM state.
+    """
+    _reduce(vm_state, 'min')
+
+
+def max_fn(vm_state):
+    """
+    The "max" function for arrays.
+    Expects the top item of the stack to be a non-empty array, and replaces it with its largest element.
+    :param vm_state: the VM state.
+    """
+    _reduce(vm_state, 'max')
+
+
+def builder_fn(vm_state):
+    """
+    The "builder" function.
+    Pushes a new, empty string builder.
+    :param vm_state: the VM state.
+    """
+    vm_state.push(Val([], ValType.BUILDER))
+
 
+def append_fn(vm_state):
+    """
+    The "append" function for string builders.
+    Expects the top two items of the stack to be any value, followed by a string builder.
+    This function adds the value to the end of the builder, as `print` would write it, leaving the builder in place.
+    :param vm_state: the VM state.
+    """
+    item = vm_state.pop()
+    builder = vm_state.pop()
+    _expect_type(vm_state, builder, [ValType.BUILDER], 'append', 'a string builder')
+    builder.val.append(_text(item))
+    vm_state.push(builder)
+
+
+def finish_fn(vm_state):
+    """
+    The "finish" function for string builders.
+    Expects the top item of the stack to be a string builder, and replaces it with a string of everything appended to
+    it.
+    :param vm_state: the VM state.
+    """
+    builder = vm_state.pop()
+    _expect_type(vm_state, builder, [ValType.BUILDER], 'finish', 'a string builder')
+    text = ''.join(builder.val)
+    # keep the joined pieces, so that finishing again (after more appends) doesn't join them all over
+    builder.val[:] = [text]
+    vm_state.push(Val(text, ValType.STRING))
+
+
+def join_fn(vm_state):
+    """
+    The "join" function.
+    Expects the top two items of the stack to be a separator string, followed by a local stack.
+    This function replaces them with a string of the local stack's items, from the bottom up, as `print` would write
+    them, with the separator between each one.
+    :param vm_state: the VM state.
+    """
+    sep = vm_state.pop()
+    stack = vm_state.pop()
+    _expect_type(vm_state, sep, TEXT_TYPES, 'join', 'a string separator')
+    _expect_type(vm_state, stack, [ValType.STACK], 'join', 'a stack')
+    if isinstance(stack.val, CharSeq) and not sep.val:
+        text = stack.val.text
+    else:
+        text = sep.val.join(map(_text, stack.val))
+    vm_state.push(Val(text, ValType.STRING))
+
+
+def chars_fn(vm_state):
+    """
+    The "chars" function.
+    Expects the top item of the stack to be a string, and replaces it with a local stack of its characters, with the
+    first character on the bottom. Character values are made as they are used.
+    :param vm_state: the VM state.
+    """
+    text = vm_state.pop()
+    _expect_type(vm_state, text, [ValType.STRING], 'chars', 'a string')
+    vm_state.push(Val(CharSeq(text.val), ValType.STACK, True))
+
+
+def unchars_fn(vm_state):
+    """
+    The "unchars" function.
+    Expects the top item of the stack to be a local stack of characters, and replaces it with a string of them, from the
+    bottom up.
+    :param vm_state: the VM state.
+    """
+    stack = vm_state.pop()
+    _expect_type(vm_state, stack, [ValType.STACK], 'unchars', 'a stack')
+    if isinstance(stack.val, CharSeq):
+        # nothing has been changed, so this is the string that the stack was made from
+        vm_state.push(Val(stack.val.text, ValType.STRING))
+        return
+    for item in stack.val:
+        _expect_type(vm_state, item, [ValType.CHAR], 'unchars', 'a stack of characters')
+    vm_state.push(Val(''.join(item.val for item in stack.val), ValType.STRING))
+
+
+def bytes_fn(vm_state):
+    """
+    The "bytes" function.
+    Expects the top item of the stack to be a string, or a local stack of integers from 0 to 255.
+    This function replaces it with bytes: the UTF-8 encoding of the string, or the integers of the local stack, from
+    the bottom up.
+    :param vm_state: the VM state.
+    """
+    item = vm_state.pop()
+    _expect_type(vm_state, item, [ValType.STRING, ValType.STACK], 'bytes', 'a string or stack')
+    if item.type is ValType.STRING:
+        data = item.val.encode('utf-8')
+    else:
+        for byte in item.val:
+            _expect_type(vm_state, byte, [ValType.INT], 'bytes', 'a stack of integers')
+            if not 0 <= byte.val < 256:
+                raise VMError(f"byte values must be from 0 to 255; instead got {byte.val}", vm_state.vm,
+                              *vm_state.current_loc())
+        data = bytes(byte.val for byte in item.val)
+    vm_state.push(Val(ByteView(data), ValType.BYTES))
+
+
+def decode_fn(vm_state):
+    """
+    The "decode" function for bytes.
+    Expects the top item of the stack to be UTF-8 encoded bytes, and replaces it with the string that they encode.
+    :param vm_state: the VM state.
+    """
+    data = vm_state.pop()
+    _expect_type(vm_state, data, [ValType.BYTES], 'decode', 'bytes')
+    try:
+        vm_state.push(Val(str(data.val.memoryview(), 'utf-8'), ValType.STRING))
+    except UnicodeDecodeError as e:
+        raise VMError(f"bytes are not valid UTF-8: {e.reason} at index {e.start}", vm_state.vm,
+                      *vm_state.current_loc())
+
+
+def find_fn(vm_state):
+    """
+    The "find" function for strings and bytes.
+    Expects the top two items of the stack to be a string or character, followed by a string; or bytes or an integer
+    byte, followed by bytes. This function pushes the index of the first place the top item appears in the one below
+    it, or -1 if it doesn't, leaving the string or bytes in place.
+    :param vm_state: the VM state.
+    """
+    needle = vm_state.pop()
+    haystack = vm_state.pop()
+    _expect_type(vm_state, haystack, [ValType.STRING, ValType.BYTES], 'find', 'a string or bytes')
+    if haystack.type is ValType.STRING:
+        _expect_type(vm_state, needle, TEXT_TYPES, 'find', 'a string or character to find')
+        index = haystack.val.find(needle.val)
+    else:
+        _expect_type(vm_state, needle, [ValType.BYTES, ValType.INT], 'find', 'bytes or an integer byte to find')
+        if needle.type is ValType.INT and not 0 <= needle.val < 256:
+            raise VMError(f"byte values must be from 0 to 255; instead got {needle.val}", vm_state.vm,
+                          *vm_state.current_loc())
+        index = haystack.val.find(needle.val.memoryview() if needle.type is ValType.BYTES else needle.val)
+    vm_state.push(haystack)
+    vm_state.push(Val(index, ValType.INT))
+
+
+def _file_result(data) -> Val:
+    if data is None:
+        return Val(None, ValType.NIL)
+    return Val(data, ValType.BYTES if isinstance(data, ByteView) else ValType.STRING)
+
+
+def _blocking(vm_state, fn: Callable, *args) -> Any:
+    """
+    Does I/O, letting other tasks run until it is done.
+    :return: what the I/O function returned.
+    """
+    sched = getattr(vm_state.vm, 'scheduler', None)
+    return fn(*args) if sched is None else sched.blocking(fn, *args)
+
+
+def _file_op(vm_state, handle: Val, fname: str, op: str, *args):
+    """
+    Runs a file handle method, turning the errors it raises into VM errors.
+    :param op: the name of the method.
+    :return: what the method returned.
+    """
+    _expect_type(vm_state, handle, [ValType.FILE], fname, 'a file')
+    try:
+        return _blocking(vm_state, getattr(handle.val, op), *args)
+    except (OSError, ValueError) as e:
+        raise VMError(f"could not {fname} {handle.val}: {e}", vm_state.vm, *vm_state.current_loc())
+
+
+def open_fn(vm_state):
+    """
+    The "open" function.
+    Expects the top two items of the stack to be a mode string, followed by a path string. This function replaces them
+    with a handle to the file, opened in that mode. The modes are the same as Python's: "r", "w", "a", or "x", followed
+    by "+" to both read and write, and "b" to read and write bytes instead of strings. Files that are still open when
+    the program ends are closed.
+    :param vm_state: the VM state.
+    """
     mode_val = vm_state.pop()
-    if mode_val.type != ValType.STRING:
-        raise VMError(f'expected a string for the file mode; instead got {mode_val.type}', vm_state.vm,
+    path_val = vm_state.pop()
+    _expect_type(vm_state, mode_val, [ValType.STRING], 'open', 'a string for the file mode')
+    _expect_type(vm_state, path_val, [ValType.STRING], 'open', 'a string for the file path')
+    if mode_val.val not in MODES:
+        raise VMError(f"unknown file mode: {mode_val.val!r}", vm_state.vm, *vm_state.current_loc())
+    try:
+        handle = _blocking(vm_state, vm_state.files.open, path_val.val, mode_val.val)
+    except OSError as e:
+        raise VMError(f"could not open {path_val.val!r}: {e.strerror}", vm_state.vm, *vm_state.current_loc())
+    vm_state.push(Val(handle, ValType.FILE))
+
+
+def stdin_fn(vm_state):
+    """
+    The "stdin" function.
+    Pushes a handle to standard input, which can be read like a text file. Reading it a line at a time with `readline`
+    streams it, so programs can be used as filters.
+    :param vm_state: the VM state.
+    """
+    vm_state.push(Val(vm_state.files.stdin, ValType.FILE))
+
+
+def stdout_fn(vm_state):
+    """
+    The "stdout" function.
+    Pushes a handle to standard output, which can be written like a text file. Writes to it share a buffer with
+    `print` and `println`, which `flush` writes out.
+    :param vm_state: the VM state.
+    """
+    vm_state.push(Val(vm_state.files.stdout, ValType.FILE))
+
+
+def close_fn(vm_state):
+    """
+    The "close" function.
+    Expects the top item of the stack to be a file or a channel, and pops it, closing it. Closing a file that is already
+    closed does nothing, as does closing a channel that is already closed.
+    :param vm_state: the VM state.
+    """
+    item = vm_state.pop()
+    if item.type is ValType.CHANNEL:
+        item.val.close(_scheduler(vm_state, 'close'))
+    else:
+        _file_op(vm_state, item, 'close', 'close')
+
+
+def read_fn(vm_state):
+    """
+    The "read" function.
+    Expects the top two items of the stack to be a positive integer, followed by a file. This function replaces the
+    integer with up to that many characters (or bytes, for binary files) read from the file, or Nil at the end of the
+    file, leaving the file in place.
+    :param vm_state: the VM state.
+    """
+    size = vm_state.pop()
+    handle = vm_state.pop()
+    _expect_type(vm_state, size, [ValType.INT], 'read', 'an integer size')
+    if size.val <= 0:
+        raise VMError(f"read size must be positive; instead got {size.val}", vm_state.vm, *vm_state.current_loc())
+    data = _file_op(vm_state, handle, 'read', 'read', size.val)
+    vm_state.push(handle)
+    vm_state.push(_file_result(data))
+
+
+def readline_fn(vm_state):
+    """
+    The "readline" function.
+    Expects the top item of the stack to be a file. This function pushes the next line of the file, including its line
+    ending, or Nil at the end of the file.
+    :param vm_state: the VM state.
+    """
+    handle = vm_state.pop()
+    data = _file_op(vm_state, handle, 'readline', 'readline')
+    vm_state.push(handle)
+    vm_state.push(_file_result(data))
+
+
+def readall_fn(vm_state):
+    """
+    The "readall" function.
+    Expects the top item of the stack to be a file. This function pushes the rest of the file, which is empty at the
+    end of the file. Big binary files are memory-mapped rather than read into memory.
+    :param vm_state: the VM state.
+    """
+    handle = vm_state.pop()
+    data = _file_op(vm_state, handle, 'readall', 'readall')
+    vm_state.push(handle)
+    vm_state.push(_file_result(data))
+
+
+def write_fn(vm_state):
+    """
+    The "write" function.
+    Expects the top two items of the stack to be a string or character (or bytes, for binary files), followed by a
+    file. This function writes the top item to the file, and pops it.
+    :param vm_state: the VM state.
+    """
+    data = vm_state.pop()
+    handle = vm_state.pop()
+    _expect_type(vm_state, handle, [ValType.FILE], 'write', 'a file')
+    if handle.val.binary:
+        _expect_type(vm_state, data, [ValType.BYTES], 'write', 'bytes to write to a binary file')
+    else:
+        _expect_type(vm_state, data, TEXT_TYPES, 'write', 'a string or character to write to a text file')
+    _file_op(vm_state, handle, 'write', 'write', data.val)
+    vm_state.push(handle)
+
+
+def flush_fn(vm_state):
+    """
+    The "flush" function.
+    Expects the top item of the stack to be a file, and writes anything buffered for it out to the OS.
+    :param vm_state: the VM state.
+    """
+    handle = vm_state.pop()
+    _file_op(vm_state, handle, 'flush', 'flush')
+    vm_state.push(handle)
+
+
+def _scheduler(vm_state, fname: str):
+    sched = getattr(vm_state.vm, 'scheduler', None)
+    if sched is None:
+        raise VMError(f"`{fname}` can only be used in programs run by the VM", vm_state.vm, *vm_state.current_loc())
+    return sched
+
+
+def spawn_fn(vm_state):
+    """
+    The "spawn" function.
+    Expects the top two items of the stack to be the name of a function, followed by any item. This function replaces
+    them with a new task, which calls the function with that item alone on its own global stack. The task starts
+    running once the current task yields, waits, or does I/O.
+    :param vm_state: the VM state.
+    """
+    name = vm_state.pop()
+    arg = vm_state.pop()
+    _expect_type(vm_state, name, [ValType.STRING], 'spawn', 'a function name')
+    sched = _scheduler(vm_state, 'spawn')
+    vm = vm_state.vm
+    if name.val not in vm.funs:
+        raise VMError(f"No such function: `{name.val}`", vm, *vm_state.current_loc())
+    fun = vm.funs[name.val]
+    file, where = vm_state.current_loc()
+    callsite = f"task spawned at {file}:{where}"
+    state = vm_state.fork()
+    state.push(arg)
+    task = sched.spawn(state, lambda: vm._call_fun(fun, callsite))
+    vm_state.push(Val(task, ValType.TASK))
+
+
+def yield_fn(vm_state):
+    """
+    The "yield" function.
+    Lets every other task that is ready to run have a turn before the current task carries on.
+    :param vm_state: the VM state.
+    """
+    _scheduler(vm_state, 'yield').yield_()
+
+
+def checkpoint_fn(vm_state):
+    """
+    The "checkpoint" function.
+    Saves a checkpoint of the program to the file given to `sbl --checkpoint`, so that `sbl --resume` can carry on from
+    just after this call.
+    :param vm_state: the VM state.
+    """
+    checkpointer = getattr(vm_state.vm, 'checkpointer', None)
+    if checkpointer is None:
+        raise VMError("`checkpoint` can only be used in programs run with a checkpoint file", vm_state.vm,
                       *vm_state.current_loc())
-    raise NotImplementedError()
+    checkpointer.save(vm_state, advance=True)
+
+
+def wait_fn(vm_state):
+    """
+    The "wait" function.
+    Expects the top item of the stack to be a task. This function waits for the task to finish, and replaces it with a
+    local stack of what the task left on its global stack.
+    :param vm_state: the VM state.
+    """
+    task = vm_state.pop()
+    _expect_type(vm_state, task, [ValType.TASK], 'wait', 'a task')
+    _scheduler(vm_state, 'wait').join(task.val)
+    vm_state.push(Val(list(task.val.state.stack), ValType.STACK))
+
+
+def channel_fn(vm_state):
+    """
+    The "channel" function.
+    Expects the top item of the stack to be a positive integer, and replaces it with a channel that holds up to that
+    many items.
+    :param vm_state: the VM state.
+    """
+    capacity = vm_state.pop()
+    _expect_type(vm_state, capacity, [ValType.INT], 'channel', 'an integer capacity')
+    if capacity.val <= 0:
+        raise VMError(f"channel capacity must be positive; instead got {capacity.val}", vm_state.vm,
+                      *vm_state.current_loc())
+    vm_state.push(Val(Channel(capacity.val), ValType.CHANNEL))
+
+
+def send_fn(vm_state):
+    """
+    The "send" function.
+    Expects the top two items of the stack to be any item, followed by a channel. This function pops the item and sends
+    it on the channel, waiting for room in the channel if it is full.
+    :param vm_state: the VM state.
+    """
+    item = vm_state.pop()
+    chan = vm_state.pop()
+    _expect_type(vm_state, chan, [ValType.CHANNEL], 'send', 'a channel')
+    try:
+        chan.val.send(_scheduler(vm_state, 'send'), item)
+    except ValueError as e:
+        raise VMError(f"could not send on {chan.val}: {e}", vm_state.vm, *vm_state.current_loc())
+    vm_state.push(chan)
+
+
+def recv_fn(vm_state):
+    """
+    The "recv" function.
+    Expects the top item of the stack to be a channel. This function pushes the next item received from the channel,
+    waiting for one if the channel is empty, or Nil if the channel is closed and empty.
+    :param vm_state: the VM state.
+    """
+    chan = vm_state.pop()
+    _expect_type(vm_state, chan, [ValType.CHANNEL], 'recv', 'a channel')
+    item = chan.val.recv(_scheduler(vm_state, 'recv'))
+    vm_state.push(chan)
+    vm_state.push(Val(None, ValType.NIL) if item is None else item)
+
+
+def pmap_fn(vm_state):
+    """
+    The "pmap" function.
+    Expects the top two items of the stack to be the name of a function, followed by a local stack. This function
+    replaces them with a local stack of what the function gives for each item, in order: the top item it leaves when
+    called with only that item on the global stack. The function must be pure, need at most one item, and leave at least
+    one. The calls are spread across worker processes, which can't be sent files, tasks, or channels.
+    :param vm_state: the VM state.
+    """
+    name = vm_state.pop()
+    stack = vm_state.pop()
+    _expect_type(vm_state, name, [ValType.STRING], 'pmap', 'a function name')
+    _expect_type(vm_state, stack, [ValType.STACK], 'pmap', 'a stack')
+    vm = vm_state.vm
+    pool = getattr(vm, 'pool', None)
+    if pool is None:
+        raise VMError("`pmap` can only be used in programs run by the VM", vm, *vm_state.current_loc())
+    if name.val not in vm.funs:
+        raise VMError(f"No such function: `{name.val}`", vm, *vm_state.current_loc())
+    fun = vm.funs[name.val]
+    if not fun.pure:
+        raise VMError(f"`{fun.name}` is not pure, so it can not be mapped", vm, *vm_state.current_loc())
+    if fun.effect.need > 1 or fun.effect.need + fun.effect.min_delta < 1:
+        raise VMError(f"`{fun.name}` has to take one item and leave at least one to be mapped; instead its effect is "
+                      f"{fun.effect}", vm, *vm_state.current_loc())
+    items = list(stack.val)
+    for item in items:
+        if item.type in UNSENDABLE_TYPES:
+            raise VMError(f"can not map over {item.type.value}s", vm, *vm_state.current_loc())
+    vm_state.push(Val(pool.map(fun, items), ValType.STACK))
 
 
 BUILTINS = {
@@ -251,11 +1083,132 @@ BUILTINS = {
     'pop': pop_fn,
     'push': push_fn,
     'len': len_fn,
+    'get': get_fn,
+    'set': set_fn,
+    'peek': peek_fn,
+    'slice': slice_fn,
+    'extend': extend_fn,
+    'concat': concat_fn,
+    'reverse': reverse_fn,
+    'sort': sort_fn,
+    # Map functions
+    'put': put_fn,
+    'has': has_fn,
+    'delete': delete_fn,
+    'keys': keys_fn,
+    # Array functions
+    'array': array_fn,
+    'unarray': unarray_fn,
+    'range': range_fn,
+    'sum': sum_fn,
+    'min': min_fn,
+    'max': max_fn,
+    # String functions
+    'builder': builder_fn,
+    'append': append_fn,
+    'finish': finish_fn,
+    'join': join_fn,
+    'chars': chars_fn,
+    'unchars': unchars_fn,
+    # Byte functions
+    'bytes': bytes_fn,
+    'decode': decode_fn,
+    'find': find_fn,
+    # Task functions
+    'spawn': spawn_fn,
+    'yield': yield_fn,
+    'checkpoint': checkpoint_fn,
+    'wait': wait_fn,
+    'channel': channel_fn,
+    'send': send_fn,
+    'recv': recv_fn,
+    'pmap': pmap_fn,
     # Global stack functions
     '$': stack_size_fn,
     '^': tos_fn,
     # IO functions
     'open': open_fn,
+    'close': close_fn,
+    'read': read_fn,
+    'readline': readline_fn,
+    'readall': readall_fn,
+    'write': write_fn,
+    'flush': flush_fn,
+    'stdin': stdin_fn,
+    'stdout': stdout_fn,
     'print': print_fn,
     'println': println_fn,
 }
+
+# The number of items each builtin needs on the global stack, and the number of items it leaves in their place. Builtins
+# that are missing from this table are treated as having an unknown effect by the stack analysis.
+BUILTIN_EFFECTS = {
+    '+': (2, 1),
+    '*': (2, 1),
+    '-': (2, 1),
+    'u-': (1, 1),
+    '/': (2, 1),
+    '==': (2, 1),
+    '!=': (2, 1),
+    '<=': (2, 1),
+    '>=': (2, 1),
+    '<': (2, 1),
+    '>': (2, 1),
+    'pop': (1, 2),
+    'push': (2, 1),
+    'len': (1, 2),
+    'get': (2, 2),
+    'set': (3, 1),
+    'peek': (1, 2),
+    'slice': (3, 2),
+    'extend': (2, 1),
+    'concat': (2, 1),
+    'reverse': (1, 1),
+    'sort': (1, 1),
+    'put': (3, 1),
+    'has': (2, 2),
+    'delete': (2, 1),
+    'keys': (1, 2),
+    'array': (1, 1),
+    'unarray': (1, 1),
+    'range': (2, 1),
+    'sum': (1, 1),
+    'min': (1, 1),
+    'max': (1, 1),
+    'builder': (0, 1),
+    'append': (2, 1),
+    'finish': (1, 1),
+    'join': (2, 1),
+    'chars': (1, 1),
+    'unchars': (1, 1),
+    'bytes': (1, 1),
+    'decode': (1, 1),
+    'find': (2, 2),
+    'spawn': (2, 1),
+    'yield': (0, 0),
+    'checkpoint': (0, 0),
+    'wait': (1, 1),
+    'channel': (1, 1),
+    'send': (2, 1),
+    'recv': (1, 2),
+    'pmap': (2, 1),
+    '$': (0, 1),
+    '^': (1, 2),
+    'open': (2, 1),
+    'close': (1, 0),
+    'read': (2, 2),
+    'readline': (1, 2),
+    'readall': (1, 2),
+    'write': (2, 1),
+    'flush': (1, 1),
+    'stdin': (0, 1),
+    'stdout': (0, 1),
+    'print': (1, 0),
+    'println': (1, 0),
+}
+
+# Builtins that do I/O, make or mutate mutable values, or look deeper into the global stack than the items they need.
+# Functions that call these are never memoized.
+IMPURE_BUILTINS = {'print', 'println', 'open', 'close', 'read', 'readline', 'readall', 'write', 'flush', 'stdin',
+                   'stdout', 'push', 'pop', 'set', 'extend', 'reverse', 'sort', 'put', 'delete', 'builder', 'append',
+                   'finish', 'spawn', 'yield', 'checkpoint', 'wait', 'channel', 'send', 'recv', '$'}
@@ -0,0 +1,133 @@
+# inline.py
+# Splices the bytecode of small functions into their callers.
+from copy import copy
+from sbl.common import *
+from sbl.vm.bc import *
+
+# The largest function body, in instructions (not counting the trailing RET), that will be inlined.
+INLINE_THRESHOLD = 8
+
+
+class Inliner:
+    def __init__(self, funs, builtins, threshold: int=INLINE_THRESHOLD):
+        """
+        :param funs: the function table to inline calls in. Functions are replaced, not mutated.
+        :param builtins: builtin functions, which take priority over user functions at run-time and are never inlined.
+        :param threshold: the largest function body that will be inlined.
+        """
+        self.funs = funs
+        self.builtins = builtins
+        self.threshold = threshold
+        self.sites = 0
+
+    def inline(self):
+        if self.threshold <= 0:
+            return self.funs
+        recursive = self._recursive_funs()
+        for name in self._post_order():
+            fun = self.funs[name]
+            bc = self._inline_calls(fun.bc, recursive)
+            if bc is not fun.bc:
+                self.funs[name] = type(fun)(fun.name, bc, fun.meta)
+        return self.funs
+
+    def _callees(self, name: str) -> List[str]:
+        return [bc.val.val for bc in self.funs[name].bc
+                if bc.code is BCType.CALL and bc.val.val in self.funs and bc.val.val not in self.builtins]
+
+    def _post_order(self) -> List[str]:
+        """
+        Orders the function table so that callees come before their callers, which lets a single pass inline chains of
+        small functions.
+        """
+        order = []
+        visited = set()
+
+        def visit(name):
+            visited.add(name)
+            for callee in self._callees(name):
+                if callee not in visited:
+                    visit(callee)
+            order.append(name)
+
+        for name in self.funs:
+            if name not in visited:
+                visit(name)
+        return order
+
+    def _recursive_funs(self) -> Set[str]:
+        recursive = set()
+        for name in self.funs:
+            seen = set()
+            todo = self._callees(name)
+            while todo:
+                callee = todo.pop()
+                if callee == name:
+                    recursive.add(name)
+                    break
+                if callee not in seen:
+                    seen.add(callee)
+                    todo += self._callees(callee)
+        return recursive
+
+    def _can_inline(self, name: str, recursive: Set[str]) -> bool:
+        if name not in self.funs or name in self.builtins or name in recursive:
+            return False
+        body = self.funs[name].bc[:-1]
+        if len(body) > self.threshold or any(bc.code is BCType.RET for bc in body):
+            return False
+        uses_locals = any(bc.code in [BCType.LOAD, BCType.POP] and bc.val.type is ValType.IDENT for bc in body)
+        if not uses_locals:
+            return True
+        # Locals are renamed when inlined, which is only safe when every load is preceded by a store in the callee;
+        # otherwise an inlined body run twice in the same frame could see a value left over from the first run.
+        if any(bc.code in [BCType.JMP, BCType.JMPZ] for bc in body):
+            return False
+        stored = set()
+        for bc in body:
+            if bc.code is BCType.POP and bc.val.type is ValType.IDENT:
+                stored.add(bc.val.val)
+            elif bc.code is BCType.LOAD and bc.val.val not in stored:
+                return False
+        return True
+
+    def _inline_calls(self, bc: List[BC], recursive: Set[str]) -> List[BC]:
+        def is_site(instr):
+            return instr.code is BCType.CALL and self._can_inline(instr.val.val, recursive)
+
+        if not any(is_site(instr) for instr in bc):
+            return bc
+        # map each old address to its new address, since inlined bodies shift everything after them
+        addrs = []
+        addr = 0
+        for instr in bc:
+            addrs += [addr]
+            addr += len(self.funs[instr.val.val].bc) - 1 if is_site(instr) else 1
+        new_bc = []
+        for instr in bc:
+            if is_site(instr):
+                new_bc += self._splice(self.funs[instr.val.val], len(new_bc))
+            elif instr.code in [BCType.JMP, BCType.JMPZ]:
+                new_bc += [BC(instr.code, instr.meta, Val(addrs[instr.val.val], ValType.INT))]
+            else:
+                new_bc += [instr]
+        return new_bc
+
+    def _splice(self, callee, base: int) -> List[BC]:
+        """
+        Copies the body of a function so it can be placed at the given address of its caller.
+        """
+        self.sites += 1
+        body = []
+        for instr in callee.bc[:-1]:
+            # keep the callee's source locations so runtime errors still point at the inlined code
+            meta = copy(instr.meta)
+            meta['inlined_from'] = callee.name
+            if instr.code in [BCType.JMP, BCType.JMPZ]:
+                val = Val(instr.val.val + base, ValType.INT)
+            elif instr.code in [BCType.LOAD, BCType.POP] and instr.val.type is ValType.IDENT:
+                val = Val(f"{callee.name}:{instr.val.val}:{self.sites}", ValType.IDENT)
+            else:
+                val = instr.val
+            body += [BC(instr.code, meta, val)]
+        return body
@@ -0,0 +1,321 @@
+# ir.py
+# A register-based intermediate representation of functions, used by the register VM tier.
+from sbl.vm.analysis import *
+from sbl.vm.funs import tos_fn
+
+# Builtins that look at the whole global stack, not just the items they need. Calls to these (or to functions that call
+# them) have to see every item the caller holds in registers.
+DEEP_BUILTINS = {'$'}
+
+
+class IROp(Enum):
+    # dst <- constant
+    CONST = 'CONST'
+    # dst <- src
+    MOV = 'MOV'
+    # dst <- src, where src is a local that may not have been stored yet
+    LOAD = 'LOAD'
+    # dst <- src1 op src2, for the specialized integer instructions
+    INT = 'INT'
+    # appends src2 to the local stack in src1, and puts the local stack in dst
+    PUSHL = 'PUSHL'
+    # puts src3 under the key src2 in the map in src1, and puts the map in dst
+    PUTL = 'PUTL'
+    # pushes the srcs onto the global stack, calls a function, and pops its results into consecutive registers from dst
+    CALL = 'CALL'
+    # dst <- src1 op src2 when both are integers; otherwise, a CALL to the builtin with one result
+    CALL_INT = 'CALL_INT'
+    # jumps to a block when src is false or Nil
+    JMPZ = 'JMPZ'
+    # jumps to a block
+    JMP = 'JMP'
+    # pushes the srcs onto the global stack and returns
+    RET = 'RET'
+
+
+# Instructions that can be removed when nothing reads what they write.
+PURE_OPS = {IROp.CONST, IROp.MOV, IROp.INT}
+
+
+class IRInstr:
+    """
+    A single IR instruction. Registers are numbered; the instruction that it was translated from is kept in `pc`, for
+    error locations.
+
+    `val` depends on the operation: the constant for CONST, the (operator, result type) pair for INT, the block to jump
+    to for JMPZ and JMP, the (function name, number of results) pair for CALL, and the (builtin name, operator, result
+    type) triple for CALL_INT.
+    """
+    def __init__(self, op: IROp, pc: int, dst: int=None, srcs: Tuple[int, ...]=(), val=None):
+        self.op = op
+        self.pc = pc
+        self.dst = dst
+        self.srcs = srcs
+        self.val = val
+
+    def defs(self) -> List[int]:
+        if self.op is IROp.CALL:
+            return list(range(self.dst, self.dst + self.val[1]))
+        return [] if self.dst is None else [self.dst]
+
+    def format(self, names: List[str]) -> str:
+        srcs = ', '.join(names[src] for src in self.srcs)
+        if self.op is IROp.CALL:
+            dsts = ', '.join(names[dst] for dst in self.defs())
+            return f"{dsts or '_'} = CALL {self.val[0]}({srcs})"
+        elif self.op is IROp.CONST:
+            return f"{names[self.dst]} = CONST {repr(self.val)}"
+        elif self.op is IROp.INT:
+            return f"{names[self.dst]} = INT {self.val[0].__name__}({srcs})"
+        elif self.op is IROp.CALL_INT:
+            return f"{names[self.dst]} = CALL_INT {self.val[0]}({srcs})"
+        elif self.op in [IROp.JMPZ, IROp.JMP]:
+            return f"{self.op.value} {srcs + ', ' if srcs else ''}B{self.val}"
+        elif self.op is IROp.RET:
+            return f"RET {srcs}"
+        return f"{names[self.dst]} = {self.op.value} {srcs}"
+
+
+class IRBlock:
+    def __init__(self, start: int, reachable: bool):
+        # the first instruction of the block in the original bytecode
+        self.start = start
+        self.reachable = reachable
+        self.instrs = []
+        self.succs = []
+
+
+class IRFun:
+    """
+    A function in register form. The first `need` registers hold the items the function takes off the global stack when
+    it is called, bottom first. Blocks fall through to the next block unless they end with a JMP or RET.
+    """
+    def __init__(self, name: str, need: int, names: List[str], blocks: List[IRBlock]):
+        self.name = name
+        self.need = need
+        self.names = names
+        self.blocks = blocks
+
+    def instr_count(self) -> int:
+        return sum(len(block.instrs) for block in self.blocks)
+
+    def __str__(self):
+        lines = [f"{self.name}: need {self.need}"]
+        for idx, block in enumerate(self.blocks):
+            lines += [f"B{idx}:"]
+            lines += [f"{' ' * 4}{instr.format(self.names)}" for instr in block.instrs]
+        return '\n'.join(lines)
+
+
+class IRBuilder:
+    """
+    Translates functions from stack bytecode into the register IR. Only functions with a fixed stack effect, whose stack
+    depth is known exactly at every instruction, can be translated; every stack slot then gets its own register, and so
+    does every local.
+    """
+    def __init__(self, funs, builtins, builtin_effects=BUILTIN_EFFECTS):
+        self.funs = funs
+        self.builtins = builtins
+        self.builtin_effects = builtin_effects
+        # the functions have already been analyzed, so reuse their effects instead of solving them again
+        self.analysis = StackAnalysis(funs, builtins, builtin_effects)
+        self.analysis.effects = {name: fun.effect for name, fun in funs.items()}
+        self.deep = self._deep_funs()
+
+    def build(self, fun) -> Optional[IRFun]:
+        """
+        Translates a function, or gets None if it can't be translated.
+        """
+        effect = fun.effect
+        if effect is None or not effect.is_fixed():
+            return None
+        depths = self.analysis.depths(fun)
+        if any(depth is not None and depth[0] != depth[1] for depth in depths):
+            return None
+        # calls to functions that never return leave the rest of the function unreachable, but don't have an effect
+        if any(depth is not None and self.analysis.instr_effect(instr) is None for instr, depth in zip(fun.bc, depths)):
+            return None
+        need = effect.need
+        slots = need + max([depth[0] for depth in depths if depth is not None] + [0])
+        local_names = []
+        for instr in fun.bc:
+            if instr.code in [BCType.POP, BCType.LOAD] and instr.val.type is ValType.IDENT \
+                    and instr.val.val not in local_names:
+                local_names += [instr.val.val]
+        names = [f"s{slot}" for slot in range(slots)] + [f"`{name}`" for name in local_names]
+        local_regs = {name: slots + idx for idx, name in enumerate(local_names)}
+
+        bbs = basic_blocks(fun.bc)
+        block_of = {bb.start: idx for idx, bb in enumerate(bbs)}
+        blocks = []
+        for bb in bbs:
+            block = IRBlock(bb.start, depths[bb.start] is not None)
+            blocks += [block]
+            if not block.reachable:
+                continue
+            for pc in range(bb.start, bb.end):
+                depth = need + depths[pc][0]
+                block.instrs += self._translate(fun.bc[pc], pc, depth, local_regs, block_of)
+        for idx, block in enumerate(blocks):
+            last = block.instrs[-1] if block.instrs else None
+            if last is not None and last.op is IROp.RET:
+                continue
+            elif last is not None and last.op is IROp.JMP:
+                block.succs = [last.val]
+            else:
+                block.succs = ([idx + 1] if idx + 1 < len(blocks) else [])
+                if last is not None and last.op is IROp.JMPZ:
+                    block.succs += [last.val]
+        return IRFun(fun.name, need, names, blocks)
+
+    def _translate(self, instr: BC, pc: int, depth: int, local_regs: Mapping[str, int],
+                   block_of: Mapping[int, int]) -> List[IRInstr]:
+        code = instr.code
+        if code is BCType.PUSH:
+            return [IRInstr(IROp.CONST, pc, depth, val=instr.val)]
+        elif code is BCType.LOAD:
+            return [IRInstr(IROp.LOAD, pc, depth, (local_regs[instr.val.val],))]
+        elif code is BCType.POP:
+            if instr.val.type is ValType.NIL:
+                return []
+            return [IRInstr(IROp.MOV, pc, local_regs[instr.val.val], (depth - 1,))]
+        elif code is BCType.POPN:
+            return []
+        elif code is BCType.PUSHL:
+            return [IRInstr(IROp.PUSHL, pc, depth - 2, (depth - 2, depth - 1))]
+        elif code is BCType.PUTL:
+            return [IRInstr(IROp.PUTL, pc, depth - 3, (depth - 3, depth - 2, depth - 1))]
+        elif code in INT_BINOPS:
+            return [IRInstr(IROp.INT, pc, depth - 2, (depth - 2, depth - 1), INT_BINOPS[code])]
+        elif code is BCType.JMPZ:
+            return [IRInstr(IROp.JMPZ, pc, srcs=(depth - 1,), val=block_of[instr.val.val])]
+        elif code is BCType.JMP:
+            return [IRInstr(IROp.JMP, pc, val=block_of[instr.val.val])]
+        elif code is BCType.RET:
+            return [IRInstr(IROp.RET, pc, srcs=tuple(range(depth)))]
+        assert code is BCType.CALL, f"can't translate {code} to IR"
+        name = instr.val.val
+        if self.builtins.get(name) is tos_fn:
+            # duplicating the top item is just a copy between registers
+            return [IRInstr(IROp.MOV, pc, depth, (depth - 1,))]
+        if name in INT_OPS and name in self.builtins:
+            return [IRInstr(IROp.CALL_INT, pc, depth - 2, (depth - 2, depth - 1), (name,) + INT_BINOPS[INT_OPS[name]])]
+        need, delta, _ = self.analysis.instr_effect(instr)
+        if name in self.deep:
+            need = depth
+        return [IRInstr(IROp.CALL, pc, depth - need, tuple(range(depth - need, depth)), (name, need + delta))]
+
+    def _deep_funs(self) -> Set[str]:
+        deep = set(DEEP_BUILTINS)
+        changed = True
+        while changed:
+            changed = False
+            for name, fun in self.funs.items():
+                if name not in deep and any(bc.code is BCType.CALL and bc.val.val in deep for bc in fun.bc):
+                    deep.add(name)
+                    changed = True
+        return deep
+
+
+def optimize(ir: IRFun) -> IRFun:
+    """
+    Runs the IR passes over a function, in place.
+    """
+    assigned_loads(ir)
+    for block in ir.blocks:
+        propagate_copies(block)
+    while eliminate_dead_stores(ir):
+        pass
+    return ir
+
+
+def _preds(ir: IRFun) -> List[List[int]]:
+    preds = [[] for _ in ir.blocks]
+    for idx, block in enumerate(ir.blocks):
+        for succ in block.succs:
+            preds[succ] += [idx]
+    return preds
+
+
+def assigned_loads(ir: IRFun):
+    """
+    Turns loads of locals that are always stored beforehand into plain moves, which can't fail.
+    """
+    preds = _preds(ir)
+    everything = set(range(len(ir.names)))
+    # the registers that are definitely written on entry to each block; the entry block is also entered by the call
+    assigned = [everything] * len(ir.blocks)
+    changed = True
+    while changed:
+        changed = False
+        for idx, block in enumerate(ir.blocks):
+            outs = [_written(ir.blocks[pred], assigned[pred]) for pred in preds[idx]]
+            if idx == 0:
+                outs += [set(range(ir.need))]
+            into = set.intersection(*outs) if outs else everything
+            if into != assigned[idx]:
+                assigned[idx] = into
+                changed = True
+    for idx, block in enumerate(ir.blocks):
+        written = set(assigned[idx])
+        for instr in block.instrs:
+            if instr.op is IROp.LOAD and instr.srcs[0] in written:
+                instr.op = IROp.MOV
+            written |= set(instr.defs())
+
+
+def _written(block: IRBlock, into: Set[int]) -> Set[int]:
+    written = set(into)
+    for instr in block.instrs:
+        written |= set(instr.defs())
+    return written
+
+
+def propagate_copies(block: IRBlock):
+    """
+    Within a block, reads of a register that was copied from another are rewritten to read the original instead. Loads
+    count as copies once they have run, since they either copy the local or fail.
+    """
+    copies = {}
+    kept = []
+    for instr in block.instrs:
+        instr.srcs = tuple(copies.get(src, src) for src in instr.srcs)
+        if instr.op is IROp.MOV and instr.srcs[0] == instr.dst:
+            continue
+        kept += [instr]
+        for dst in instr.defs():
+            copies = {reg: src for reg, src in copies.items() if dst not in (reg, src)}
+        if instr.op in [IROp.MOV, IROp.LOAD] and instr.srcs[0] != instr.dst:
+            copies[instr.dst] = instr.srcs[0]
+    block.instrs = kept
+
+
+def eliminate_dead_stores(ir: IRFun) -> bool:
+    """
+    Removes pure instructions whose results are never read, including stores to locals that are never loaded again.
+    :return: whether anything was removed.
+    """
+    live_in = [set() for _ in ir.blocks]
+    changed = True
+    while changed:
+        changed = False
+        for idx in reversed(range(len(ir.blocks))):
+            block = ir.blocks[idx]
+            live = set().union(*[live_in[succ] for succ in block.succs])
+            for instr in reversed(block.instrs):
+                live = (live - set(instr.defs())) | set(instr.srcs)
+            if live != live_in[idx]:
+                live_in[idx] = live
+                changed = True
+    removed = False
+    for block in ir.blocks:
+        live = set().union(*[live_in[succ] for succ in block.succs])
+        kept = []
+        for instr in reversed(block.instrs):
+            if instr.op in PURE_OPS and instr.dst not in live:
+                removed = True
+                continue
+            live = (live - set(instr.defs())) | set(instr.srcs)
+            kept += [instr]
+        block.instrs = kept[::-1]
+    return removed
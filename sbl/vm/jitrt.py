@@ -0,0 +1,156 @@
+# jitrt.py
+# Run-time support for SBL functions that have been translated to Python.
+#
+# Generated code only depends on this module, so it must not import the tokenizer, parser, or compiler.
+import sys
+from sbl.common import *
+from sbl.vm.val import Val, ValType, KEY_TYPES
+from sbl.vm.pvec import PVec
+from sbl.vm.files import FileTable
+from sbl.vm.funs import BUILTINS
+
+INT = ValType.INT
+BOOL = ValType.BOOL
+NIL = ValType.NIL
+STACK = ValType.STACK
+MAP = ValType.MAP
+
+
+class State:
+    """
+    The VM state used by modules compiled ahead of time; this is the part of the interpreter's VMState that builtins
+    and translated functions use.
+    """
+    def __init__(self, vm):
+        self.stack = []
+        self.call_stack = []
+        self.vm = vm
+        self.files = FileTable()
+
+    def push(self, val: Val):
+        self.stack += [val]
+
+    def pop(self) -> Val:
+        try:
+            return self.stack.pop()
+        except IndexError:
+            raise VMError(f"attempted to pop an empty stack", self.vm, *self.current_loc())
+
+    def current_loc(self) -> (str, Range):
+        frame = self.call_stack[-1]
+        return frame.fun.bc[frame.pc].meta['file'], frame.fun.bc[frame.pc].meta['where']
+
+
+class Instr:
+    """
+    What a compiled module keeps of an instruction: how it looked, and where it came from.
+    """
+    def __init__(self, text: str, meta: Mapping[str, Any]):
+        self.text = text
+        self.meta = meta
+
+    def __str__(self):
+        return self.text
+
+
+class FunInfo:
+    """
+    What a compiled module keeps of a function, for error messages and state dumps.
+    """
+    def __init__(self, name: str, meta: Mapping[str, Any], bc: List[Instr]):
+        self.name = name
+        self.meta = meta
+        self.bc = bc
+
+
+class Runtime:
+    """
+    Stands in for the VM in modules compiled ahead of time.
+    """
+    def __init__(self, funs: Mapping[str, FunInfo]):
+        self.funs = funs
+        self.state = State(self)
+
+    def dump_funtable(self):
+        for fun in self.funs:
+            printerr(f"{fun}:")
+            for addr, instr in enumerate(self.funs[fun].bc):
+                printerr("{:05}".format(addr), instr)
+
+    def dump_state(self):
+        printerr("call stack:")
+        for f in self.state.call_stack:
+            printerr(f"{' ' * 4}{f.name} (defined at {f.fun.meta['file']}:{f.fun.meta['where']}) "
+                     f"called from {f.callsite}")
+        fun = self.state.call_stack[-1]
+        printerr("last function:", fun.name)
+        printerr(f"{' '*4}PC:               {fun.pc}")
+        printerr(f"{' '*4}Last instruction: {fun.fun.bc[fun.pc]}")
+        printerr("stack:")
+        for s in reversed(self.state.stack):
+            printerr(f"{' '*4}{repr(s)}")
+
+
+def main(run: Callable[[Runtime], None], funs: Mapping[str, FunInfo], source_name: str, argv: List[str]=None) -> int:
+    """
+    The entry point of a compiled module, reporting errors the same way `sbl` does.
+    :param run: runs the program on a runtime.
+    :param funs: the program's functions.
+    :param source_name: the file the program was compiled from.
+    :param argv: command line arguments; `-v` (or `-vv`) shows detailed information on errors.
+    :return: the exit status.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    verbose = sum(arg.count('v') for arg in argv if arg.startswith('-') and set(arg[1:]) == {'v'})
+    runtime = Runtime(funs)
+    try:
+        run(runtime)
+    except KeyboardInterrupt:
+        printerr()
+        printerr("VM interrupted; shutting down.")
+        if verbose:
+            if verbose >= 2:
+                runtime.dump_funtable()
+            runtime.dump_state()
+    except ChainedError as e:
+        printerr(f"Error caused in {source_name}:")
+        e.printerr(verbose=verbose)
+        return 1
+    except VMError as e:
+        e.printerr(verbose=verbose)
+        return 1
+    except RecursionError as e:
+        printerr("Internal stack overflow - exiting with error.")
+        if verbose:
+            printerr(f"{' '*4}{e}")
+        return 1
+    return 0
+
+
+class Frame:
+    """
+    The call stack entry of a translated function. This has the same shape as the interpreter's FunState, so errors and
+    state dumps work the same way; locals live in Python variables instead, so they aren't shown.
+    """
+    def __init__(self, fun, callsite):
+        self.name = fun.name
+        self.fun = fun
+        self.locals = {}
+        self.pc = 0
+        self.callsite = callsite
+
+
+def translate_error(error: Exception, state, frame: Frame, code, lines: Mapping[int, Tuple[int, str]]) -> Exception:
+    """
+    Turns a Python error raised directly by a translated function into the VMError the interpreter would have raised,
+    using the line it was raised on (relative to the start of the function) to find the instruction. Errors raised
+    anywhere else are returned untouched.
+    """
+    tb = error.__traceback__
+    while tb.tb_next is not None:
+        tb = tb.tb_next
+    offset = tb.tb_lineno - code.co_firstlineno
+    if tb.tb_frame.f_code is not code or offset not in lines:
+        return error
+    frame.pc, message = lines[offset]
+    return VMError(message, state.vm, *state.current_loc())
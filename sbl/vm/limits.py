@@ -0,0 +1,108 @@
+# limits.py
+# Limits on how long a program may run, and how much of the stacks it may use, for running programs that can't be
+# trusted to stop on their own.
+#
+# Checking limits on every instruction would slow every program down, so they are only checked where a program can go
+# on for a while: when a function is called, and when a loop goes around. Each check charges the instructions the
+# program could have run since the last one (the whole body of a function that was called, or of a loop that went
+# around), so the instruction count is an upper bound, and a loop is always stopped within one trip of a limit.
+import time
+
+from sbl.common import *
+
+# How many instructions are charged between looking at the clock, when there's a time limit.
+CLOCK_INTERVAL = 10000
+
+
+class Limits:
+    """
+    The limits for running a program. A limit of 0 means there is none.
+    """
+    def __init__(self, instructions: int=0, stack: int=0, depth: int=0, time: float=0):
+        """
+        :param instructions: how many instructions the program may run.
+        :param stack: how many items the global stack may hold.
+        :param depth: how many function calls deep the program may go.
+        :param time: how many seconds the program may run for.
+        """
+        self.instructions = instructions
+        self.stack = stack
+        self.depth = depth
+        self.time = time
+
+    def __bool__(self):
+        return bool(self.instructions or self.stack or self.depth or self.time)
+
+    def __repr__(self):
+        return f"Limits(instructions={self.instructions}, stack={self.stack}, depth={self.depth}, time={self.time})"
+
+
+class Meter:
+    """
+    Keeps track of a run of a program against its limits, and saves checkpoints of it when they are due.
+    """
+    def __init__(self, vm, limits: Limits, checkpointer=None):
+        """
+        :param checkpointer: the Checkpointer saving checkpoints of the run, if any.
+        """
+        self.vm = vm
+        self.limits = limits
+        self.checkpointer = checkpointer
+        self.count = 0
+        self.max_stack = limits.stack or sys.maxsize
+        self.max_depth = limits.depth or sys.maxsize
+        self.deadline = time.perf_counter() + limits.time if limits.time else None
+        self.next_check = 0
+        self._schedule()
+
+    def enter(self, state, size: int):
+        """
+        Charges for a call to a function, once it is on the call stack.
+        :param size: how many instructions the function has.
+        :raise VMError: if the call breaks a limit.
+        """
+        self.count += size
+        if self.count >= self.next_check or len(state.call_stack) > self.max_depth or \
+                len(state.stack) > self.max_stack:
+            self.check(state)
+
+    def tick(self, state, count: int):
+        """
+        Charges for running some instructions.
+        :raise VMError: if a limit has been broken.
+        """
+        self.count += count
+        if self.count >= self.next_check or len(state.stack) > self.max_stack:
+            self.check(state)
+
+    def check(self, state):
+        """
+        Checks every limit. Translated code charges instructions itself, and only calls this once `count` reaches
+        `next_check`, or a stack grows past its limit.
+        :raise VMError: if a limit has been broken.
+        """
+        limits = self.limits
+        if len(state.call_stack) > self.max_depth:
+            raise VMError(f"call depth limit of {limits.depth} exceeded", self.vm, *state.current_loc())
+        if len(state.stack) > self.max_stack:
+            raise VMError(f"global stack limit of {limits.stack} items exceeded", self.vm, *state.current_loc())
+        if limits.instructions and self.count > limits.instructions:
+            raise VMError(f"instruction limit of {limits.instructions} exceeded", self.vm, *state.current_loc())
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise VMError(f"time limit of {limits.time}s exceeded", self.vm, *state.current_loc())
+        checkpointer = self.checkpointer
+        if checkpointer is not None and checkpointer.due(self.count):
+            try:
+                checkpointer.save(state)
+            except VMError as e:
+                # checkpoints the program didn't ask for are skipped, rather than ending the run
+                printerr(f"warning: {e}")
+        self._schedule()
+
+    def _schedule(self):
+        self.next_check = self.count + CLOCK_INTERVAL if self.deadline is not None else sys.maxsize
+        if self.limits.instructions:
+            self.next_check = min(self.next_check, self.limits.instructions + 1)
+        checkpointer = self.checkpointer
+        if checkpointer is not None:
+            self.next_check = min(self.next_check, 0 if checkpointer.requested else checkpointer.next_at)
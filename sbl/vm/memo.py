@@ -0,0 +1,61 @@
+# memo.py
+# Memoization of pure functions.
+from collections import OrderedDict
+from sbl.common import *
+
+# The default number of results kept by a memo cache.
+MEMO_SIZE = 4096
+
+
+class MemoCache:
+    """
+    A bounded, least-recently-used cache of the results of pure functions, keyed on the function and the items it needs
+    from the stack.
+    """
+    def __init__(self, vm, size: int=MEMO_SIZE):
+        self.vm = vm
+        self.size = size
+        self.entries = OrderedDict()
+        # per-function counters
+        self.hits = {}
+        self.misses = {}
+        self.uncacheable = {}
+
+    def call(self, fun, callsite):
+        """
+        Calls a pure function, reusing its earlier results for the same inputs.
+        """
+        stack = self.vm.state.stack
+        need = fun.effect.need
+        if len(stack) < need:
+            # let the VM report the underflow
+            self.vm._run_fun(fun, callsite)
+            return
+        depth = len(stack) - need
+        key = (fun.name,) + tuple((item.type, item.val) for item in stack[depth:])
+        try:
+            outputs = self.entries.get(key)
+        except TypeError:
+            # local stacks can't be keys
+            self.uncacheable[fun.name] = self.uncacheable.get(fun.name, 0) + 1
+            self.vm._run_fun(fun, callsite)
+            return
+        if outputs is not None:
+            self.entries.move_to_end(key)
+            self.hits[fun.name] = self.hits.get(fun.name, 0) + 1
+            del stack[depth:]
+            stack.extend(item.share() if item.frozen else item for item in outputs)
+            return
+        self.misses[fun.name] = self.misses.get(fun.name, 0) + 1
+        self.vm._run_fun(fun, callsite)
+        # kept frozen, like constants, so that callers changing a stack or map they got back change a copy of it; the
+        # caller thaws its own value rather than the cache's
+        self.entries[key] = tuple(item.share() if item.freeze().frozen else item for item in stack[depth:])
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def dump(self):
+        printerr(f"memo cache ({len(self.entries)}/{self.size} entries):")
+        for name in sorted(set(self.hits) | set(self.misses) | set(self.uncacheable)):
+            printerr(f"{' ' * 4}{name}: hits={self.hits.get(name, 0)} misses={self.misses.get(name, 0)} "
+                     f"uncacheable={self.uncacheable.get(name, 0)}")
@@ -0,0 +1,141 @@
+# pmap.py
+# Applying pure functions to every item of a local stack, in a pool of worker processes.
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from sbl.common import *
+from sbl.vm.val import Val, ValType
+
+# When no chunk size is given, stacks are split into about this many chunks per worker, so that workers that finish
+# early can pick up more work.
+CHUNKS_PER_WORKER = 4
+
+# Values that only make sense in the process that made them.
+UNSENDABLE_TYPES = {ValType.FILE, ValType.TASK, ValType.CHANNEL}
+
+CALLSITE = '<pmap>'
+
+
+def apply(vm, fun, item: Val) -> Val:
+    """
+    Calls a function on a global stack holding only an item.
+    :return: the top item the function left on the stack.
+    """
+    state = vm.state
+    stack = state.stack
+    state.stack = [item]
+    try:
+        vm._call_fun(fun, CALLSITE)
+        return state.stack[-1]
+    finally:
+        state.stack = stack
+
+
+class Pool:
+    """
+    The worker processes a VM maps functions with. Each worker has a VM of its own, of the same class as this one, with
+    its own copy of the program; workers are started the first time they're needed, and shut down with `shutdown`.
+    """
+    def __init__(self, vm, workers: int=0, chunk_size: int=0):
+        """
+        :param workers: how many worker processes to use; 0 uses one per CPU. With 1, functions are mapped in this
+        process.
+        :param chunk_size: how many items to send to a worker at a time; 0 picks a size from the length of the stack.
+        """
+        self.vm = vm
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.executor = None
+
+    def map(self, fun, items: List[Val]) -> List[Val]:
+        """
+        Applies a pure function to items, which must not be files, tasks, or channels.
+        :return: the results, in the same order as the items.
+        :raise VMError: if the function fails on any of the items.
+        """
+        if self.workers == 1 or not items:
+            return self._check(fun, _apply_all(self.vm, fun, 0, items))
+        if self.executor is None:
+            # the standard builtins hold objects that can't be pickled, so workers find them for themselves
+            builtins = None if self.vm.builtins is funs.BUILTINS else self.vm.builtins
+            self.executor = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                                initargs=(type(self.vm), self.vm.funs, builtins))
+        size = self.chunk_size or -(-len(items) // (self.workers * CHUNKS_PER_WORKER))
+        futures = [self.executor.submit(_apply_chunk, fun.name, start, items[start:start + size])
+                   for start in range(0, len(items), size)]
+        results = []
+        try:
+            for future in futures:
+                results += self._check(fun, future.result())
+        except BrokenProcessPool:
+            self.executor = None
+            raise VMError("a pmap worker process died", self.vm, *self.vm.state.current_loc())
+        finally:
+            for future in futures:
+                future.cancel()
+        return results
+
+    def _check(self, fun, results: Union[List[Val], 'WorkerError']) -> List[Val]:
+        if isinstance(results, WorkerError):
+            raise VMError(f"`{fun.name}` failed on item {results.index}: {results.message}", self.vm,
+                          results.source_file, results.source_range)
+        return results
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+
+class WorkerError:
+    """
+    An error from a worker, without the worker's VM, so that it can be sent back.
+    """
+    def __init__(self, index: int, message: str, source_file: str, source_range: Range):
+        self.index = index
+        self.message = message
+        self.source_file = source_file
+        self.source_range = source_range
+
+
+# the VM of a worker process
+_worker = None
+
+
+def _init_worker(vm_class, fun_table, builtins):
+    global _worker
+    _worker = vm_class(fun_table, funs.BUILTINS if builtins is None else builtins)
+    # functions mapped inside of a worker are mapped in the worker
+    _worker.pool = Pool(_worker, workers=1)
+
+
+def _apply_chunk(name: str, start: int, items: List[Val]) -> Union[List[Val], WorkerError]:
+    return _apply_all(_worker, _worker.funs[name], start, items)
+
+
+def _apply_all(vm, fun, start: int, items: List[Val]) -> Union[List[Val], WorkerError]:
+    """
+    Applies a function to items, stopping at the first error.
+    :param start: the index of the first item in the whole stack.
+    :return: the results, or the error.
+    """
+    call_stack = vm.state.call_stack
+    depth = len(call_stack)
+    results = []
+    for index, item in enumerate(items, start):
+        try:
+            results += [apply(vm, fun, item)]
+        except PrintErr as e:
+            # the innermost error says what went wrong, and where
+            while isinstance(e, ChainedError):
+                e = e.err
+            if not isinstance(e, VMError):
+                raise
+            return WorkerError(index, str(e), e.source_file, e.source_range)
+        finally:
+            del call_stack[depth:]
+    return results
+
+
+from sbl.vm import funs
@@ -0,0 +1,221 @@
+# profiler.py
+# Finding out where an SBL program spends its time, by SBL function and source line.
+#
+# There are two ways to profile a program. ProfilingVM times every call to every SBL function, which gives exact call
+# counts and times at the cost of slowing every call down. Sampler leaves the VM alone, and looks at its call stack from
+# another thread every so often, which costs little and shows which lines are hot, but only gives estimates. The plain
+# VM knows nothing about either, so programs that aren't profiled don't pay for them.
+#
+# Both write a text report, and the stacks they saw in the collapsed format that flame graph tools read: one line per
+# stack, with its frames from the outermost in, separated by semicolons, and then how much time was spent in it.
+import threading
+import time
+
+from sbl.vm.vm import *
+
+# How often the sampler looks at the call stack, in seconds. Python only switches threads every so often (see
+# `sys.setswitchinterval`), so samples of a busy program are at least that far apart.
+SAMPLE_INTERVAL = 0.001
+
+
+def _where(meta: Mapping[str, Any]) -> str:
+    return f"{meta.get('file', 'unknown')}:{meta['where']}"
+
+
+class CallNode:
+    """
+    A function in the tree of calls a program made, with the time spent in it, not counting the functions it called.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.time = 0
+        self.children = {}
+
+    def child(self, name: str) -> 'CallNode':
+        node = self.children.get(name)
+        if node is None:
+            node = self.children[name] = CallNode(name)
+        return node
+
+    def collapsed(self) -> Iterator[Tuple[str, int]]:
+        """
+        :return: the stacks under this node, starting with it, and the time spent in each of them.
+        """
+        # deeply recursive programs make deep trees, so this doesn't recurse itself
+        todo = [(self.name, self)]
+        while todo:
+            path, node = todo.pop()
+            if node.time:
+                yield path, node.time
+            todo += [(f"{path};{child.name}", child) for child in reversed(node.children.values())]
+
+
+class FunStats:
+    def __init__(self):
+        self.calls = 0
+        # in nanoseconds; total time counts recursive calls once, and self time leaves out the functions called
+        self.total = 0
+        self.own = 0
+
+
+class ProfilingVM(VM):
+    """
+    A VM that times every call to an SBL function. Times are wall-clock times, so a task's calls include any time the
+    task spent waiting for its turn.
+    """
+    def __init__(self, funs: FunTable, builtins=BUILTINS, **options):
+        """
+        :param options: the options VM takes.
+        """
+        super().__init__(funs, builtins, **options)
+        self.stats = {}
+        self.root = CallNode('')
+        # each task runs on a thread of its own, with its own calls
+        self._calls = threading.local()
+
+    def _call_fun(self, fun: Fun, callsite):
+        calls = self._calls
+        if not hasattr(calls, 'frames'):
+            calls.frames = []
+            calls.active = {}
+        frames = calls.frames
+        active = calls.active
+        name = fun.name
+        node = (frames[-1][0] if frames else self.root).child(name)
+        active[name] = active.get(name, 0) + 1
+        # the node, when the call started, and how long the functions it called took
+        frame = [node, time.perf_counter_ns(), 0]
+        frames.append(frame)
+        try:
+            super()._call_fun(fun, callsite)
+        finally:
+            elapsed = time.perf_counter_ns() - frame[1]
+            frames.pop()
+            active[name] -= 1
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = FunStats()
+            stats.calls += 1
+            stats.own += elapsed - frame[2]
+            # only the outermost of a function's recursive calls counts towards its total
+            if not active[name]:
+                stats.total += elapsed
+            node.time += elapsed - frame[2]
+            if frames:
+                frames[-1][2] += elapsed
+
+    def collapsed(self) -> Iterator[Tuple[str, int]]:
+        """
+        :return: each stack of calls, and the time spent in it, in microseconds.
+        """
+        for node in self.root.children.values():
+            for path, elapsed in node.collapsed():
+                yield path, elapsed // 1000
+
+    def report(self, fp: TextIO, top: int=0):
+        """
+        Writes the functions that were called, slowest first.
+        :param top: how many functions to write; 0 writes all of them.
+        """
+        overall = sum(stats.own for stats in self.stats.values()) or 1
+        fp.write(f"{'calls':>10} {'total ms':>10} {'self ms':>10} {'self %':>7}  function\n")
+        ranked = sorted(self.stats.items(), key=lambda item: item[1].own, reverse=True)
+        for name, stats in ranked[:top or None]:
+            fp.write(f"{stats.calls:10} {stats.total / 1e6:10.2f} {stats.own / 1e6:10.2f} "
+                     f"{100 * stats.own / overall:6.1f}%  {name} ({_where(self.funs[name].meta)})\n")
+
+
+class Sampler:
+    """
+    Samples the call stack of a VM running in another thread.
+    """
+    def __init__(self, vm: VM, interval: float=SAMPLE_INTERVAL):
+        """
+        :param interval: how long to wait between samples, in seconds.
+        """
+        self.vm = vm
+        self.interval = interval
+        self.samples = 0
+        # how many times each stack of (function, line) frames was seen, outermost first
+        self.stacks = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self) -> 'Sampler':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """
+        Records what the VM is running right now.
+        """
+        frames = []
+        # the VM changes the call stack as this runs, so it works from a copy, and skips frames that have moved on
+        for fun_state in list(self.vm.state.call_stack):
+            try:
+                meta = fun_state.fun.bc[fun_state.pc].meta
+            except IndexError:
+                continue
+            frames.append((fun_state.name, f"{meta.get('file', 'unknown')}:{meta['where'].start.line + 1}"))
+        if frames:
+            stack = tuple(frames)
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def collapsed(self) -> Iterator[Tuple[str, int]]:
+        """
+        :return: each stack of calls that was seen, with the line each function was at, and how many times it was seen.
+        """
+        for stack, count in self.stacks.items():
+            yield ';'.join(f"{name} ({line})" for name, line in stack), count
+
+    def report(self, fp: TextIO, top: int=0):
+        """
+        Writes the functions and lines that were seen the most.
+        :param top: how many functions, and lines, to write; 0 writes all of them.
+        """
+        own = {}
+        total = {}
+        lines = {}
+        for stack, count in self.stacks.items():
+            innermost, line = stack[-1]
+            own[innermost] = own.get(innermost, 0) + count
+            lines[line, innermost] = lines.get((line, innermost), 0) + count
+            # recursive functions count once per sample
+            for name in {name for name, _ in stack}:
+                total[name] = total.get(name, 0) + count
+        samples = self.samples or 1
+        fp.write(f"{self.samples} samples\n")
+        fp.write(f"{'self':>10} {'self %':>7} {'total':>10} {'total %':>7}  function\n")
+        for name in sorted(total, key=lambda name: (own.get(name, 0), total[name]), reverse=True)[:top or None]:
+            fp.write(f"{own.get(name, 0):10} {100 * own.get(name, 0) / samples:6.1f}% {total[name]:10} "
+                     f"{100 * total[name] / samples:6.1f}%  {name} ({_where(self.vm.funs[name].meta)})\n")
+        fp.write(f"{'self':>10} {'self %':>7}  line\n")
+        for (line, name), count in sorted(lines.items(), key=lambda item: item[1], reverse=True)[:top or None]:
+            fp.write(f"{count:10} {100 * count / samples:6.1f}%  {line} in {name}\n")
+
+
+def write_collapsed(path: str, stacks: Iterable[Tuple[str, int]]):
+    """
+    Writes stacks in the collapsed format, for flame graph tools.
+    :raise OSError: if the file can't be written.
+    """
+    with open(path, 'w') as fp:
+        for stack, weight in stacks:
+            if weight:
+                fp.write(f"{stack} {weight}\n")
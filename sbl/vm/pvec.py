@@ -0,0 +1,187 @@
+# pvec.py
+# A persistent vector, used for local stacks that are never changed in place.
+from sbl.common import *
+
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+
+
+class PVec:
+    """
+    An immutable vector that shares structure between versions. Items live in a trie of WIDTH-wide nodes, with the last
+    (up to) WIDTH items kept in a separate tail so that pushing and popping at the end rarely touches the trie.
+
+    Indexing, `append`, `pop`, and `set` take O(log n) time, and making a new version never changes an old one, so a
+    vector can be shared by any number of values without being copied.
+    """
+    __slots__ = ('count', 'shift', 'root', 'tail')
+
+    def __init__(self, items: Iterable=()):
+        items = list(items)
+        self.count = len(items)
+        tail_start = self._tail_start()
+        self.tail = tuple(items[tail_start:])
+        nodes = [tuple(items[i:i + WIDTH]) for i in range(0, tail_start, WIDTH)]
+        self.shift = BITS
+        while len(nodes) > WIDTH:
+            nodes = [tuple(nodes[i:i + WIDTH]) for i in range(0, len(nodes), WIDTH)]
+            self.shift += BITS
+        self.root = tuple(nodes)
+
+    @staticmethod
+    def _make(count: int, shift: int, root: tuple, tail: tuple) -> 'PVec':
+        vec = PVec.__new__(PVec)
+        vec.count = count
+        vec.shift = shift
+        vec.root = root
+        vec.tail = tail
+        return vec
+
+    def _tail_start(self) -> int:
+        return 0 if self.count < WIDTH else ((self.count - 1) >> BITS) << BITS
+
+    def _leaf(self, index: int) -> tuple:
+        if index >= self._tail_start():
+            return self.tail
+        node = self.root
+        for level in range(self.shift, 0, -BITS):
+            node = node[(index >> level) & MASK]
+        return node
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PVec(self[i] for i in range(*index.indices(self.count)))
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('PVec index out of range')
+        return self._leaf(index)[index & MASK]
+
+    def __iter__(self):
+        yield from self._iter_node(self.root, self.shift)
+        yield from self.tail
+
+    def _iter_node(self, node: tuple, level: int):
+        if level == 0:
+            yield from node
+        else:
+            for child in node:
+                yield from self._iter_node(child, level - BITS)
+
+    def append(self, item) -> 'PVec':
+        """
+        :return: a new vector with the item added to the end.
+        """
+        if self.count - self._tail_start() < WIDTH:
+            return PVec._make(self.count + 1, self.shift, self.root, self.tail + (item,))
+        # the tail is full, so it moves into the trie
+        if (self.count >> BITS) > (1 << self.shift):
+            root = (self.root, _new_path(self.shift, self.tail))
+            shift = self.shift + BITS
+        else:
+            root = self._push_tail(self.shift, self.root)
+            shift = self.shift
+        return PVec._make(self.count + 1, shift, root, (item,))
+
+    def _push_tail(self, level: int, parent: tuple) -> tuple:
+        index = ((self.count - 1) >> level) & MASK
+        if level == BITS:
+            node = self.tail
+        elif index < len(parent):
+            node = self._push_tail(level - BITS, parent[index])
+        else:
+            node = _new_path(level - BITS, self.tail)
+        return parent[:index] + (node,) + parent[index + 1:]
+
+    def pop(self) -> ('PVec', Any):
+        """
+        :return: a new vector without the last item, and the last item.
+        """
+        if self.count == 0:
+            raise IndexError('pop from empty PVec')
+        item = self.tail[-1]
+        if self.count == 1:
+            return PVec(), item
+        if len(self.tail) > 1:
+            return PVec._make(self.count - 1, self.shift, self.root, self.tail[:-1]), item
+        # the tail is now empty, so the last leaf of the trie becomes the tail
+        tail = self._leaf(self.count - 2)
+        root = self._pop_tail(self.shift, self.root) or ()
+        shift = self.shift
+        if shift > BITS and len(root) == 1:
+            root = root[0]
+            shift -= BITS
+        return PVec._make(self.count - 1, shift, root, tail), item
+
+    def _pop_tail(self, level: int, node: tuple) -> Optional[tuple]:
+        index = ((self.count - 2) >> level) & MASK
+        if level > BITS:
+            child = self._pop_tail(level - BITS, node[index])
+            if child is None and index == 0:
+                return None
+            return node[:index] + ((child,) if child is not None else ())
+        elif index == 0:
+            return None
+        return node[:index]
+
+    def set(self, index: int, item) -> 'PVec':
+        """
+        :return: a new vector with the item at the index replaced.
+        """
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('PVec index out of range')
+        if index >= self._tail_start():
+            pos = index & MASK
+            return PVec._make(self.count, self.shift, self.root, self.tail[:pos] + (item,) + self.tail[pos + 1:])
+        return PVec._make(self.count, self.shift, _assoc(self.shift, self.root, index, item), self.tail)
+
+    def extend(self, items: Iterable) -> 'PVec':
+        """
+        :return: a new vector with the items added to the end.
+        """
+        vec = self
+        for item in items:
+            vec = vec.append(item)
+        return vec
+
+    def tolist(self) -> list:
+        return list(self)
+
+    def __add__(self, other):
+        if not isinstance(other, (PVec, list)):
+            return NotImplemented
+        return self.extend(other)
+
+    def __radd__(self, other):
+        if not isinstance(other, list):
+            return NotImplemented
+        return PVec(other).extend(self)
+
+    def __eq__(self, other):
+        if not isinstance(other, (PVec, list)):
+            return NotImplemented
+        return len(self) == len(other) and all(lhs == rhs for lhs, rhs in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"PVec({self.tolist()!r})"
+
+
+def _new_path(level: int, node: tuple) -> tuple:
+    for _ in range(0, level, BITS):
+        node = (node,)
+    return node
+
+
+def _assoc(level: int, node: tuple, index: int, item) -> tuple:
+    pos = (index >> level) & MASK
+    if level == 0:
+        return node[:pos] + (item,) + node[pos + 1:]
+    return node[:pos] + (_assoc(level - BITS, node[pos], index, item),) + node[pos + 1:]
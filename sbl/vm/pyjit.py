@@ -0,0 +1,374 @@
+# pyjit.py
+# Translates compiled SBL functions into Python functions.
+import string
+from sbl.vm.vm import *
+
+# The file name given to translated code, which shows up in Python tracebacks.
+JIT_FILE = '<sbl-jit>'
+
+# Python operators for the specialized integer instructions.
+INT_SOURCE_OPS = {
+    BCType.INT_ADD: ('+', 'INT'),
+    BCType.INT_SUB: ('-', 'INT'),
+    BCType.INT_MUL: ('*', 'INT'),
+    BCType.INT_EQ: ('==', 'BOOL'),
+    BCType.INT_NE: ('!=', 'BOOL'),
+    BCType.INT_LT: ('<', 'BOOL'),
+    BCType.INT_LE: ('<=', 'BOOL'),
+    BCType.INT_GT: ('>', 'BOOL'),
+    BCType.INT_GE: ('>=', 'BOOL'),
+}
+
+
+def meter_checks(limits: Optional[Limits]) -> Tuple[bool, bool, bool]:
+    """
+    :return: whether code checking `limits` counts instructions, checks the call depth, and checks the stack size.
+    """
+    if not limits:
+        return False, False, False
+    return bool(limits.instructions or limits.time), bool(limits.depth), bool(limits.stack)
+
+
+class Unstructured(Exception):
+    """
+    Raised when a function's jumps don't match the shapes the compiler emits for `br`, `el`, and `loop`.
+    """
+    pass
+
+
+def mangle(name: str) -> str:
+    """
+    Turns an SBL identifier into a Python identifier.
+    """
+    return ''.join(c if c in string.ascii_letters + string.digits else f"_{ord(c):x}_" for c in name)
+
+
+class FunSource:
+    """
+    The Python source of a single translated function. Each line remembers the instruction it came from, and the error
+    to raise if that line fails.
+    """
+    def __init__(self, fun: Fun, pyname: str):
+        self.fun = fun
+        self.pyname = pyname
+        self.lines = []
+
+    def emit(self, indent: int, text: str, pc: int=None, message: str=None):
+        self.lines += [(' ' * 4 * indent + text, pc, message)]
+
+
+class PyGen:
+    """
+    Generates Python source for a function table. Locals become Python variables, and `br`/`el`/`loop` become
+    `if`/`else`/`while`. Functions whose jumps can't be turned back into those are left out, and named in
+    `unstructured`.
+
+    The generated source expects these names to be defined around it:
+    * everything in sbl.vm.jitrt;
+    * `CONSTS`, a list of the values in `self.consts`;
+    * `FUNS`, a mapping of function names to functions (or anything with the same `name`, `meta`, and `bc[pc].meta`);
+    * a function named by `fallback` for each name in `unstructured`, taking a function and returning something callable
+      like a translated function, when there are any;
+    * `meter`, the VM's Meter, if the source is metered.
+    """
+    def __init__(self, funs: FunTable, builtins=BUILTINS, limits: Limits=None):
+        """
+        :param limits: the limits to check on calls and loops, like the interpreter does; none are checked if not given.
+        Only the checks for the limits that are set are generated, so the values of the limits can change.
+        """
+        self.funs = funs
+        self.builtins = builtins
+        # the checks to generate
+        self.counted, self.depth, self.sized = meter_checks(limits)
+        self.consts = []
+        self.callsites = {}
+        self.unstructured = set()
+
+    def generate(self) -> str:
+        sources = []
+        for fun in self.funs.values():
+            source = FunSource(fun, 'f_' + mangle(fun.name))
+            try:
+                self._gen_fun(source)
+            except Unstructured:
+                self.unstructured.add(fun.name)
+                continue
+            sources += [source]
+        out = []
+        for name in self.builtins:
+            out += [f"b_{mangle(name)} = BUILTINS[{repr(name)}]"]
+        for name in self.funs:
+            out += [f"fun_{mangle(name)} = FUNS[{repr(name)}]"]
+        for idx in range(len(self.consts)):
+            out += [f"k{idx} = CONSTS[{idx}]"]
+        for name in self.unstructured:
+            out += [f"f_{mangle(name)} = fallback(fun_{mangle(name)})"]
+        for callsite, name in self.callsites.items():
+            out += [f"{name} = {repr(callsite)}"]
+        for source in sources:
+            out += ['', '']
+            # keyed on the line's offset from the `def`, so the source can be placed anywhere in a file
+            lines = {}
+            for offset, (text, pc, message) in enumerate(source.lines):
+                out += [text]
+                if pc is not None:
+                    lines[offset] = (pc, message)
+            out += [f"lines_{source.pyname} = {repr(lines)}"]
+        return '\n'.join(out) + '\n'
+
+    def _const(self, val: Val) -> str:
+        for idx, const in enumerate(self.consts):
+            if const is val:
+                return f"k{idx}"
+        self.consts += [val]
+        return f"k{len(self.consts) - 1}"
+
+    def _callsite(self, fun: Fun, instr: BC) -> str:
+        callsite = f"`{fun.name}` at {instr.meta['file']}:{instr.meta['where']}"
+        if callsite not in self.callsites:
+            self.callsites[callsite] = f"cs{len(self.callsites)}"
+        return self.callsites[callsite]
+
+    def _gen_fun(self, source: FunSource):
+        name = source.pyname
+        source.emit(0, f"def {name}(state, callsite):")
+        source.emit(1, "stack = state.stack")
+        source.emit(1, "push = stack.append")
+        source.emit(1, "pop = stack.pop")
+        source.emit(1, "call_stack = state.call_stack")
+        source.emit(1, f"frame = Frame(fun_{mangle(source.fun.name)}, callsite)")
+        source.emit(1, "call_stack.append(frame)")
+        # charged here rather than through Meter.enter, which costs a call
+        self._gen_meter(source, len(source.fun.bc), 1, self.depth)
+        source.emit(1, "try:")
+        self._gen_range(source, 0, len(source.fun.bc), 2)
+        source.emit(1, "except (IndexError, NameError) as e:")
+        source.emit(2, f"raise translate_error(e, state, frame, {name}.__code__, lines_{name})")
+
+    def _gen_range(self, source: FunSource, start: int, end: int, indent: int):
+        bc = source.fun.bc
+        if start == end:
+            source.emit(indent, "pass")
+        pc = start
+        while pc < end:
+            instr = bc[pc]
+            if instr.code is BCType.JMPZ:
+                target = instr.val.val
+                last = bc[target - 1] if target - 1 > pc else None
+                if target <= pc or target > end:
+                    raise Unstructured()
+                elif last is not None and last.code is BCType.JMP and last.val.val == pc:
+                    # loop
+                    source.emit(indent, "while True:")
+                    self._gen_meter(source, target - pc, indent + 1, False, pc)
+                    self._gen_test(source, pc, indent + 1)
+                    source.emit(indent + 2, "break")
+                    self._gen_range(source, pc + 1, target - 1, indent + 1)
+                    pc = target
+                elif self._ends_el(bc, pc, target, end):
+                    # branch with an el block
+                    self._gen_test(source, pc, indent)
+                    self._gen_range(source, target, last.val.val, indent + 1)
+                    source.emit(indent, "else:")
+                    self._gen_range(source, pc + 1, target - 1, indent + 1)
+                    pc = last.val.val
+                else:
+                    self._gen_test(source, pc, indent)
+                    source.emit(indent + 1, "pass")
+                    source.emit(indent, "else:")
+                    self._gen_range(source, pc + 1, target, indent + 1)
+                    pc = target
+            elif instr.code is BCType.JMP:
+                raise Unstructured()
+            else:
+                self._gen_instr(source, pc, indent)
+                pc += 1
+
+    def _gen_meter(self, source: FunSource, count: int, indent: int, depth: bool, pc: int=None):
+        """
+        Emits a charge for `count` instructions, and a call to Meter.check if it may have broken a limit.
+        :param depth: whether to check the call depth.
+        :param pc: the instruction to report broken limits at, if the frame isn't at the right one already.
+        """
+        tests = []
+        if self.counted:
+            source.emit(indent, f"meter.count += {count}")
+            tests += ["meter.count >= meter.next_check"]
+        if depth:
+            tests += ["len(call_stack) > meter.max_depth"]
+        if self.sized:
+            tests += ["len(stack) > meter.max_stack"]
+        if tests:
+            source.emit(indent, f"if {' or '.join(tests)}:")
+            if pc is not None:
+                source.emit(indent + 1, f"frame.pc = {pc}")
+            source.emit(indent + 1, "meter.check(state)")
+
+    def _ends_el(self, bc: List[BC], pc: int, target: int, end: int) -> bool:
+        """
+        Whether the JMPZ at `pc` starts a `br` with an `el` block, rather than a `br` whose block ends in a nested `el`.
+        """
+        last = bc[target - 1]
+        if target - 1 <= pc or last.code is not BCType.JMP or not target <= last.val.val <= end:
+            return False
+        # a nested `br` also jumps to the target when the JMP ends its `el` block
+        return not any(bc[i].code is BCType.JMPZ and bc[i].val.val == target for i in range(pc + 1, target - 1))
+
+    def _gen_test(self, source: FunSource, pc: int, indent: int):
+        """
+        Emits an `if` that is taken when JMPZ would jump.
+        """
+        source.emit(indent, "tos = stack[-1]", pc, "could not compare to empty stack")
+        source.emit(indent, "if tos.type is NIL or (tos.type is BOOL and tos.val == False):")
+
+    def _gen_instr(self, source: FunSource, pc: int, indent: int):
+        fun = source.fun
+        instr = fun.bc[pc]
+        code = instr.code
+        emit = source.emit
+        if code is BCType.PUSH:
+            share = '.share()' if instr.val.frozen else ''
+            emit(indent, f"push({self._const(instr.val)}{share})")
+        elif code is BCType.LOAD:
+            emit(indent, f"push(l_{mangle(instr.val.val)})", pc, f"unknown local `{instr.val.val}`")
+        elif code is BCType.POP:
+            if instr.val.type is ValType.NIL:
+                emit(indent, "pop()", pc, "attempted to pop an empty stack")
+            else:
+                emit(indent, f"l_{mangle(instr.val.val)} = pop()", pc, "attempted to pop an empty stack")
+        elif code is BCType.POPN:
+            count = instr.val.val
+            if count > 0:
+                emit(indent, f"if len(stack) < {count}:")
+                emit(indent + 1, f"frame.pc = {pc}")
+                emit(indent + 1, f"raise VMError(f\"attempted to pop {count} items off of a stack with only "
+                                 f"{{len(stack)}} items\", state.vm, *state.current_loc())")
+                emit(indent, f"del stack[-{count}:]")
+        elif code is BCType.PUSHL:
+            emit(indent, "item = pop()", pc, "attempted to pop an empty stack")
+            emit(indent, "local = pop()", pc, "attempted to pop an empty stack")
+            emit(indent, "if local.type is not STACK:")
+            emit(indent + 1, f"frame.pc = {pc}")
+            emit(indent + 1, "raise VMError(f\"attempted to push values into non-stack item: {local.type}\", "
+                             "state.vm, *state.current_loc())")
+            emit(indent, "push(local.push_item(item))")
+        elif code is BCType.PUTL:
+            emit(indent, "item = pop()", pc, "attempted to pop an empty stack")
+            emit(indent, "key = pop()", pc, "attempted to pop an empty stack")
+            emit(indent, "local = pop()", pc, "attempted to pop an empty stack")
+            emit(indent, "if local.type is not MAP:")
+            emit(indent + 1, f"frame.pc = {pc}")
+            emit(indent + 1, "raise VMError(f\"attempted to put values into non-map item: {local.type}\", "
+                             "state.vm, *state.current_loc())")
+            emit(indent, "if key.type not in KEY_TYPES:")
+            emit(indent + 1, f"frame.pc = {pc}")
+            emit(indent + 1, "raise VMError(f\"map keys can not be {key.type.value}s\", state.vm, "
+                             "*state.current_loc())")
+            emit(indent, "local.thaw()")
+            emit(indent, "local.val[key] = item")
+            emit(indent, "push(local)")
+        elif code in INT_SOURCE_OPS:
+            op, ty = INT_SOURCE_OPS[code]
+            emit(indent, "rhs = pop()")
+            emit(indent, "lhs = pop()")
+            emit(indent, f"push(Val(lhs.val {op} rhs.val, {ty}))")
+        elif code is BCType.CALL:
+            name = instr.val.val
+            if name in self.builtins:
+                emit(indent, f"frame.pc = {pc}")
+                emit(indent, "try:")
+                emit(indent + 1, f"b_{mangle(name)}(state)")
+                emit(indent, "except VMError as e:")
+                emit(indent + 1, f"raise ChainedError({repr(f'builtin function `{name}`')}, e)")
+            elif name in self.funs:
+                emit(indent, f"f_{mangle(name)}(state, {self._callsite(fun, instr)})")
+            else:
+                # let the interpreter report it
+                raise Unstructured()
+        elif code is BCType.RET:
+            emit(indent, "call_stack.pop()")
+            emit(indent, "return")
+        else:
+            raise Unstructured()
+
+
+class JitCode:
+    """
+    A function table translated to Python and compiled. Translating is most of the cost of making a JitVM, so VMs
+    running the same program can share this; each VM runs it in a namespace of its own.
+    """
+    def __init__(self, funs: FunTable, builtins=BUILTINS, limits: Limits=None):
+        """
+        :param limits: the limits the translated code checks, if any.
+        """
+        gen = PyGen(funs, builtins, limits)
+        self.funs = funs
+        self.builtins = builtins
+        self.source = gen.generate()
+        self.code = compile(self.source, JIT_FILE, 'exec')
+        self.consts = gen.consts
+        self.unstructured = gen.unstructured
+        self._metered = {meter_checks(limits): self}
+
+    def metered(self, limits: Optional[Limits]) -> 'JitCode':
+        """
+        :return: this program, translated to check `limits`. Translations are kept, and shared by limits that set the
+        same kinds of limit.
+        """
+        checks = meter_checks(limits)
+        jit_code = self._metered.get(checks)
+        if jit_code is None:
+            # VMs on different threads may both translate it, which is only wasted time
+            jit_code = JitCode(self.funs, self.builtins, limits)
+            jit_code._metered = self._metered
+            self._metered[checks] = jit_code
+        return jit_code
+
+
+class JitVM(VM):
+    """
+    A VM that runs functions as generated Python code. Functions that can't be translated are interpreted.
+    """
+    def __init__(self, funs: FunTable, builtins=BUILTINS, output_buffer: int=OUTPUT_BUFFER, workers: int=0,
+                 chunk_size: int=0, limits: Limits=None, jit_code: JitCode=None):
+        """
+        :param jit_code: the program, already translated with the same builtins; it is translated here if not given.
+        """
+        if jit_code is None:
+            jit_code = JitCode(funs, builtins)
+        assert jit_code.funs is funs and jit_code.builtins is builtins
+        # programs run without limits don't pay for checking them
+        jit_code = jit_code.metered(limits)
+        namespace = {name: getattr(jitrt, name) for name in dir(jitrt) if not name.startswith('__')}
+        namespace.update({
+            'BUILTINS': builtins,
+            'CONSTS': jit_code.consts,
+            'FUNS': funs,
+            'fallback': lambda fun: lambda state, callsite: self._run_fun(fun, callsite),
+            'meter': None,
+        })
+        exec(jit_code.code, namespace)
+        # set up before the VM, since the translated code sees the VM's meter through it
+        self.namespace = namespace
+        super().__init__(funs, builtins, output_buffer=output_buffer, workers=workers, chunk_size=chunk_size,
+                         limits=limits)
+        self.source = jit_code.source
+        self.jitted = {name: namespace['f_' + mangle(name)] for name in funs if name not in jit_code.unstructured}
+
+    @property
+    def meter(self) -> Optional[Meter]:
+        return self.namespace['meter']
+
+    @meter.setter
+    def meter(self, meter: Optional[Meter]):
+        self.namespace['meter'] = meter
+
+    def _call_fun(self, fun: Fun, callsite):
+        jitted = self.jitted.get(fun.name)
+        if jitted is None:
+            self._run_fun(fun, callsite)
+        else:
+            jitted(self.state, callsite)
+
+
+from sbl.vm import jitrt
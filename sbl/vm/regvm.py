@@ -0,0 +1,189 @@
+# regvm.py
+# A register VM tier for hot functions.
+from sbl.vm.ir import *
+from sbl.vm.vm import *
+
+# How many times a function has to be called before it is translated to registers.
+HOT_CALLS = 2
+
+CONST = IROp.CONST
+MOV = IROp.MOV
+LOAD = IROp.LOAD
+INT = IROp.INT
+PUSHL = IROp.PUSHL
+PUTL = IROp.PUTL
+CALL = IROp.CALL
+CALL_INT = IROp.CALL_INT
+JMPZ = IROp.JMPZ
+JMP = IROp.JMP
+RET = IROp.RET
+
+
+class RegCode:
+    """
+    A function's IR, flattened for the register VM. Each instruction is an (op, dst, srcs, val, pc) tuple, with jumps
+    pointing at instruction indexes. CALL_INTs hold a (builtin, name, operator, result type) tuple, and CALLs hold a
+    (function, builtin, label, results) tuple, where exactly one of function and builtin is set, and label is the
+    builtin's name or the callsite of the function.
+    """
+    def __init__(self, ir: IRFun, instrs: List[tuple]):
+        self.ir = ir
+        self.need = ir.need
+        self.nregs = len(ir.names)
+        self.instrs = instrs
+
+
+class RegVM(VM):
+    """
+    A VM that runs hot functions in registers. Functions are interpreted until they have been called `hot_calls` times;
+    after that, they are translated to the register IR, optimized, and run by `_run_reg` from then on. Functions that
+    can't be translated are always interpreted. Locals of functions running in registers don't show up in state dumps.
+    """
+    def __init__(self, funs: FunTable, builtins=BUILTINS, hot_calls: int=HOT_CALLS, output_buffer: int=OUTPUT_BUFFER,
+                 workers: int=0, chunk_size: int=0, limits: Limits=None):
+        super().__init__(funs, builtins, output_buffer=output_buffer, workers=workers, chunk_size=chunk_size,
+                         limits=limits)
+        self.hot_calls = hot_calls
+        self.calls = {}
+        # None for functions that can't be translated
+        self.code = {}
+        self.builder = None
+
+    def _call_fun(self, fun: Fun, callsite):
+        code = self.code.get(fun.name)
+        if code is None and fun.name not in self.code:
+            calls = self.calls[fun.name] = self.calls.get(fun.name, 0) + 1
+            if calls >= self.hot_calls:
+                code = self.code[fun.name] = self.translate(fun)
+        if code is not None and len(self.state.stack) >= code.need:
+            self._run_reg(fun, code, callsite)
+        else:
+            self._run_fun(fun, callsite)
+
+    def translate(self, fun: Fun) -> Optional[RegCode]:
+        if self.builder is None:
+            self.builder = IRBuilder(self.funs, self.builtins)
+        ir = self.builder.build(fun)
+        if ir is None:
+            return None
+        optimize(ir)
+        starts = []
+        count = 0
+        for block in ir.blocks:
+            starts += [count]
+            count += len(block.instrs)
+        instrs = []
+        for block in ir.blocks:
+            for instr in block.instrs:
+                op = instr.op
+                val = instr.val
+                if op in [JMPZ, JMP]:
+                    val = starts[val]
+                elif op is CALL:
+                    name, results = val
+                    callsite = f"`{fun.name}` at {fun.bc[instr.pc].meta['file']}:{fun.bc[instr.pc].meta['where']}"
+                    if name in self.builtins:
+                        val = (None, self.builtins[name], name, results)
+                    else:
+                        val = (self.funs[name], None, callsite, results)
+                elif op is CALL_INT:
+                    name, operator, ty = val
+                    val = (self.builtins[name], name, operator, ty)
+                instrs += [(op, instr.dst, instr.srcs, val, instr.pc)]
+        return RegCode(ir, instrs)
+
+    def _run_reg(self, fun: Fun, code: RegCode, callsite):
+        state = self.state
+        meter = self.meter
+        state.push_fun(fun, callsite)
+        fun_state = self._fun_state()
+        if meter is not None:
+            meter.enter(state, len(code.instrs))
+        stack = state.stack
+        regs = [None] * code.nregs
+        need = code.need
+        if need:
+            regs[:need] = stack[len(stack) - need:]
+            del stack[len(stack) - need:]
+        instrs = code.instrs
+        ip = 0
+        while True:
+            op, dst, srcs, val, pc = instrs[ip]
+            ip += 1
+            if op is MOV:
+                regs[dst] = regs[srcs[0]]
+            elif op is CONST:
+                regs[dst] = val.share() if val.frozen else val
+            elif op is INT:
+                operator, ty = val
+                regs[dst] = Val(operator(regs[srcs[0]].val, regs[srcs[1]].val), ty)
+            elif op is CALL_INT:
+                lhs = regs[srcs[0]]
+                rhs = regs[srcs[1]]
+                builtin, name, operator, ty = val
+                if lhs.type is ValType.INT and rhs.type is ValType.INT:
+                    regs[dst] = Val(operator(lhs.val, rhs.val), ty)
+                else:
+                    fun_state.pc = pc
+                    stack.append(lhs)
+                    stack.append(rhs)
+                    self._call_builtin(name, builtin)
+                    regs[dst] = stack.pop()
+            elif op is CALL:
+                fun_state.pc = pc
+                for src in srcs:
+                    stack.append(regs[src])
+                callee, builtin, label, results = val
+                if builtin is None:
+                    self._call_fun(callee, label)
+                else:
+                    self._call_builtin(label, builtin)
+                if results:
+                    regs[dst:dst + results] = stack[len(stack) - results:]
+                    del stack[len(stack) - results:]
+            elif op is JMPZ:
+                tos = regs[srcs[0]]
+                if (tos.type is ValType.BOOL and tos.val == False) or tos.type is ValType.NIL:
+                    ip = val
+            elif op is JMP:
+                if meter is not None and val < ip:
+                    fun_state.pc = pc
+                    meter.tick(state, ip - val)
+                ip = val
+            elif op is LOAD:
+                item = regs[srcs[0]]
+                if item is None:
+                    fun_state.pc = pc
+                    raise VMError(f"unknown local `{fun.bc[pc].val.val}`", self, *state.current_loc())
+                regs[dst] = item
+            elif op is PUSHL:
+                local = regs[srcs[0]]
+                if local.type is not ValType.STACK:
+                    fun_state.pc = pc
+                    raise VMError(f"attempted to push values into non-stack item: {local.type}", self,
+                                  *state.current_loc())
+                regs[dst] = local.push_item(regs[srcs[1]])
+            elif op is PUTL:
+                local = regs[srcs[0]]
+                key = regs[srcs[1]]
+                if local.type is not ValType.MAP:
+                    fun_state.pc = pc
+                    raise VMError(f"attempted to put values into non-map item: {local.type}", self,
+                                  *state.current_loc())
+                if key.type not in KEY_TYPES:
+                    fun_state.pc = pc
+                    raise VMError(f"map keys can not be {key.type.value}s", self, *state.current_loc())
+                local.thaw()
+                local.val[key] = regs[srcs[2]]
+                regs[dst] = local
+            elif op is RET:
+                for src in srcs:
+                    stack.append(regs[src])
+                break
+        state.pop_fun()
+
+    def dump_funtable(self):
+        super().dump_funtable()
+        for code in self.code.values():
+            if code is not None:
+                printerr(code.ir)
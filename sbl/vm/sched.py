@@ -0,0 +1,234 @@
+# sched.py
+# Cooperative tasks and channels.
+#
+# The interpreter keeps SBL call frames on the Python stack, so every task but the main one runs on a thread of its own.
+# Only the task holding the turn ever runs, and it only gives the turn up when it yields, waits, or does I/O, so tasks
+# never need to lock anything else. A task doing I/O gives up the turn until its I/O is done, which lets any number of
+# slow files and pipes be read and written at once.
+import threading
+from collections import deque
+
+from sbl.common import *
+
+
+class TaskCancelled(BaseException):
+    """
+    Unwinds a task's thread when the program ends before it does.
+    """
+
+
+class Task:
+    """
+    A thread of SBL execution, with its own global stack and call stack.
+    """
+    def __init__(self, state):
+        self.state = state
+        self.thread = None
+        self.done = False
+        # tasks waiting for this one to finish
+        self.joiners = []
+        self.in_io = False
+
+    def __str__(self):
+        return f"<{'finished ' if self.done else ''}task>"
+
+
+class Channel:
+    """
+    A queue of values that tasks can send to and receive from. Senders wait while the queue is full, and receivers wait
+    while it is empty; once a channel is closed, nothing more can be sent, and receiving from an empty channel gives
+    None.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.items = deque()
+        self.closed = False
+        self.senders = []
+        self.receivers = []
+
+    def send(self, sched: 'Scheduler', item):
+        """
+        :raise ValueError: if the channel is closed.
+        """
+        while len(self.items) >= self.capacity and not self.closed:
+            sched.block(self.senders)
+        if self.closed:
+            raise ValueError('channel is closed')
+        self.items.append(item)
+        sched.wake(self.receivers)
+
+    def recv(self, sched: 'Scheduler') -> Any:
+        while not self.items and not self.closed:
+            sched.block(self.receivers)
+        if not self.items:
+            return None
+        sched.wake(self.senders)
+        return self.items.popleft()
+
+    def close(self, sched: 'Scheduler'):
+        self.closed = True
+        sched.wake(self.senders)
+        sched.wake(self.receivers)
+
+    def __str__(self):
+        return f"<{'closed ' if self.closed else ''}channel ({len(self.items)}/{self.capacity})>"
+
+
+class Scheduler:
+    """
+    Runs the tasks of a VM one at a time. Tasks that are ready to run take turns in the order they became ready. The
+    program ends when the main task does, cancelling any other tasks; an error in any task ends the program as well.
+    """
+    def __init__(self, vm):
+        self.vm = vm
+        self.cond = threading.Condition()
+        self.current = None
+        self.ready = deque()
+        self.tasks = []
+        # how many tasks are doing I/O; while any are, waiting for something isn't a deadlock
+        self.in_io = 0
+        self.error = None
+        self.cancelled = False
+        # set when the last task that could run finishes, leaving the rest waiting on each other
+        self.deadlocked = False
+
+    def run(self, fn: Callable[[], None]):
+        """
+        Runs the main task until it finishes.
+        :param fn: runs the main function on the VM's current state.
+        """
+        self.current = Task(self.vm.state)
+        try:
+            fn()
+        except TaskCancelled:
+            raise self.error from None
+        finally:
+            self._shutdown()
+
+    def spawn(self, state, fn: Callable[[], None]) -> Task:
+        """
+        Starts a task, which runs once the current task gives up its turn.
+        :param state: the task's VM state.
+        :param fn: runs the task on its state.
+        """
+        task = Task(state)
+        task.thread = threading.Thread(target=self._task_main, args=(task, fn), daemon=True)
+        self.tasks += [task]
+        with self.cond:
+            self.ready.append(task)
+        task.thread.start()
+        return task
+
+    def _task_main(self, task: Task, fn: Callable[[], None]):
+        try:
+            with self.cond:
+                self._wait_turn(task)
+            fn()
+        except TaskCancelled:
+            return
+        except BaseException as e:
+            with self.cond:
+                if self.error is None:
+                    self.error = e
+                self.cancelled = True
+                self.cond.notify_all()
+            return
+        with self.cond:
+            task.done = True
+            self.wake(task.joiners)
+            self._next()
+
+    def _shutdown(self):
+        with self.cond:
+            self.cancelled = True
+            self.cond.notify_all()
+        for task in self.tasks:
+            # tasks stuck in I/O are left to finish it on their own
+            if not task.in_io:
+                task.thread.join()
+
+    def _wait_turn(self, task: Task):
+        while self.current is not task:
+            # checked first, so that the main task reports the deadlock rather than another task's report of it
+            if self.deadlocked:
+                self.vm.state = task.state
+                raise VMError("deadlock: every task is waiting on a channel or another task", self.vm,
+                              *task.state.current_loc())
+            if self.cancelled:
+                raise TaskCancelled()
+            self.cond.wait()
+        if self.cancelled:
+            raise TaskCancelled()
+        self.vm.state = task.state
+
+    def _next(self):
+        if not self.ready and self.in_io == 0:
+            # only reached when a task finishes: `block` checks for this itself, and the main task is still waiting
+            # for something, so nothing is left that could wake it
+            self.deadlocked = True
+        self.current = self.ready.popleft() if self.ready else None
+        self.cond.notify_all()
+
+    def yield_(self):
+        """
+        Lets every other ready task run before the current one carries on.
+        """
+        if not self.ready:
+            return
+        with self.cond:
+            task = self.current
+            self.ready.append(task)
+            self._next()
+            self._wait_turn(task)
+
+    def join(self, task: Task):
+        while not task.done:
+            self.block(task.joiners)
+
+    def block(self, waiters: list):
+        """
+        Gives up the current task's turn until it is woken.
+        :param waiters: the list of tasks waiting for the same thing; the current task is added to it.
+        :raise VMError: if no other task can run, so nothing could ever wake this one.
+        """
+        with self.cond:
+            if not self.ready and self.in_io == 0:
+                raise VMError("deadlock: every task is waiting on a channel or another task", self.vm,
+                              *self.vm.state.current_loc())
+            task = self.current
+            waiters.append(task)
+            self._next()
+            self._wait_turn(task)
+
+    def wake(self, waiters: list):
+        """
+        Makes the tasks waiting for something ready to run again. Woken tasks check what they were waiting for again
+        when they get their turn.
+        """
+        with self.cond:
+            self.ready.extend(waiters)
+            waiters.clear()
+
+    def blocking(self, fn: Callable, *args) -> Any:
+        """
+        Does I/O, letting other tasks run until it is done. With only one task, the I/O is just done.
+        :return: what the I/O function returned.
+        """
+        if not self.tasks:
+            return fn(*args)
+        with self.cond:
+            task = self.current
+            task.in_io = True
+            self.in_io += 1
+            self._next()
+        try:
+            return fn(*args)
+        finally:
+            with self.cond:
+                task.in_io = False
+                self.in_io -= 1
+                if self.current is None:
+                    self.current = task
+                else:
+                    self.ready.append(task)
+                self._wait_turn(task)
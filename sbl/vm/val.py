@@ -1,5 +1,7 @@
 from enum import *
 
+from sbl.vm.pvec import PVec
+
 
 class ValType(Enum):
     INT = 'integer'
@@ -9,27 +11,119 @@ class ValType(Enum):
     NIL = 'nil'
     BOOL = 'bool'
     STACK = 'stack'
+    MAP = 'map'
+    ARRAY = 'array'
+    BUILDER = 'string builder'
+    BYTES = 'bytes'
+    FILE = 'file'
+    TASK = 'task'
+    CHANNEL = 'channel'
+
+
+# The types of values that can be used as map keys.
+KEY_TYPES = {ValType.INT, ValType.CHAR, ValType.STRING, ValType.NIL, ValType.BOOL}
 
 
 class Val:
-    def __init__(self, val, ty: ValType):
+    def __init__(self, val, ty: ValType, frozen: bool=False):
         assert isinstance(ty, ValType)
         self.val = val
         self.type = ty
+        # frozen stacks and maps share their contents with a constant, and have to be thawed before they are changed
+        self.frozen = frozen
+
+    def freeze(self) -> 'Val':
+        """
+        Marks this value as a constant, along with every stack or map inside of it. Only stacks and maps can be frozen;
+        persistent stacks are never changed in place, so they don't need to be.
+        :return: this value.
+        """
+        if self.type is ValType.STACK:
+            self.frozen = not isinstance(self.val, PVec)
+            for item in self.val:
+                item.freeze()
+        elif self.type is ValType.MAP:
+            self.frozen = True
+            for item in self.val.values():
+                item.freeze()
+        return self
+
+    def share(self) -> 'Val':
+        """
+        Gets a new value that shares the contents of this frozen value until it is thawed.
+        """
+        return Val(self.val, self.type, True)
+
+    def thaw(self):
+        """
+        Gives this value its own copy of its contents, if they are shared with a constant, so that it can be changed in
+        place. The copy is one level deep; stacks and maps inside of it stay shared until they are thawed themselves.
+        """
+        if not self.frozen:
+            return
+        if self.type is ValType.STACK:
+            self.val = [item.share() if item.frozen else item for item in self.val]
+        else:
+            self.val = {key: item.share() if item.frozen else item for key, item in self.val.items()}
+        self.frozen = False
+
+    def push_item(self, item: 'Val') -> 'Val':
+        """
+        Pushes an item onto this local stack.
+        :return: the stack with the item pushed. Persistent stacks are left alone, and a new value is returned; any
+        other stack is changed in place and returned.
+        """
+        if isinstance(self.val, PVec):
+            return Val(self.val.append(item), ValType.STACK)
+        self.thaw()
+        self.val.append(item)
+        return self
+
+    def pop_item(self) -> ('Val', 'Val'):
+        """
+        Pops the top item off of this local stack, which must not be empty.
+        :return: the stack without the item, in the same way as `push_item`, and the item.
+        """
+        if isinstance(self.val, PVec):
+            vec, item = self.val.pop()
+            return Val(vec, ValType.STACK), item
+        self.thaw()
+        return self, self.val.pop()
+
+    def set_item(self, index: int, item: 'Val') -> 'Val':
+        """
+        Replaces the item at an index of this local stack.
+        :return: the stack with the item replaced, in the same way as `push_item`.
+        """
+        if isinstance(self.val, PVec):
+            return Val(self.val.set(index, item), ValType.STACK)
+        self.thaw()
+        self.val[index] = item
+        return self
 
     def is_const(self) -> bool:
         if self.type in [ValType.INT, ValType.CHAR, ValType.STRING, ValType.NIL, ValType.BOOL]:
             return True
-        elif self.type is ValType.IDENT:
+        elif self.type in [ValType.IDENT, ValType.BUILDER, ValType.FILE, ValType.TASK, ValType.CHANNEL]:
             return False
+        elif self.type in [ValType.ARRAY, ValType.BYTES]:
+            return True
+        elif self.type is ValType.MAP:
+            return all(key.is_const() and val.is_const() for key, val in self.val.items())
         else:
             assert self.type is ValType.STACK
-            assert isinstance(self.val, list)
+            assert isinstance(self.val, (list, PVec, CharSeq))
             return all(map(Val.is_const, self.val))
 
     def __str__(self):
         if self.type is ValType.STACK:
             return '[' + str(', '.join(map(str, self.val))) + ']'
+        elif self.type is ValType.ARRAY:
+            return '<' + ', '.join(map(str, self.val.tolist())) + '>'
+        elif self.type is ValType.MAP:
+            return '(' + ', '.join(f"{key}: {val}" for key, val in self.val.items()) + ')'
+        elif self.type is ValType.BUILDER:
+            return ''.join(self.val)
         elif self.type is ValType.BOOL:
             return "T" if self.val else "F"
         else:
@@ -41,9 +135,51 @@ class Val:
         else:
             return f"Val({self.type.value} `{repr(self.val)}`)"
 
+    def __hash__(self):
+        if self.type not in KEY_TYPES:
+            raise TypeError(f"unhashable SBL value type: {self.type.value}")
+        return hash((self.type, self.val))
+
     def __eq__(self, other):
-        return self.type == other.type and \
+        if self.type is ValType.ARRAY:
+            # NumPy arrays compare elementwise
+            return isinstance(other, Val) and other.type is ValType.ARRAY and self.val.tolist() == other.val.tolist()
+        return isinstance(other, Val) and self.type == other.type and \
         (
             (self.val is not None and self.val == other.val) or
             self.val is None == other.val is None
         )
+
+
+class CharSeq:
+    """
+    The characters of a string, as the items of a read-only local stack. Character values are only made when they are
+    looked at, so turning a string into a stack doesn't cost anything up front. Stacks holding a CharSeq are frozen, so
+    they get a list of their own the first time they are changed.
+    """
+    def __init__(self, text: str):
+        self.text = text
+
+    def __len__(self):
+        return len(self.text)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Val(c, ValType.CHAR) for c in self.text[index]]
+        return Val(self.text[index], ValType.CHAR)
+
+    def __iter__(self):
+        return (Val(c, ValType.CHAR) for c in self.text)
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __eq__(self, other):
+        if isinstance(other, CharSeq):
+            return self.text == other.text
+        return list(self) == other
+
+    __hash__ = None
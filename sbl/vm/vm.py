@@ -1,13 +1,29 @@
+from sbl.vm.adaptive import Adaptive
+from sbl.vm.checkpoint import Checkpoint, Checkpointer
+from sbl.vm.memo import MemoCache
 from sbl.vm.compile import *
+from sbl.vm.files import FileTable, OUTPUT_BUFFER
 from sbl.vm.funs import BUILTINS
-from sbl.vm.val import Val, ValType
+from sbl.vm.limits import Limits, Meter
+from sbl.vm.sched import Scheduler
+from sbl.vm.pmap import Pool
+from sbl.vm.val import Val, ValType, KEY_TYPES
 
 
 class VMState:
-    def __init__(self, vm: 'VM'):
+    def __init__(self, vm: 'VM', output_buffer: int=OUTPUT_BUFFER):
         self.stack = []
         self.call_stack = []
         self.vm = vm
+        self.files = FileTable(output_buffer)
+
+    def fork(self) -> 'VMState':
+        """
+        Makes the state of a new task, which shares this state's files.
+        """
+        state = VMState(self.vm)
+        state.files = self.files
+        return state
 
     def load(self, name: str) -> Val:
         last = self.call_stack[-1]
@@ -23,9 +39,10 @@ class VMState:
         self.stack += [val]
 
     def pop(self) -> Val:
-        if len(self.stack) == 0:
+        try:
+            return self.stack.pop()
+        except IndexError:
             raise VMError(f"attempted to pop an empty stack", self.vm, *self.current_loc())
-        return self.stack.pop()
 
     def push_fun(self, fun: Fun, callsite):
         self.call_stack += [FunState(fun, callsite)]
@@ -61,79 +78,229 @@ class FunState:
 
 
 class VM:
-    def __init__(self, funs: FunTable, builtins=BUILTINS):
-        self.funs = funs
+    def __init__(self, funs: FunTable, builtins=BUILTINS, adaptive: bool=False, memo_size: int=0,
+                 output_buffer: int=OUTPUT_BUFFER, workers: int=0, chunk_size: int=0, limits: Limits=None,
+                 checkpoint: str=None, checkpoint_every: int=0):
+        """
+        :param funs: the compiled program.
+        :param builtins: the builtin functions available to the program.
+        :param adaptive: whether to quicken hot instructions at run-time. The VM makes its own copy of the program's
+        bytecode to rewrite.
+        :param memo_size: how many results of pure functions to cache; 0 disables memoization.
+        :param output_buffer: how many characters of standard output to buffer before writing them out.
+        :param workers: how many processes `pmap` spreads its calls across; 0 uses one per CPU, and 1 makes calls in
+        this process.
+        :param chunk_size: how many items `pmap` sends to a worker at a time; 0 picks a size for each stack.
+        :param limits: limits on each run of the program. Functions mapped by `pmap` in worker processes aren't limited.
+        :param checkpoint: the file to save checkpoints of each run to, for `run` to resume from later.
+        :param checkpoint_every: how many instructions to run between checkpoints, counted the way limits are; 0 only
+        saves them when the program calls `checkpoint`, or the process gets CHECKPOINT_SIGNAL.
+        """
         self.builtins = builtins
-        self.state = VMState(self)
+        self.state = VMState(self, output_buffer)
+        if adaptive:
+            self.funs = FunTable(**{name: fun.copy() for name, fun in funs.items()})
+            self.adaptive = Adaptive(self)
+        else:
+            self.funs = funs
+            self.adaptive = None
+        self.memo = MemoCache(self, memo_size) if memo_size > 0 else None
+        self.scheduler = None
+        self.pool = Pool(self, workers, chunk_size)
+        self.limits = limits
+        self.checkpointer = Checkpointer(self, checkpoint, checkpoint_every) if checkpoint is not None else None
+        # keeps track of the current run against the limits, if there are any, and of when to save checkpoints
+        self.meter = None
 
-    def run(self):
-        self._call('main', '<init>')
+    def run(self, fname: str='main', resume: Checkpoint=None):
+        """
+        Runs a function of the program on the current global stack, and then closes any files left open.
+        :param fname: the function to start from.
+        :param resume: a checkpoint saved by this program to carry on from, instead of starting a function.
+        """
+        files = self.state.files
+        self.scheduler = Scheduler(self)
+        checkpointer = self.checkpointer
+        stop_checkpoints = checkpointer.start() if checkpointer is not None else None
+        if self.limits or checkpointer is not None:
+            self.meter = Meter(self, self.limits or Limits(), checkpointer)
+        else:
+            self.meter = None
+        if resume is not None:
+            self.state.stack = resume.stack
+            start = lambda: self._resume(resume.frames)
+        else:
+            start = lambda: self._call(fname, '<init>')
+        try:
+            self.scheduler.run(start)
+        finally:
+            if stop_checkpoints is not None:
+                stop_checkpoints()
+            self.pool.shutdown()
+            files.close_all()
+
+    def callsite(self, fun_state: 'FunState', bc: BC) -> str:
+        return f"`{fun_state.name}` at {bc.meta['file']}:{bc.meta['where']}"
 
     def _call(self, fname: str, callsite):
         if fname not in self.funs and fname not in self.builtins:
             raise VMError(f"No such function: `{fname}`", self, *self.state.current_loc())
         if fname in self.builtins:
-            # call builtin function
-            try:
-                self.builtins[fname](self.state)
-            except VMError as e:
-                raise ChainedError(f'builtin function `{fname}`', e)
-            return
-        # call user-defined function
-        fun = self.funs[fname]
-        self.state.push_fun(fun, callsite)
-        fun_state = self._fun_state()
+            self._call_builtin(fname, self.builtins[fname])
+        else:
+            self._call_fun(self.funs[fname], callsite)
+
+    def _call_builtin(self, fname: str, builtin):
+        try:
+            builtin(self.state)
+        except VMError as e:
+            raise ChainedError(f'builtin function `{fname}`', e)
+
+    def _call_fun(self, fun: Fun, callsite):
+        if self.memo is not None and fun.pure:
+            self.memo.call(fun, callsite)
+        else:
+            self._run_fun(fun, callsite)
+
+    def _resume(self, frames: List[tuple]):
+        """
+        Carries on from the calls of a checkpoint, from the innermost out.
+        """
+        for name, callsite, pc, locals in frames:
+            self.state.push_fun(self.funs[name], callsite)
+            fun_state = self._fun_state()
+            fun_state.pc = pc
+            fun_state.locals = locals
+        resumed = list(self.state.call_stack)
+        self._run_fun(resumed[-1].fun, resumed[-1].callsite, resumed[-1])
+        for fun_state in reversed(resumed[:-1]):
+            # past the call to the function that just returned
+            fun_state.pc += 1
+            self._run_fun(fun_state.fun, fun_state.callsite, fun_state)
+
+    def _run_fun(self, fun: Fun, callsite, fun_state: FunState=None):
+        """
+        :param fun_state: the state of a call to carry on with, already on the call stack, rather than calling the
+        function afresh.
+        """
+        adaptive = self.adaptive
+        meter = self.meter
+        stack = self.state.stack
+        if fun_state is None:
+            self.state.push_fun(fun, callsite)
+            fun_state = self._fun_state()
+            if meter is not None:
+                meter.enter(self.state, len(fun.bc))
+            # functions that are proven to never underflow the stack skip the empty-stack checks, as long as they were
+            # called with as many items as they need
+            checked = fun.effect is None or len(stack) < fun.effect.need
+        else:
+            checked = True
+        pop = self.state.pop if checked else stack.pop
         while True:
             pc = fun_state.pc
             bc = fun.bc[pc]
-            if bc.code == BCType.PUSH:
-                self.state.push(bc.val)
+            code = bc.code
+            if code == BCType.PUSH:
+                val = bc.val
+                # constant stacks and maps are shared between runs, and only copied if they are changed
+                self.state.push(val.share() if val.frozen else val)
                 fun_state.pc += 1
-            elif bc.code == BCType.PUSHL:
-                item = self.state.pop()
-                stack = self.state.pop()
-                if stack.type is not ValType.STACK:
-                    raise VMError(f"attempted to push values into non-stack item: {stack.type}", self, bc.meta['file'],
+            elif code == BCType.PUSHL:
+                item = pop()
+                local = pop()
+                if local.type is not ValType.STACK:
+                    raise VMError(f"attempted to push values into non-stack item: {local.type}", self, bc.meta['file'],
                                   bc.meta['where'])
-                stack.val.append(item)
-                self.state.push(stack)
+                self.state.push(local.push_item(item))
                 fun_state.pc += 1
-            elif bc.code == BCType.POP:
-                item = self.state.pop()
+            elif code == BCType.POP:
+                item = pop()
                 if bc.val.type is not ValType.NIL:
                     self.state.store(bc.val.val, item)
                 fun_state.pc += 1
-            elif bc.code == BCType.POPN:
+            elif code == BCType.POPN:
                 assert bc.val.type is ValType.INT
-                if len(self.state.stack) < bc.val.val:
-                    raise VMError(f"attempted to pop {bc.val.val} items off of a stack with only {len(self.state.stack)}"
+                if checked and len(stack) < bc.val.val:
+                    raise VMError(f"attempted to pop {bc.val.val} items off of a stack with only {len(stack)} "
                                   "items", self, bc.meta['file'], bc.meta['where'])
-                self.state.stack = self.state.stack[0:len(self.state.stack) - bc.val.val]
+                del stack[len(stack) - bc.val.val:]
                 fun_state.pc += 1
-            elif bc.code == BCType.JMPZ:
+            elif code == BCType.JMPZ:
                 assert bc.val.type is ValType.INT
-                if len(self.state.stack) == 0:
+                if checked and len(stack) == 0:
                     raise VMError("could not compare to empty stack", self, bc.meta['file'], bc.meta['where'])
-                tos = self.state.stack[-1]
+                tos = stack[-1]
                 # only jmpz on on Nil and False values
                 if (tos.type is ValType.BOOL and tos.val == False) or tos.type is ValType.NIL:
                     fun_state.pc = bc.val.val
                 else:
                     fun_state.pc += 1
-            elif bc.code == BCType.JMP:
+            elif code == BCType.JMP:
                 assert bc.val.type is ValType.INT
+                # loops jump back to their test
+                if meter is not None and bc.val.val <= pc:
+                    meter.tick(self.state, pc - bc.val.val + 1)
                 fun_state.pc = bc.val.val
-            elif bc.code == BCType.CALL:
+            elif code == BCType.CALL:
                 assert bc.val.type is ValType.IDENT
-                self._call(bc.val.val, f"`{fun_state.name}` at {bc.meta['file']}:{bc.meta['where']}")
+                if adaptive:
+                    adaptive.observe(fun_state, bc, stack)
+                self._call(bc.val.val, self.callsite(fun_state, bc))
+                fun_state.pc += 1
+            elif code == BCType.CALL_FUN:
+                self._call_fun(*bc.cache)
+                fun_state.pc += 1
+            elif code == BCType.CALL_BUILTIN:
+                self._call_builtin(bc.val.val, bc.cache)
+                fun_state.pc += 1
+            elif code == BCType.CALL_INT:
+                if len(stack) >= 2 and stack[-1].type is ValType.INT and stack[-2].type is ValType.INT:
+                    op, ty = bc.cache
+                    rhs = stack.pop()
+                    lhs = stack.pop()
+                    stack.append(Val(op(lhs.val, rhs.val), ty))
+                else:
+                    adaptive.deopt(fun_state, bc)
+                    self._call(bc.val.val, self.callsite(fun_state, bc))
                 fun_state.pc += 1
-            elif bc.code == BCType.RET:
+            elif code == BCType.RET:
                 break
-            elif bc.code == BCType.LOAD:
+            elif code == BCType.LOAD:
                 assert bc.val.type is ValType.IDENT
+                if adaptive:
+                    adaptive.observe(fun_state, bc, stack)
                 val = self.state.load(bc.val.val)
                 self.state.push(val)
                 fun_state.pc += 1
+            elif code == BCType.LOAD_FAST:
+                locals = fun_state.locals
+                if bc.val.val in locals:
+                    stack.append(locals[bc.val.val])
+                else:
+                    adaptive.deopt(fun_state, bc)
+                    self.state.push(self.state.load(bc.val.val))
+                fun_state.pc += 1
+            elif code in INT_BINOPS:
+                # both operands were pushed by this function, so they are known to be there
+                op, ty = INT_BINOPS[code]
+                rhs = stack.pop()
+                lhs = stack.pop()
+                stack.append(Val(op(lhs.val, rhs.val), ty))
+                fun_state.pc += 1
+            elif code == BCType.PUTL:
+                val = pop()
+                key = pop()
+                local = pop()
+                if local.type is not ValType.MAP:
+                    raise VMError(f"attempted to put values into non-map item: {local.type}", self, bc.meta['file'],
+                                  bc.meta['where'])
+                if key.type not in KEY_TYPES:
+                    raise VMError(f"map keys can not be {key.type.value}s", self, bc.meta['file'], bc.meta['where'])
+                local.thaw()
+                local.val[key] = val
+                self.state.push(local)
+                fun_state.pc += 1
         self.state.pop_fun()
 
     def _fun_state(self):
@@ -141,7 +308,8 @@ class VM:
 
     def dump_funtable(self):
         for fun in self.funs:
-            printerr(f"{fun}:")
+            effect = self.funs[fun].effect
+            printerr(f"{fun}: {effect}" if effect else f"{fun}:")
             addr = 0
             for bc in self.funs[fun].bc:
                 printerr("{:05}".format(addr), bc)
@@ -164,3 +332,8 @@ class VM:
         printerr("stack:")
         for s in reversed(self.state.stack):
             printerr(f"{' '*4}{repr(s)}")
+
+        if self.adaptive:
+            self.adaptive.dump()
+        if self.memo:
+            self.memo.dump()
@@ -11,7 +11,7 @@ package = {
     'license': 'Apache 2',
     'packages': ['sbl'],
     'entry_points': {
-        'console_scripts': ['sbl=sbl.sbl:main']
+        'console_scripts': ['sbl=sbl.sbl:main', 'sblc=sbl.client:main']
     },
     'test_suite': 'nose.collector',
     'tests_require': 'nose',